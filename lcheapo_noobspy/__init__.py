@@ -1,5 +1,8 @@
 name = "lcheapo"
-from .lcheapo import (LCDataBlock, LCDiskHeader, LCDirEntry)
+from .lcheapo import (LCDataBlock, LCDiskHeader, LCDirEntry, LCFile,  # NOQA
+                      LCIndex, read_block_headers, block_times_msec,
+                      blocks_to_int32, iter_channel_samples, build_index,
+                      load_index, find_block, find_last_block)
 # import .sdpchain
 
 from .version import __version__
\ No newline at end of file
@@ -3,7 +3,7 @@
 """
 print out blocks with bad time header values
 """
-from lcheapo import (LCDataBlock, LCDiskHeader)
+from lcheapo import (LCDataBlock, LCDiskHeader, read_block_headers)
 
 fname = '../tests/data/BUGGY.raw.lch'
 
@@ -34,13 +34,13 @@ with open(fname, 'rb') as fp:
     _read_and_print_dataheader(fp, last_data_block, 'Last block')
 
     # Run through data blocks, printing out ones with bad times
+    headers = read_block_headers(fp, first_data_block,
+                                 last_data_block - first_data_block + 1)
     lcData = LCDataBlock()
-    lcData.seekBlock(fp, first_data_block)
     n_bad = 0
-    for i in range(first_data_block, last_data_block + 1):
-        lcData.readBlock(fp)
-        if lcData.year > 50:     # > 50 is 1950-1999
-            n_bad += 1
-            print(f'{i:10d}: ', end='')
-            lcData.prettyPrintHeader(annotated=True)
+    for i in (headers['year'] > 50).nonzero()[0]:     # > 50 is 1950-1999
+        n_bad += 1
+        lcData.readRecord(headers[i])
+        print(f'{first_data_block + i:10d}: ', end='')
+        lcData.prettyPrintHeader(annotated=True)
     print(f'{n_bad:d} bad header times')
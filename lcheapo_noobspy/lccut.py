@@ -4,6 +4,12 @@
 Cut an LCHEAPO file into pieces
 
 Used to remove bad/empty blocks, blocks start with 0 and are 512-bytes
+
+The section can also be given as a time window (--starttime, --endtime), it
+then starts and ends at whole channel 0-(n-1) block groups
+
+With --with-header, the section is written after a disk header and directory
+describing it, as in a raw LCHEAPO file
 """
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
@@ -11,18 +17,22 @@ from future.builtins import *  # NOQA @UnusedWildImport
 
 import argparse
 import copy
+import csv
+import json
 # import os
-from datetime import datetime as dt
 import sys
 from math import floor
 from pathlib import Path
 
+import numpy as np
+
 from . import sdpchain
 from .version import __version__
-# from .lcheapo import (LCDataBlock, LCDiskHeader, LCDirEntry)
+from .lcheapo import (LCFile, LCDirEntry, DIRBLOCKS, iter_blocks,
+                      copy_blocks, write_header_and_directory,
+                      find_last_block, parse_time, time_window_blocks)
 
 BLOCK_SIZE = 512
-MAX_BLOCK_READ = 2048   # max number of blocks to read at once
 
 
 def main():
@@ -31,61 +41,101 @@ def main():
 
     # GET ARGUMENTS
     args = getOptions()
+    in_path = Path(args.in_dir) / args.in_fname
 
-    # Verify output filename
-    if not args.output_file:
-        # Create output filename
-        base = Path(args.in_fname).stem
-        ext = Path(args.in_fname).suffix
-        args.output_file = f'{base}_{args.start:d}_{args.end:d}{ext}'
-    out_path = Path(args.out_dir) / args.output_file
-    if out_path.exists():
-        print('output file {out_path} exists already, quitting...')
-        sys.exit(2)
-
-    with open(Path(args.in_dir) / args.in_fname, 'rb') as fp:
-        # Set/validate last block to read
-        fp.seek(0, 2)   # End of file
-        last_file_block = floor(fp.tell()/BLOCK_SIZE)-1
-        if args.end:
-            if args.end > last_file_block:
-                args.end = last_file_block
-        else:
-            args.end = last_file_block
-        # Quit if start block is after EOF and/or end block
-        if args.start > last_file_block:
-            return_code = 2
-            msg = 'Error: --start block [{:d}] is beyond EOF [{:d}]'.format(
-                args.start, last_file_block)
+    # Convert times to block numbers and name the output files
+    windows = []
+    lcfile = None
+    if args.with_header:
+        lcfile = LCFile(in_path)
+        if lcfile.header is None:
+            msg = f'Error: {args.in_fname} has no disk header to copy'
             print(msg)
             exec_messages.append(msg)
-        elif args.start > args.end:
-            return_code = 3
-            msg = 'Error: --start block [{:d}] is beyond --end [{:d}]'.format(
-                args.start, args.end)
+            return_code = 4
+            args.windows = []
+    for start, end, starttime, endtime, output_file in args.windows:
+        if starttime or endtime:
+            if lcfile is None:
+                lcfile = LCFile(in_path)
+            try:
+                start, end, msg = time_window_blocks(
+                    lcfile, parse_time(starttime), parse_time(endtime))
+            except ValueError as e:
+                return_code = 4
+                msg = f'Error: {e}'
+                print(msg)
+                exec_messages.append(msg)
+                continue
             print(msg)
             exec_messages.append(msg)
-        else:
-            msg = 'Writing blocks {:d}-{:d} to {}'.format(
-                args.start, args.end, args.output_file)
+        if not output_file:
+            # Create output filename
+            base = Path(args.in_fname).stem
+            ext = Path(args.in_fname).suffix
+            output_file = f'{base}_{start:d}_{end:d}{ext}'
+        windows.append((start, end, output_file))
+
+    # Verify output filenames
+    out_files = [x[2] for x in windows]
+    for output_file in out_files:
+        out_path = Path(args.out_dir) / output_file
+        if out_path.exists():
+            print('output file {out_path} exists already, quitting...')
+            sys.exit(2)
+        if out_files.count(output_file) > 1:
+            print(f'output file {output_file} is given more than once, '
+                  'quitting...')
+            sys.exit(2)
+
+    with open(in_path, 'rb') as fp:
+        # Set/validate last block to read
+        fp.seek(0, 2)   # End of file
+        last_file_block = floor(fp.tell()/BLOCK_SIZE)-1
+        # Files read with their header stop at the last valid block
+        last_data_block = last_file_block
+        if lcfile is not None and lcfile.header is not None:
+            last_data_block = find_last_block(lcfile)
+        to_write = []
+        for start, end, output_file in windows:
+            if end:
+                if end > last_file_block:
+                    end = last_file_block
+            else:
+                end = last_data_block
+            # Skip if start block is after EOF and/or end block
+            if start > last_file_block:
+                return_code = 2
+                msg = 'Error: --start block [{:d}] is beyond EOF [{:d}]'\
+                    .format(start, last_file_block)
+            elif start > end:
+                return_code = 3
+                msg = 'Error: --start block [{:d}] is beyond --end [{:d}]'\
+                    .format(start, end)
+            else:
+                msg = 'Writing blocks {:d}-{:d} to {}'.format(
+                    start, end, output_file)
+                to_write.append((start, end, output_file))
             print(msg)
             exec_messages.append(msg)
-            with open(out_path, 'wb') as of:
-                start_block = args.start
-                fp.seek(start_block * BLOCK_SIZE, 0)
-                while start_block <= args.end:
-                    if (args.end-start_block+1) < MAX_BLOCK_READ:  # NEAR EOF
-                        of.write(fp.read((args.end
-                                          - start_block
-                                          + 1) * BLOCK_SIZE))
-                        break
-                    else:
-                        of.write(fp.read(MAX_BLOCK_READ * BLOCK_SIZE))
-                        start_block += MAX_BLOCK_READ
+        if not args.with_header:
+            _write_windows(fp, to_write, args.out_dir, args.channels)
+        elif to_write:      # Nothing to write if there is no disk header
+            out_block = lcfile.header.dataStart
+            _write_windows(fp, to_write, args.out_dir, args.channels,
+                           out_block)
+            for start, end, output_file in to_write:
+                with open(Path(args.out_dir) / output_file, 'r+b') as of:
+                    _write_header(lcfile, of, start, end)
+    if lcfile is not None:
+        lcfile.close()
     # Save/append process information to process_steps file
     global process_step
     process_step.messages = exec_messages
-    process_step.out_file = args.output_file
+    if len(args.windows) > 1:
+        process_step.output_files = [x[2] for x in to_write]
+    elif out_files:
+        process_step.out_file = out_files[0]
     process_step.exit_code = return_code
     process_step.write(args.in_dir, args.out_dir)
 
@@ -109,6 +159,31 @@ def getOptions():
     parser.add_argument("--end", type=int, default=0,
                         help=""" last block to write out (end of file if not
                         specified)""")
+    parser.add_argument("--starttime", default=None,
+                        help="""start time of the section to write out
+                        (ISO format, e.g. 2019-07-03T12:00:00), overrides
+                        --start""")
+    parser.add_argument("--endtime", default=None,
+                        help="""end time of the section to write out,
+                        overrides --end""")
+    parser.add_argument("--channels", type=int, nargs='+', default=None,
+                        help="""only write out these channels' blocks (the
+                        output file is then not a standard LCHEAPO file if
+                        channels are missing)""")
+    parser.add_argument("--range", dest="ranges", nargs=2, action='append',
+                        metavar=('START', 'END'), default=None,
+                        help="""block numbers or times of a section to write
+                        out (may be repeated).  Each section is written to
+                        its own file, in one pass over the input file""")
+    parser.add_argument("--manifest", default=None,
+                        help="""CSV (or JSON if it ends with .json) file of
+                        sections to write out: start and end block numbers
+                        or times, and optional output filename""")
+    parser.add_argument("--with-header", dest="with_header",
+                        action='store_true',
+                        help="""write the input file's disk header and a
+                        new directory before the data, so that the output
+                        is a complete LCHEAPO file""")
     parser.add_argument("-d", "--directory", dest="base_dir",
                         default='.', help="Base directory for files")
     parser.add_argument("-i", "--input", dest="in_dir", default='.',
@@ -116,6 +191,31 @@ def getOptions():
     parser.add_argument("-o", "--output", dest="out_dir", default='.',
                         help="path for output files (abs, or rel to base)")
     args = parser.parse_args()
+    for t in (args.starttime, args.endtime):
+        try:
+            parse_time(t)
+        except ValueError:
+            parser.error(f'invalid time: {t}')
+    if args.with_header and args.channels is not None:
+        parser.error('--with-header cannot be used with --channels')
+    windows = []
+    if args.ranges or args.manifest:
+        if args.start or args.end or args.starttime or args.endtime:
+            parser.error('--range and --manifest cannot be used with --start, '
+                         '--end, --starttime or --endtime')
+        try:
+            if args.manifest:
+                windows.extend(_read_manifest(args.manifest))
+            windows.extend(_window(*x) for x in args.ranges or [])
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        if args.output_file and len(windows) > 1:
+            parser.error('--of can only be used with one section')
+        if args.output_file:
+            windows = [windows[0][:4] + (args.output_file,)]
+    else:
+        windows.append((args.start, args.end, args.starttime, args.endtime,
+                        args.output_file))
     global process_step
     process_step = sdpchain.ProcessStep(
         'lccut',
@@ -124,8 +224,124 @@ def getOptions():
         app_version=__version__,
         parameters=args)
     args.in_dir, args.out_dir = sdpchain.setup_paths(args)
+    args.windows = windows
     return args
 
 
+def _window(start, end, output_file=''):
+    """
+    Make a section to write out from its start, end and output filename
+
+    :param start: start block number or time (str, empty for start of file)
+    :param end: end block number or time (str, empty for end of file)
+    :returns: (start block, end block, starttime, endtime, output_file),
+        with the block numbers set to 0 if times are given
+    :raises ValueError: if start or end is not a block number or a time
+    """
+    start, end = str(start).strip(), str(end).strip()
+    if all(x.isdigit() or not x for x in (start, end)):
+        return (int(start or 0), int(end or 0), None, None, output_file)
+    for t in (start, end):
+        if t.isdigit():
+            raise ValueError(f'mixed block number and time: {start}, {end}')
+        parse_time(t or None)
+    return (0, 0, start or None, end or None, output_file)
+
+
+def _read_manifest(fname):
+    """
+    Read the sections to write out from a CSV or JSON manifest
+
+    CSV files have one start,end[,output_file] line per section, lines
+    starting with '#' and a "start,end..." header line are skipped.  JSON
+    files hold a list of [start, end(, output_file)] lists or of
+    {"start": , "end": , "output_file": } objects.
+
+    :returns: list of sections, see _window()
+    """
+    with open(fname, 'r') as fp:
+        if str(fname).endswith('.json'):
+            rows = json.load(fp)
+        else:
+            rows = [x for x in csv.reader(fp)
+                    if x and not x[0].startswith('#')
+                    and x[0].strip().lower() != 'start']
+    windows = []
+    for row in rows:
+        if isinstance(row, dict):
+            row = [row.get('start', ''), row.get('end', ''),
+                   row.get('output_file', '')]
+        windows.append(_window(*[str(x).strip() for x in row[:3]]))
+    return windows
+
+
+def _write_windows(fp, windows, out_dir, channels=None, out_block=0):
+    """
+    Write out sections of the input file in one pass
+
+    The sections are sorted and overlapping sections are read together.
+    Sections read alone are copied by the kernel where possible (see
+    lcheapo.copy_blocks()), the others are read in chunks, which are written
+    to each section that they overlap.
+
+    :param fp: input file pointer
+    :param windows: list of (first block, last block, output filename)
+    :param out_dir: output directory
+    :param channels: only write out these channels' blocks (all if None)
+    :param out_block: output block to write each section's first block to
+    """
+    spans = []      # [first block, last block, windows]
+    for window in sorted(windows):
+        if spans and window[0] <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], window[1])
+            spans[-1][2].append(window)
+        else:
+            spans.append([window[0], window[1], [window]])
+    for first, last, span_windows in spans:
+        ofps = [open(Path(out_dir) / x[2], 'wb') for x in span_windows]
+        try:
+            if len(ofps) == 1 and channels is None:
+                copy_blocks(fp, ofps[0], first, last - first + 1, out_block)
+                continue
+            for of in ofps:
+                of.seek(out_block * BLOCK_SIZE)
+            for block, blocks in iter_blocks(fp, first, last - first + 1):
+                chunk_last = block + len(blocks) - 1
+                for (start, end, _), of in zip(span_windows, ofps):
+                    if start > chunk_last or end < block:
+                        continue
+                    part = blocks[max(start - block, 0):end - block + 1]
+                    if channels is not None:
+                        part = part[np.isin(part['muxChannel'], channels)]
+                    of.write(part.data)
+        finally:
+            for of in ofps:
+                of.close()
+
+
+def _write_header(lcfile, of, first, last):
+    """
+    Write the disk header and directory of a section written at dataStart
+
+    The header is the input file's, the directory entries have the times of
+    the blocks that they point to and the other values of the input file's
+    first entry.
+
+    :param lcfile: the input file
+    :type  lcfile: :class: `lcheapo:LCFile`
+    :param of: output file pointer
+    :param first: section's first block in the input file
+    :param last: section's last block in the input file
+    """
+    lcDir = None
+    if len(lcfile.directory):
+        lcDir = LCDirEntry()
+        lcDir.readRecord(lcfile.directory[0])
+    n_blocks = last - first + 1
+    dir_times = [lcfile.getBlock(first + x).getDateTime()
+                 for x in range(0, n_blocks, DIRBLOCKS)]
+    write_header_and_directory(of, lcfile.header, n_blocks, dir_times, lcDir)
+
+
 if __name__ == '__main__':
     main()
@@ -6,26 +6,42 @@ Dump record information from an LCHEAPO file
 # from __future__ import (absolute_import, division, print_function,
 #                         unicode_literals)
 # from future.builtins import *  # NOQA @UnusedWildImport
-from pathlib import Path
 
 import sys
 import argparse
 import datetime as dt
 
-from .lcheapo import (LCDiskHeader, LCDirEntry, LCDataBlock)
+import numpy as np
+
+from .lcheapo import (LCDirEntry, LCFile, MAX_BLOCK_READ, BOGUS_MSEC,
+                      iter_blocks, block_times_msec, format_block_headers,
+                      hex_dump_blocks, parse_time, time_window_blocks)
 
 
 # ------------------------------------
 # Global Variable Declarations
 # ------------------------------------
 PROGRAM_NAME = "lcdump"
-VERSION = "0.2.3"
+VERSION = "0.3"
 version_notes = """
     v0.2 (2015/01): WCC added format options
     v0.2.1 (2017/01): WCC added possibility to compare time with theoretical
     v0.2.2 (2017/03): WCC added directory printing
     v0.2.3 (2017/03): Added "--from_end" option
+    v0.3 (2026/10): time_verify (-f 3) is vectorized, uses the header's
+                    number of channels and only prints deviating blocks,
+                    followed by a summary.  Blocks are formatted and
+                    written in chunks.  Added "--export",
+                    "--starttime" and "--endtime" options
     """
+VERIFY_CHUNK_BLOCKS = 32 * MAX_BLOCK_READ   # blocks time-verified at once
+DUMP_CHUNK_BLOCKS = MAX_BLOCK_READ   # blocks formatted at once
+EXPORT_CHUNK_BLOCKS = 32 * MAX_BLOCK_READ   # blocks exported at once
+# Exported block header values (--export)
+EXPORT_DTYPE = np.dtype([('block', '<i8'), ('time_msec', '<i8'),
+                         ('muxChannel', 'u1'), ('blockFlag', 'u1'),
+                         ('numberOfSamples', '<u2'), ('U1', 'u1'),
+                         ('U2', 'u1')])
 
 
 def getOptions():
@@ -34,9 +50,9 @@ def getOptions():
     """
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("inFilename", help="LCHEAPO file name")
-    parser.add_argument("startBlock", type=int, default=5000,
+    parser.add_argument("startBlock", type=int, default=5000, nargs='?',
                         help="block at which to start dump")
-    parser.add_argument("nBlocks", type=int, default=10,
+    parser.add_argument("nBlocks", type=int, default=10, nargs='?',
                         help="number of blocks to dump")
     parser.add_argument("-r", "--from_end", default=False, action="store_true",
                         help="Count startBlocks back from end of file")
@@ -49,7 +65,21 @@ def getOptions():
     parser.add_argument("-f", "--format", type=int, default=0,
                         choices=[0, 1, 2, 3],
                         help="Output format: 0=pretty [default], 1=decimal,\
-                        2=hex, 3=time_verify")
+                        2=hex, 3=time_verify (only prints blocks whose time\
+                        differs from the expected one, then a summary)")
+    parser.add_argument("--starttime", type=parse_time, default=None,
+                        help="dump from the block group holding this time "
+                             "(ISO format, UTC) instead of startBlock")
+    parser.add_argument("--endtime", type=parse_time, default=None,
+                        help="dump to the block group holding this time "
+                             "(ISO format, UTC) instead of nBlocks")
+    parser.add_argument("--export", choices=['csv', 'jsonl', 'npy'],
+                        default=None,
+                        help="export the block headers (block number, time "
+                             "in ms since 1970, channel, flag, number of "
+                             "samples, U1, U2) instead of printing them")
+    parser.add_argument("--of", dest="out_file", default=None,
+                        help="export file (default: standard output)")
     args = parser.parse_args()
 
     # Get the filename (the arguments)
@@ -64,36 +94,52 @@ def main():
 
     args = getOptions()
 
+    time_window = args.starttime is not None or args.endtime is not None
+    read_header = (args.printHeader or (args.format == 3)
+                   or args.printDirectory or time_window)
+    lcfile = LCFile(args.inFilename, read_header=read_header)
     if args.from_end is True:
-        args.startBlock = int(Path(args.inFilename).stat().st_size/512)-args.startBlock
+        args.startBlock = lcfile.n_blocks - args.startBlock
+    if time_window:
+        try:
+            start, end, msg = time_window_blocks(lcfile, args.starttime,
+                                                 args.endtime)
+        except ValueError as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        args.startBlock, args.nBlocks = start, end - start + 1
+
+    if args.export:
+        if args.out_file is None:
+            _export_headers(lcfile, args.startBlock, args.nBlocks,
+                            args.export, sys.stdout.buffer)
+        else:
+            with open(args.out_file, 'wb') as fp:
+                _export_headers(lcfile, args.startBlock, args.nBlocks,
+                                args.export, fp)
+        lcfile.close()
+        return
 
-    fp = open(args.inFilename, 'rb')
-    if args.printHeader or (args.format == 3) or args.printDirectory:
-        lcHeader = LCDiskHeader()
-        lcHeader.readHeader(fp)
+    if read_header:
+        lcHeader = lcfile.header
         if args.printHeader:
             lcHeader.printHeader()
         if args.printDirectory:
             lcDir = LCDirEntry()
-            lcDir.seekBlock(fp, lcHeader.dirStart)
-            iDir = 0
             print("="*80)
             print(" {:25s} {:8s} {:15s} {:10s} {:12s} {:11s} {}".format(
                 "DateTime", "MuxChan", "SPS", "block#",
                 "numBlocks", "recordLen", "Flag"))
             print("="*80)
-            while iDir < lcHeader.dirCount:
-                lcDir.readDirEntry(fp)
+            for rec in lcfile.directory:
+                lcDir.readRecord(rec)
                 print(lcDir)
-                iDir = iDir + 1
 
     if args.format == 3:
         firstBlock = lcHeader.dataStart
         if firstBlock == 0:   # normal start block
             firstBlock = 2393
-        lcStartData = LCDataBlock()
-        lcStartData.seekBlock(fp, firstBlock)
-        lcStartData.readBlock(fp)
+        lcStartData = lcfile.getBlock(firstBlock)
         firstTime = dt.datetime(lcStartData.year+2000,
                                 lcStartData.month,
                                 lcStartData.day,
@@ -111,39 +157,187 @@ def main():
               "BLOCK", "CH", "EXPECTED TIME", "FOUND TIME", "DELTA"))
         print("-{:->7s}:-{:-^2s}-|-{:-^23s}-|-{:-^23s}-|-{:->8s}-".format(
               "-", "-", "-", "-", "-"))
+        _print_time_verify_summary(*_time_verify(
+            lcfile, firstBlock, args.startBlock, args.nBlocks, sampRate,
+            lcHeader.numberOfChannels))
+        lcfile.close()
+        return
+
+    _dump_blocks(lcfile, args.startBlock, args.nBlocks, args.format)
+    lcfile.close()
+
+
+def _dump_blocks(lcfile, startBlock, nBlocks, format):
+    """
+    Print block headers (formats 0 and 1) or data (format 2)
+
+    Blocks are formatted DUMP_CHUNK_BLOCKS at a time and each chunk is
+    written at once
 
-    block = args.startBlock
-    lcData = LCDataBlock()
-    lcData.seekBlock(fp, block)
-
-    for i in range(0, args.nBlocks):
-        lcData.readBlock(fp)
-        print("{:8d}:".format(args.startBlock + i), end=' ')
-        if args.format == 3:
-            time = dt.datetime(lcData.year + 2000,
-                               lcData.month,
-                               lcData.day,
-                               lcData.hour,
-                               lcData.minute,
-                               lcData.second,
-                               lcData.msec * 1000)
-            rec_offset = int((args.startBlock + i - firstBlock) / 4)
-            calcTime = firstTime + dt.timedelta(
-                       seconds=rec_offset*lcData.numberOfSamples/sampRate)
-            print("{:2d} | {} | {} | {:8.3f}".format(
-                lcData.muxChannel,
-                calcTime.strftime('%Y/%m/%d-%H:%M:%S.%f')[:-3],
-                time.strftime('%Y/%m/%d-%H:%M:%S.%f')[:-3],
-                (time-calcTime).total_seconds())
-            )
-        elif args.format == 1:
-            lcData.printDecimalDumpOfHeader(True)
-        elif args.format == 2:
-            lcData.printHexDumpOfData()
-        elif args.format == 0:
-            lcData.prettyPrintHeader()
+    :param lcfile: the LCHEAPO file
+    :type  lcfile: :class: `lcheapo:LCFile`
+    :param startBlock: first block to dump
+    :param nBlocks: number of blocks to dump (stops at the end of file)
+    :param format: output format (0=pretty, 1=decimal, 2=hex)
+    """
+    for block, blocks in iter_blocks(lcfile, startBlock, max(nBlocks, 0),
+                                     DUMP_CHUNK_BLOCKS):
+        if format == 1:
+            texts = [x + '\n' for x in format_block_headers(
+                blocks, 'decimal', annotated=True)]
+        elif format == 2:
+            texts = hex_dump_blocks(blocks)
+        else:
+            texts = [x + '\n' for x in format_block_headers(blocks)]
+        sys.stdout.write(''.join(["{:8d}: {}".format(*x) for x in zip(
+            range(block, block + len(blocks)), texts)]))
+
+
+def _export_headers(lcfile, startBlock, nBlocks, export, fp):
+    """
+    Write block header values in a machine-readable format
+
+    The values are those of EXPORT_DTYPE.  Blocks are decoded and written
+    EXPORT_CHUNK_BLOCKS at a time.
+
+    :param lcfile: the LCHEAPO file
+    :type  lcfile: :class: `lcheapo:LCFile`
+    :param startBlock: first block to export
+    :param nBlocks: number of blocks to export (stops at the end of file)
+    :param export: 'csv' (with a header line), 'jsonl' (one object per
+        block) or 'npy' (numpy structured array of EXPORT_DTYPE)
+    :param fp: binary output file pointer
+    """
+    nBlocks = max(min(nBlocks, lcfile.n_blocks - startBlock), 0)
+    names = EXPORT_DTYPE.names
+    if export == 'csv':
+        fp.write((','.join(names) + '\n').encode())
+        fmt = ','.join(['{}'] * len(names)) + '\n'
+    elif export == 'jsonl':
+        fmt = '{{' + ', '.join(['"{}": {{}}'.format(x) for x in names]) \
+            + '}}\n'
+    else:
+        np.lib.format.write_array_header_1_0(fp, {
+            'descr': np.lib.format.dtype_to_descr(EXPORT_DTYPE),
+            'fortran_order': False, 'shape': (nBlocks,)})
+    for block, blocks in iter_blocks(lcfile, startBlock, nBlocks,
+                                     EXPORT_CHUNK_BLOCKS):
+        values = np.empty(len(blocks), dtype=EXPORT_DTYPE)
+        values['block'] = np.arange(block, block + len(blocks))
+        values['time_msec'] = block_times_msec(blocks)
+        for name in names[2:]:
+            values[name] = blocks[name]
+        if export == 'npy':
+            fp.write(values.tobytes())
         else:
-            print("ERROR! Shouldn't get here!")
+            fp.write(''.join([fmt.format(*x) for x in zip(
+                *[values[x].tolist() for x in names])]).encode())
+
+
+def _time_verify(lcfile, firstBlock, startBlock, nBlocks, sampRate,
+                 nChannels):
+    """
+    Print the blocks whose time differs from the expected one
+
+    The expected time of a block is the first data block's time plus the
+    length of the channel groups between them.  Blocks are processed in
+    chunks of VERIFY_CHUNK_BLOCKS, so any number of blocks can be checked.
+    Blocks before firstBlock (disk header and directory) are not checked.
+    A block deviates if its time is at least half a millisecond from the
+    expected time.  Blocks with impossible times are counted apart, and
+    left out of the offset statistics.
+
+    :param lcfile: the LCHEAPO file
+    :type  lcfile: :class: `lcheapo:LCFile`
+    :param firstBlock: first data block (the time reference)
+    :param startBlock: first block to check
+    :param nBlocks: number of blocks to check (stops at the end of file)
+    :param sampRate: sampling rate
+    :param nChannels: number of channels
+    :returns: number of blocks checked, number of blocks with impossible
+        times, number of deviating blocks, sum of their offsets, their
+        largest offset (seconds) and the list of deviation runs
+        [first block, last block, min offset, max offset]
+    """
+    first_usec = int(block_times_msec(lcfile.headers[firstBlock:firstBlock
+                                                     + 1])[0]) * 1000
+    if startBlock < firstBlock:
+        nBlocks -= firstBlock - startBlock
+        startBlock = firstBlock
+    n_checked, n_bogus, n_dev, sum_dev, max_dev, runs = 0, 0, 0, 0., 0., []
+    for block, blocks in iter_blocks(lcfile, startBlock, max(nBlocks, 0),
+                                     VERIFY_CHUNK_BLOCKS):
+        block_nums = np.arange(block, block + len(blocks))
+        found_msec = block_times_msec(blocks)
+        bogus = found_msec == BOGUS_MSEC
+        found_usec = found_msec * 1000
+        # Truncated like int((block - firstBlock) / nChannels)
+        rec_offset = np.trunc((block_nums - firstBlock) / nChannels)
+        calc_usec = first_usec + np.rint(
+            rec_offset * blocks['numberOfSamples'] * 1e6 / sampRate
+            ).astype(np.int64)
+        delta = (found_usec - calc_usec) / 1e6
+        n_checked += len(blocks)
+        n_bogus += int(bogus.sum())
+        bad = np.flatnonzero((np.abs(delta) >= 0.0005) & ~bogus)
+        if len(bad) == 0:
+            continue
+        _print_time_deviations(block_nums[bad], blocks['muxChannel'][bad],
+                               calc_usec[bad], found_usec[bad], delta[bad])
+        n_dev += len(bad)
+        sum_dev += delta[bad].sum()
+        i_max = np.argmax(np.abs(delta[bad]))
+        if abs(delta[bad][i_max]) > abs(max_dev):
+            max_dev = float(delta[bad][i_max])
+        # Runs of consecutive deviating blocks
+        starts = np.flatnonzero(np.diff(bad) != 1) + 1
+        for a, b in zip(np.r_[0, starts], np.r_[starts, len(bad)]):
+            run = [int(block_nums[bad[a]]), int(block_nums[bad[b - 1]]),
+                   float(delta[bad[a:b]].min()), float(delta[bad[a:b]].max())]
+            if runs and runs[-1][1] == run[0] - 1:   # continued from chunk
+                runs[-1] = [runs[-1][0], run[1], min(runs[-1][2], run[2]),
+                            max(runs[-1][3], run[3])]
+            else:
+                runs.append(run)
+    return n_checked, n_bogus, n_dev, sum_dev, max_dev, runs
+
+
+def _print_time_deviations(block_nums, channels, calc_usec, found_usec,
+                           deltas):
+    """
+    Print time_verify lines for a set of blocks
+    """
+    def _time_strings(usec):
+        # Same as strftime('%Y/%m/%d-%H:%M:%S.%f')[:-3]
+        strs = np.datetime_as_string(usec.astype('datetime64[us]'), unit='ms')
+        return [x.replace('-', '/').replace('T', '-') for x in strs.tolist()]
+
+    lines = ["{:8d}: {:2d} | {} | {} | {:8.3f}".format(*x) for x in zip(
+        block_nums.tolist(), channels.tolist(), _time_strings(calc_usec),
+        _time_strings(found_usec), deltas.tolist())]
+    print('\n'.join(lines))
+
+
+def _print_time_verify_summary(n_checked, n_bogus, n_dev, sum_dev, max_dev,
+                               runs):
+    """
+    Print the summary of a time verification
+    """
+    print("-" * 80)
+    print("{:d} blocks checked, {:d} deviate from the expected time".format(
+          n_checked, n_dev))
+    if n_bogus:
+        print("{:d} blocks have impossible times".format(n_bogus))
+    if n_dev == 0:
+        return
+    print("Max offset = {:.3f} s, mean offset = {:.3f} s".format(
+          max_dev, sum_dev / n_dev))
+    print("{:d} deviation runs:".format(len(runs)))
+    print(" {:>8s} {:>8s} {:>8s} | {:>14s} {:>14s}".format(
+          "FIRST", "LAST", "NBLOCKS", "MIN OFFSET", "MAX OFFSET"))
+    for first, last, run_min, run_max in runs:
+        print(" {:8d} {:8d} {:8d} | {:14.3f} {:14.3f}".format(
+              first, last, last - first + 1, run_min, run_max))
 
 
 # Run 'main' if the script is not imported as a module
@@ -16,10 +16,24 @@ import queue
 import os
 import textwrap
 import logging      # for logging information
+import heapq
+import collections
+import bisect
+import json
+import copy
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
 from pathlib import Path
 
-from .lcheapo import (LCDataBlock, LCDiskHeader, LCDirEntry)
+import numpy as np
+
+from .lcheapo import (LCDataBlock, LCDiskHeader, LCDirEntry, LCFile,
+                      BLOCK_SIZE, BLOCK_HEADER_DTYPE, INDEX_SUFFIX,
+                      DIRBLOCKS, BAD_DIRBLOCKS,
+                      INDEX_BAD_HEADER, iter_blocks, copy_blocks,
+                      block_times_msec, msec_to_datetime, datetime_to_msec,
+                      write_header_and_directory, find_last_block)
 from . import sdpchain
 from .version import __version__
 
@@ -27,6 +41,8 @@ from .version import __version__
 # Global Variable Declarations
 # ------------------------------------
 warnings = 0  # count # of warnings
+# Blocks read before a shard to find each channel's previous block
+SHARD_TAIL_BLOCKS = 256
 
 
 class BugCounters():
@@ -90,7 +106,7 @@ class BugCounters():
 
 
 def main():
-    global warnings
+    global warnings, process_step
     # Prepare variables
     counters = BugCounters()
     n_files = 0
@@ -103,6 +119,18 @@ def main():
     commandQ = queue.Queue(0)
     responseQ = queue.Queue(0)
 
+    if args.undo:
+        fname = args.input_files[0]
+        msg = _undo_in_place(
+            os.path.join(args.in_dir, fname),
+            os.path.join(args.out_dir, fname.split('.')[0]) + ".fix.undo.json")
+        print(msg)
+        process_step.messages = [msg]
+        process_step.exit_status = 0
+        process_step.output_files = [fname]
+        process_step.write(args.in_dir, args.out_dir)
+        sys.exit(0)
+
     out_filename_root = args.input_files[0].split('.')[0]
     _make_logger(os.path.join(args.out_dir, out_filename_root + '.fix.txt'))
     if args.dryrun:
@@ -118,58 +146,39 @@ def main():
             args.input_files.insert(0, f)
             break
 
+    # Extract the disk header from the first file
+    with open(os.path.join(args.in_dir, args.input_files[0]), 'rb') as ifp1:
+        lcHeader, _ = __readLCHeader(ifp1)
+    if args.verbosity:
+        lcHeader.printHeader()
+    # DO NOT TRY TO READ DATA IF FILE IS JUST A HEADER
+    if '.header.' in args.input_files[0]:
+        data_files = [(f, False) for f in args.input_files[1:]]
+    else:
+        data_files = [(f, i == 0) for i, f in enumerate(args.input_files)]
+
     # LOOP THROUGH INPUT FILES
     numInFiles = len(args.input_files)
-    firstFile = True
-    for fname in args.input_files:
-        ifp1 = open(os.path.join(args.in_dir, fname), 'rb')
-
-        # Find and copy the disk header
-        if firstFile:    # First file, extract header
-            lcHeader, firstInpBlock = __readLCHeader(ifp1)
-            if args.verbosity:
-                lcHeader.printHeader()
-            # DO NOT TRY TO READ DATA IF FILE IS JUST A HEADER
-            if '.header.' in fname:
-                firstFile = False
-                continue
-        else:
-            firstInpBlock = 0      # dataBlocks will start at the beginning
-            lcHeader.dirCount = 0  # No header, so no directory entries
-
-        logging.info('='*14 + " PROCESSING FILE {} ".format(fname) + "="*13)
-
-        # Determine last file block
-        ifp1.seek(0, 2)                # Seek end of file
-        lastInpBlock = int(ifp1.tell() / 512) - 1
-
-        if lastInpBlock <= firstInpBlock + 4:
-            print("No data, skipping file")
-            firstFile = False
+    if args.jobs > 1 and len(data_files) > 1:
+        results = _fix_input_files_parallel(data_files, lcHeader, numInFiles,
+                                            args)
+    else:
+        results = (_fix_input_file(fname, hasHeader, lcHeader, numInFiles,
+                                   args, commandQ, responseQ)
+                   for fname, hasHeader in data_files)
+    for result in results:
+        if result is None:    # No data
             continue
-
-        if __stopProcess(commandQ):
-            return
-
-        # Adjust first block to correspond to first block with channel 0
-        firstInpBlock = __findFirstMux0Block(firstInpBlock, ifp1)
-
-        outFileRoot = __makeOutFileRoot(args.out_dir, fname, numInFiles,
-                                        ifp1, firstInpBlock)
-
-        # Process file
-        (loopcounters, msg, ofname) = _process_input_file(
-            ifp1, fname, outFileRoot, lcHeader, firstInpBlock,
-            lastInpBlock, firstFile, args, commandQ, responseQ)
-        ifp1.close()
+        (loopcounters, msg, ofname) = result
 
         # Update counters
         counters += loopcounters
         n_files += 1
         msgs.append(msg)
-        outFiles.append(ofname)
-
-        firstFile = False
+        if isinstance(ofname, list):   # --split
+            outFiles.extend(ofname)
+        else:
+            outFiles.append(ofname)
         # END OF INPUT FILES LOOP
     _print_final_message(args.forceTime, counters, n_files)
 
@@ -180,7 +189,6 @@ def main():
         elif not warnings == 0:
             exit_status = 2
 
-        global process_step
         process_step.messages = msgs
         process_step.exit_status = exit_status
         process_step.output_files = [Path(x).name for x in outFiles]
@@ -189,15 +197,199 @@ def main():
     sys.exit(exit_status)
 
 
+def _fix_input_file(fname, hasHeader, lcHeader, numInFiles, args,
+                    commandQ=None, responseQ=None):
+    """
+    Process one LCHEAPO file
+
+    :param fname: input file name (without path)
+    :param hasHeader: does the input file have a header?
+    :param lcHeader: header taken from the first input file (is not
+        modified)
+    :param numInFiles: number of input files
+    :param args: command line arguments
+    :returns: counters, message, output file name (None if the file has no
+        data or processing was stopped)
+    """
+    lcHeader = copy.deepcopy(lcHeader)
+    ifp1 = open(os.path.join(args.in_dir, fname), 'rb')
+    if hasHeader:
+        firstInpBlock = lcHeader.dataStart
+    else:
+        firstInpBlock = 0      # dataBlocks will start at the beginning
+        lcHeader.dirCount = 0  # No header, so no directory entries
+
+    logging.info('='*14 + " PROCESSING FILE {} ".format(fname) + "="*13)
+
+    # Determine last valid block
+    lastInpBlock = _last_input_block(ifp1, firstInpBlock, lcHeader)
+
+    if lastInpBlock <= firstInpBlock + 4:
+        print("No data, skipping file")
+        ifp1.close()
+        return None
+
+    if __stopProcess(commandQ):
+        return None
+
+    # Adjust first block to correspond to first block with channel 0
+    firstInpBlock = __findFirstMux0Block(firstInpBlock, ifp1)
+
+    outFileRoot = __makeOutFileRoot(args.out_dir, fname, numInFiles,
+                                    ifp1, firstInpBlock)
+
+    # Process file
+    result = _process_input_file(
+        ifp1, fname, outFileRoot, lcHeader, firstInpBlock,
+        lastInpBlock, hasHeader, args, commandQ, responseQ)
+    ifp1.close()
+    return result
+
+
+def _fix_input_files_parallel(data_files, lcHeader, numInFiles, args):
+    """
+    Process LCHEAPO files in a pool of processes
+
+    Each file's log messages, printed text and warnings are collected by
+    its process and replayed here in input file order, so that the
+    outputs do not depend on the order in which the files finish.
+
+    :param data_files: (input file name, has header?) for each file
+    :returns: generator of _fix_input_file() results, in input file order
+    """
+    global warnings
+    # Headerless files' directory entries take their non-time values from
+    # the last entry read from the file with a header
+    lastDir = None
+    if data_files[0][1]:
+        with open(os.path.join(args.in_dir, data_files[0][0]), 'rb') as fp:
+            lastDir = _last_dir_entry(fp, lcHeader)
+    sys.stdout.flush()
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(_fix_input_file_job, fname, hasHeader,
+                                   lcHeader, numInFiles, args,
+                                   None if hasHeader else lastDir)
+                   for fname, hasHeader in data_files]
+        for future in futures:
+            result, events, n_warnings, exit_code = future.result()
+            for event in events:
+                if event[0] == 'log':
+                    logging.log(event[1], event[2])
+                else:
+                    sys.stdout.write(event[1])
+            warnings += n_warnings
+            if exit_code is not None:
+                for f in futures:
+                    f.cancel()
+                sys.exit(exit_code)
+            yield result
+
+
+def _fix_input_file_job(fname, hasHeader, lcHeader, numInFiles, args,
+                        lastDir=None):
+    """
+    Run _fix_input_file() in a worker process, collecting its outputs
+
+    :param lastDir: directory entry left by processing the previous files
+    :returns: result, list of log and print events, number of warnings,
+        exit code (None unless sys.exit() was called)
+    """
+    global lcDir
+    if lastDir is not None:
+        lcDir = lastDir
+    args = copy.copy(args)
+    args.jobs = 1    # Do not split the file into shards
+    events = []
+    handler = _EventCollector(events)
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(logging.INFO)
+    start_warnings = warnings
+    result, exit_code = None, None
+    with contextlib.redirect_stdout(handler):
+        try:
+            result = _fix_input_file(fname, hasHeader, lcHeader, numInFiles,
+                                     args)
+        except SystemExit as e:
+            exit_code = e.code
+    return result, events, warnings - start_warnings, exit_code
+
+
+def _last_input_block(ifp1, firstInpBlock, lcHeader):
+    """
+    Return the last valid block of an input file
+
+    Blocks after it (zero-filled or garbage blocks at the end of recovered
+    disks) are ignored, see lcheapo.find_last_block()
+
+    :param ifp1: input file pointer
+    :param firstInpBlock: first data block
+    :param lcHeader: disk header (of the first file if this one has none)
+    """
+    global warnings
+    with LCFile(ifp1.name, read_header=False) as lcfile:
+        lastInpBlock = find_last_block(lcfile, firstInpBlock,
+                                       lcHeader.numberOfChannels,
+                                       lcHeader.realSampleRate)
+        n_ignored = lcfile.n_blocks - 1 - lastInpBlock
+    if n_ignored > 0 and lastInpBlock >= firstInpBlock:
+        logging.warning("  Ignoring {:d} blocks after the last valid block "
+                        "({:d})".format(n_ignored, lastInpBlock))
+        warnings += 1
+    return lastInpBlock
+
+
+def _last_dir_entry(ifp1, lcHeader):
+    """
+    Return the last directory entry that _process_input_file() reads from
+    a file with a header
+
+    :param ifp1: input file pointer
+    :param lcHeader: the file's header
+    """
+    lastInpBlock = _last_input_block(ifp1, lcHeader.dataStart, lcHeader)
+    lcDir = LCDirEntry()
+    lcDir.seekBlock(ifp1, lcHeader.dirStart)
+    for iDir in range(lcHeader.dirCount):
+        lcDir.readDirEntry(ifp1)
+        numBlocks = lcDir.numBlocks
+        if numBlocks == BAD_DIRBLOCKS:
+            numBlocks = DIRBLOCKS
+        if lcDir.blockNumber > lastInpBlock or \
+                lcDir.blockNumber + numBlocks >= lastInpBlock:
+            break
+    return lcDir
+
+
+class _EventCollector(logging.Handler):
+    """
+    Collect log records and printed text, in order
+    """
+    def __init__(self, events):
+        super().__init__()
+        self.events = events
+
+    def emit(self, record):
+        self.events.append(('log', record.levelno, record.getMessage()))
+
+    def write(self, text):
+        self.events.append(('print', text))
+
+    def flush(self):
+        pass
+
+
 def _get_options():
     """
     Parse user passed options and parameters.
     """
     epi_text = textwrap.dedent("""\
     Outputs (for input filename root.*):
-      - root.fix.lch: fixed data
+      - root.fix.lch: fixed data (root_YYYYmmddTHHMMSS.fix.lch files with
+        --split)
       - root.fix.txt: text on bugs found and fixes applied
       - (root.fix.timetears.txt): list of time tears
+      - (root.fix.undo.json): original bytes of an --in-place corrected file
     Notes:
       - TIME TEARS MUST BE ELIMINATED BEFORE FURTHER PROCESSING!!!
     Recommendations:
@@ -223,9 +415,27 @@ def _get_options():
     parser.add_argument("-v", "--verbose", dest="verbosity", default=0,
                         action="count",
                         help="be verbose (-v = kind of, -vv = very)")
-    parser.add_argument("--dryrun", dest="dryrun", default=False,
-                        action="store_true",
-                        help="do not output fixed LCHEAPO file")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--dryrun", dest="dryrun", default=False,
+                      action="store_true",
+                      help="do not output fixed LCHEAPO file")
+    mode.add_argument("--in-place", dest="in_place", default=False,
+                      action="store_true",
+                      help="write the corrected block headers and directory "
+                           "entries back into the input file instead of "
+                           "creating root.fix.lch.  The original bytes are "
+                           "first saved to root.fix.undo.json")
+    mode.add_argument("--undo", dest="undo", default=False,
+                      action="store_true",
+                      help="restore an input file patched using --in-place, "
+                           "from its root.fix.undo.json")
+    mode.add_argument("--split", dest="split", default=None,
+                      metavar="PERIOD", type=_split_period,
+                      help="write the fixed data to one file per PERIOD "
+                           "('daily', 'hourly' or a number of blocks), each "
+                           "with a header and directory, named "
+                           "root_YYYYmmddTHHMMSS.fix.lch after its first "
+                           "block time")
     parser.add_argument("-d", dest="base_dir", metavar="BASE_DIR",
                         default='.', help="base directory for files")
     parser.add_argument("-i", dest="in_dir", metavar="IN_DIR", default='.',
@@ -237,6 +447,17 @@ def _get_options():
     parser.add_argument("-F", "--forceTimes", dest="forceTime", default=False,
                         action="store_true",
                         help="Force timetags to be consecutive")
+    parser.add_argument("--jobs", dest="jobs", type=int, default=1,
+                        metavar="N",
+                        help="number of processes: several input files are "
+                             "processed in parallel, a single input file is "
+                             "split into parallel shards of %d blocks"
+                             % DIRBLOCKS)
+    parser.add_argument("--engine", choices=['vector', 'loop'],
+                        default='vector',
+                        help="vector: compare block times as arrays and "
+                             "only examine the suspect blocks, loop: examine "
+                             "every block (always used with -vv)")
     args = parser.parse_args()
     global process_step
     process_step = sdpchain.ProcessStep(
@@ -249,11 +470,24 @@ def _get_options():
     # Expand captured wildcards
     # print(f'{args.input_files=}')
     args.input_files = [x.name for f in args.input_files
-                        for x in Path(args.in_dir).glob(f)]
+                        for x in Path(args.in_dir).glob(f)
+                        if x.suffix != INDEX_SUFFIX]
     # print(f'expanded {args.input_files=}')
+    if (args.in_place or args.undo) and len(args.input_files) > 1:
+        parser.error("--in-place and --undo take only one input file")
     return args
 
 
+def _split_period(string):
+    """
+    Validate the --split period
+    """
+    if string in ('daily', 'hourly') or (string.isdigit() and int(string)):
+        return string
+    raise argparse.ArgumentTypeError(
+        f"must be 'daily', 'hourly' or a number of blocks, not '{string}'")
+
+
 def getTimeDelta(seconds=0.):
     """
     Convert seconds to a timedelta() object
@@ -303,7 +537,7 @@ def __stopProcess(commandQ):
     return False
 
 
-def __endBUG1A(startBlock, endBlock):
+def _endBUG1A(startBlock, endBlock):
     global startBUG1A
     if startBUG1A >= 0:
         logging.info("{:8d}:  End LCHEAPO BUG #3 (started at {:d})".format(
@@ -467,22 +701,25 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
     :rtype: `tuple`
     """
     # Declare variables
-    global startBUG1A, printHeader, lcDir, warnings
+    global startBUG1A, printHeader, lcDir
     i = 0
-    counters = BugCounters()
-    lastBUG1s = [0, 0, 0, 0]
     printHeader = ''
     startBUG1A = -1
-    prev_mux_chan = -1
-    # prev_block_flag = 73
-    # prev_num_samps = 166
-    # prev_U1 = 3
-    # prev_U2 = 166
     verbosity = args.verbosity
-    consecIdentTimeErrors, oldDiff = 0, 0
     lcData = LCDataBlock()
-
-    if not args.dryrun:
+    ofp1 = None
+
+    if args.in_place:
+        # Changes are held in ofp1 until the undo journal has been written
+        outfilename = os.path.join(args.in_dir, fname)
+        fname_undo = outFileRoot + ".fix.undo.json"
+        if os.path.exists(fname_undo):
+            print(f"undo journal {fname_undo} exists already! Quitting")
+            sys.exit(2)
+        ofp1 = _PatchedFile(outfilename)
+    elif args.split:
+        outfilename = None   # One file per period, see _write_split_files()
+    elif not args.dryrun:
         outfilename = outFileRoot + ".fix.lch"
         if os.path.exists(outfilename):
             print(f"output file {outfilename} exists already! Quitting")
@@ -494,14 +731,14 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
     # -----------------------------
     # Copy the disk header to the output file
     # -----------------------------
-    if not args.dryrun:
+    if ofp1 is not None:
         lcHeader.seekHeaderPosition(ofp1)
         lcHeader.writeHeader(ofp1)
     if __stopProcess(commandQ):
         return
 
     blockTime = int((166 * (1.0 / lcHeader.realSampleRate)) * 1000)
-    blockTimeDelta = t = timedelta(0, 0, 0, blockTime, 0, 0)
+    blockTimeDelta = timedelta(0, 0, 0, blockTime, 0, 0)
 
     # -----------------------------
     # Grab the first time entries (one for each channel) and adjust them
@@ -519,7 +756,7 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
     # lastAddress = ifp1.tell()
     # Back up to data start block
     lcData.seekBlock(ifp1, firstInpBlock)
-    if not args.dryrun:
+    if ofp1 is not None:
         if hasHeader:
             lcData.seekBlock(ofp1, firstInpBlock)
         else:
@@ -531,168 +768,59 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
     if debug:
         logging.info("  DEBUGGING")
 
-    # Loop over blocks, comparing expected and actual times.
-    for i in range(firstInpBlock, lastInpBlock+1):
-        if debug and (i > lastInpBlock-10):
-            logging.info("  BLOCK {:d}".format(i))
-        lcData.readBlock(ifp1)
-        if debug and (i > lastInpBlock - 10):
-            logging.info("  READ")
-        currBlock = int(ifp1.tell() / 512) - 1
-        if startBUG1A >= 0 and currBlock > (lastBUG1s[0] + 500):
-            __endBUG1A(startBUG1A, currBlock)
-        if i != currBlock:
-            raise ValueError(
-                f"Current Block ({currBlock:d}) != expected ({i:d})")
-        if verbosity > 1:  # Very verbose, print each block header
-            logging.info("{:8d}({:d}): ".format(i, ifp1.tell()))
-            lcData.prettyPrintHeader()
-        # VERIFY NON-TIME HEADER VALUES ############
-        counters.bad_hdr = verify_non_time_header_values(
-            lcData, counters.bad_hdr, printHeader, currBlock)
-        # VERIFY CHANNEL NUMBER ############
-        lcData.muxChannel, warnings = verify_channel_number(
-            lcData.muxChannel, lcHeader.numberOfChannels,
-            prev_mux_chan, warnings, printHeader, currBlock)
-        # Handle bad chan numbers without crashing
-        # iCh = lcData.muxChannel % lcHeader.numberOfChannels
-        expect_time = lastTime[lcData.muxChannel] + blockTimeDelta
-        t = lcData.getDateTime()
-        diff = abs(_to_msec(t - expect_time))
-        if diff:
-            if args.forceTime or (i > lastInpBlock
-                                  - (3*lcHeader.numberOfChannels)):
-                # FORCE TIME TO BE WHAT WE EXPECT
-                if (consecIdentTimeErrors > 0) & (diff != oldDiff):
-                    # Starting a new time offset
-                    logging.info("{:d} blocks".format(
-                        consecIdentTimeErrors))
-                    consecIdentTimeErrors = 0
-
-                if consecIdentTimeErrors == 0:
-                    # New time error or error offset
-                    txt = "{}{:8d}:  CH{:d}: {:g}s offset" +\
-                          " FORCED to conform..."
-                    forceTimeErrorStr = txt.format(printHeader, currBlock,
-                                                   lcData.muxChannel,
-                                                   diff/1000.)
-                    if not args.forceTime:
-                        forceTimeErrorStr += " BECAUSE NEAR END OF FILE"
-                t = expect_time
-                lcData.changeTime(t)
-                if args.forceTime:
-                    counters.time_tear += 1
-                consecIdentTimeErrors += 1  # Only used for forceTime
-                oldDiff = diff
-            else:
-                if diff > 1100:
-                    # Difference greater than 1 second, could be a time
-                    # tear or an isolated bad entry (bug #2)
-                    # See if following blocks have the expected time
-                    pos = ifp1.tell()
-                    channel = lcData.muxChannel
-                    nextTime = _get_next_time(ifp1, channel, pos)
-                    tempDiff = abs(_to_msec(nextTime - expect_time))
-                    if (tempDiff - 2*_to_msec(blockTimeDelta) < 2):
-                        _log_error_2("2", printHeader, currBlock,
-                                     lcData.muxChannel, expect_time,
-                                     t)
-                        counters.bug2 += 1
-                        t = expect_time
-                        lcData.changeTime(t)
-                    else:
-                        # Check TWO blocks ahead with the same channel
-                        nextTime = _get_next_time(ifp1, channel, pos)
-                        tempDiff = abs(_to_msec(nextTime -
-                                                expect_time))
-                        if (tempDiff - 3*_to_msec(blockTimeDelta) < 2):
-                            _log_error_2("2b", printHeader, currBlock,
-                                         lcData.muxChannel,
-                                         expect_time, t)
-                            counters.bug2 += 1
-                            t = expect_time
-                            lcData.changeTime(t)
-                        else:
-                            # Check THREE blocks ahead, same channel
-                            nextTime = _get_next_time(ifp1, channel,
-                                                      pos)
-                            tempDiff = abs(_to_msec(nextTime -
-                                                    expect_time))
-                            if (tempDiff - 4*_to_msec(blockTimeDelta)
-                                    < 2):
-                                # LCHEAPO BUG 2C
-                                _log_error_2("2c",
-                                             printHeader,
-                                             currBlock,
-                                             lcData.muxChannel,
-                                             expect_time,
-                                             t)
-                                counters.bug2 += 1
-                                t = expect_time
-                                lcData.changeTime(t)
-                            else:
-                                # Time tear (do not fix it!)
-                                fmt = "{:8d}: Time Tear in Data.   " +\
-                                      "CH{:d} Expected Time: {}, " +\
-                                      "Got: {}"
-                                txt = fmt.format(currBlock,
-                                                 lcData.muxChannel,
-                                                 expect_time, t)
-                                logging.warning(printHeader + txt)
-                                warnings += 1
-                                print(printHeader + txt, file=oftt)
-                                counters.time_tear += 1
-                    # Go back to original position
-                    ifp1.seek(pos)
-                    # End if diff > 1100:
-                else:
-                    # LCHEAPO BUG - A second is dropped (then recovered)
-                    if lastBUG1s[0] == currBlock - 500:
-                        if startBUG1A < 0:
-                            txt = "{}{:8d}: LCHEAPO BUG #1a. BUG #1s " +\
-                                  "repeating at 500-block intervals"
-                            logging.info(txt.format(printHeader,
-                                                    currBlock))
-                            startBUG1A = currBlock
-                            printHeader = '      '
-                    else:
-                        txt = "{}{:8d}: LCHEAPO BUG #1. CH{:d} " +\
-                              "Expected Time: {}, Got: {} "
-                        logging.info(
-                            txt.format(printHeader, currBlock,
-                                       lcData.muxChannel, expect_time, t))
-                    counters.bug1 += 1
-                    t = expect_time
-                    lcData.changeTime(t)
-                    # FIFO: remove 1st elem & add new last
-                    lastBUG1s.pop(0)
-                    lastBUG1s.append(currBlock)
+    # Compare expected and actual times of every block
+    fixer = _BlockFixer(lcHeader.numberOfChannels, lastTime, blockTimeDelta,
+                        lastInpBlock, args.forceTime, oftt)
+    patches, arrays = {}, []
+    if args.engine == 'vector' and verbosity <= 1 and not debug:
+        if hasHeader:
+            dirOrigin = lcHeader.dataStart
         else:
-            if args.forceTime and (consecIdentTimeErrors > 0):
-                logging.info(forceTimeErrorStr +
-                             "{:d} blocks".format(consecIdentTimeErrors))
-                consecIdentTimeErrors = 0
-        # Write out the block of data and report status (if necessary)
-        if not args.dryrun:
-            lcData.writeBlock(ofp1)
-        if (i % 5000 == 0):
-            if __stopProcess(commandQ):
-                return
-            if responseQ:
-                responseQ.put((i, lastInpBlock, counters.bug1,
-                               counters.time_tear))
-
-        # Handle bad muxChannel numbers without crashing
-        # iCh = lcData.muxChannel % lcHeader.numberOfChannels
-        lastTime[lcData.muxChannel] = t
-        prev_mux_chan = lcData.muxChannel
-        # prev_block_flag = lcData.blockFlag
-        # prev_num_samps = lcData.numberOfSamples
-        # prev_U1 = lcData.U1
-        # prev_U2 = lcData.U2
-    # END LOOP THROUGH EVERY BLOCK
-    if responseQ:
-        responseQ.put((i, lastInpBlock, counters.bug1, counters.time_tear))
+            dirOrigin = firstInpBlock
+        # Use the file's index, or build it (without saving it next to the
+        # input file) unless the blocks are read in parallel
+        with LCFile(ifp1.name, read_header=hasHeader) as lcfile:
+            index = lcfile.getIndex(build=args.jobs <= 1, save=False)
+        i = _fix_blocks_vector(fixer, ifp1, firstInpBlock, lastInpBlock,
+                               patches, commandQ, responseQ, args.jobs,
+                               dirOrigin, index, arrays)
+    else:
+        i = _fix_blocks_loop(fixer, ifp1, firstInpBlock, lastInpBlock,
+                             patches, verbosity, commandQ, responseQ, debug)
+    if i is None:
+        return
+    if args.in_place:
+        for block in sorted(patches):
+            lcData.seekBlock(ofp1, block)
+            ofp1.write(patches[block])
+    elif ofp1 is not None:
+        # Copy the data blocks, then correct their headers
+        _copy_blocks_patched(ifp1, ofp1, firstInpBlock, lastInpBlock,
+                             patches)
+    counters = fixer.counters
+
+    if args.split:
+        # Write the blocks to one file per period, with new directories
+        if hasHeader:
+            counters.bug3 += _count_bad_dir_entries(ifp1, lcHeader,
+                                                    lastInpBlock)
+        outfilenames = _write_split_files(
+            ifp1, lcHeader, firstInpBlock, lastInpBlock, patches,
+            os.path.join(args.out_dir, fname.split('.')[0]), args.split,
+            hasHeader, arrays or None)
+        message = _print_blockloop_message(fname, outfilenames[0],
+                                           args.forceTime, i, counters)
+        logging.info("  SPLIT INTO {:d} FILES: {}".format(
+            len(outfilenames),
+            ", ".join(os.path.split(x)[1] for x in outfilenames)))
+        oftt.close()
+        if counters.time_tear == 0:
+            os.remove(fname_timetears)
+        elif not args.forceTime:
+            for x in outfilenames:
+                os.remove(x)
+            return counters, message, fname_timetears
+        return counters, message, outfilenames
 
     # ----------------------------------------------------------------------
     # Copy over the directory entries and modify the block time to correspond
@@ -700,7 +828,10 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
     # ----------------------------------------------------------------------
 
     # Open the output datafile for reading
-    if not args.dryrun:
+    if args.in_place:
+        # the input file, with the pending corrections
+        ofp_data = ofp1.reopen()
+    elif not args.dryrun:
         ofp_data = open(outfilename, 'rb')  # generally the output file
     else:
         # if no output file, read block data from input file
@@ -734,9 +865,6 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
         lastOutBlock = lastInpBlock
     else:
         lastOutBlock = lastInpBlock + lcHeader.dataStart
-    # LCHEAPO DIRECTORY ENTRIES ARE EVERY 14336 blocks BY DEFAULT
-    DIRBLOCKS = 14336
-    BAD_DIRBLOCKS = 16384
     # Loop through the directory
     while True:
         # If the input file had a directory, read in the next entry
@@ -835,6 +963,12 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
     # -----------------------
     # Close all the files
     # -----------------------
+    if args.in_place and (counters.time_tear == 0 or args.forceTime):
+        n_patched = ofp1.commit(fname_undo)
+        txt = "  {:d} records corrected in {}, undo journal is {}".format(
+            n_patched, fname, os.path.split(fname_undo)[1])
+        logging.info(txt)
+        message += "\n" + txt
     if not args.dryrun:
         ofp1.close()
         ofp_data.close()
@@ -845,11 +979,748 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
         os.remove(fname_timetears)
     # Otherwise, if not forced time corrections, remove the output data file
     elif not args.forceTime:
-        os.remove(outfilename)
+        if not args.in_place:
+            os.remove(outfilename)
         return counters, message, fname_timetears
+    if args.in_place:
+        return counters, message, fname_undo
     return counters, message, outfilename
 
 
+class _BlockFixer():
+    """
+    Time verification and correction state for one input file
+
+    Blocks must be passed to check_bug1a_end() and fix_block() in
+    increasing block order.  Each lcfix engine decides which blocks to pass.
+    """
+    def __init__(self, n_channels, lastTime, blockTimeDelta, lastInpBlock,
+                 forceTime, oftt):
+        """
+        :param n_channels: number of channels
+        :param lastTime: expected time of each channel's first block minus
+            blockTimeDelta
+        :param blockTimeDelta: time spanned by a block
+        :param lastInpBlock: last block number in the input file
+        :param forceTime: force timetags to be consecutive
+        :param oftt: time tears file pointer
+        """
+        self.counters = BugCounters()
+        self.n_channels = n_channels
+        self.lastTime = lastTime
+        self.blockTimeDelta = blockTimeDelta
+        self.lastInpBlock = lastInpBlock
+        self.forceTime = forceTime
+        self.oftt = oftt
+        self.lastBUG1s = [0, 0, 0, 0]
+        self.prev_mux_chan = -1
+        self.consecIdentTimeErrors, self.oldDiff = 0, 0
+        self.forceTimeErrorStr = ''
+
+    def check_bug1a_end(self, currBlock):
+        """
+        Signal the end of a series of 500-block-interval BUG1s
+        """
+        if startBUG1A >= 0 and currBlock > (self.lastBUG1s[0] + 500):
+            _endBUG1A(startBUG1A, currBlock)
+
+    def fix_block(self, lcData, currBlock, lookahead):
+        """
+        Verify one block's header values and correct its time and channel
+
+        :param lcData: the block, modified in place
+        :param currBlock: the block number
+        :param lookahead: gives the times of the channel's following blocks
+        :type  lookahead: _WindowLookahead or _ArrayLookahead
+        """
+        global startBUG1A, printHeader, warnings
+        counters = self.counters
+        lastTime = self.lastTime
+        blockTimeDelta = self.blockTimeDelta
+        # VERIFY NON-TIME HEADER VALUES ############
+        counters.bad_hdr = verify_non_time_header_values(
+            lcData, counters.bad_hdr, printHeader, currBlock)
+        # VERIFY CHANNEL NUMBER ############
+        lcData.muxChannel, warnings = verify_channel_number(
+            lcData.muxChannel, self.n_channels,
+            self.prev_mux_chan, warnings, printHeader, currBlock)
+        # Handle bad chan numbers without crashing
+        # iCh = lcData.muxChannel % lcHeader.numberOfChannels
+        expect_time = lastTime[lcData.muxChannel] + blockTimeDelta
+        t = lcData.getDateTime()
+        diff = abs(_to_msec(t - expect_time))
+        if diff:
+            if self.forceTime or (currBlock > self.lastInpBlock
+                                  - (3*self.n_channels)):
+                # FORCE TIME TO BE WHAT WE EXPECT
+                if (self.consecIdentTimeErrors > 0) & (diff != self.oldDiff):
+                    # Starting a new time offset
+                    logging.info("{:d} blocks".format(
+                        self.consecIdentTimeErrors))
+                    self.consecIdentTimeErrors = 0
+
+                if self.consecIdentTimeErrors == 0:
+                    # New time error or error offset
+                    txt = "{}{:8d}:  CH{:d}: {:g}s offset" +\
+                          " FORCED to conform..."
+                    self.forceTimeErrorStr = txt.format(
+                        printHeader, currBlock, lcData.muxChannel,
+                        diff/1000.)
+                    if not self.forceTime:
+                        self.forceTimeErrorStr += " BECAUSE NEAR END OF FILE"
+                t = expect_time
+                lcData.changeTime(t)
+                if self.forceTime:
+                    counters.time_tear += 1
+                self.consecIdentTimeErrors += 1  # Only used for forceTime
+                self.oldDiff = diff
+            else:
+                if diff > 1100:
+                    # Difference greater than 1 second, could be a time
+                    # tear or an isolated bad entry (bug #2)
+                    # See if following blocks have the expected time
+                    channel = lcData.muxChannel
+                    for n_ahead, bug_type in enumerate(["2", "2b", "2c"]):
+                        nextTime = lookahead.next_time(currBlock, channel,
+                                                       n_ahead + 1)
+                        if nextTime is None:
+                            continue
+                        tempDiff = abs(_to_msec(nextTime - expect_time))
+                        if (tempDiff - (n_ahead + 2)*_to_msec(blockTimeDelta)
+                                < 2):
+                            _log_error_2(bug_type, printHeader, currBlock,
+                                         lcData.muxChannel, expect_time, t)
+                            counters.bug2 += 1
+                            t = expect_time
+                            lcData.changeTime(t)
+                            break
+                    else:
+                        # Time tear (do not fix it!)
+                        fmt = "{:8d}: Time Tear in Data.   " +\
+                              "CH{:d} Expected Time: {}, " +\
+                              "Got: {}"
+                        txt = fmt.format(currBlock, lcData.muxChannel,
+                                         expect_time, t)
+                        logging.warning(printHeader + txt)
+                        warnings += 1
+                        print(printHeader + txt, file=self.oftt)
+                        counters.time_tear += 1
+                    # End if diff > 1100:
+                else:
+                    # LCHEAPO BUG - A second is dropped (then recovered)
+                    if self.lastBUG1s[0] == currBlock - 500:
+                        if startBUG1A < 0:
+                            txt = "{}{:8d}: LCHEAPO BUG #1a. BUG #1s " +\
+                                  "repeating at 500-block intervals"
+                            logging.info(txt.format(printHeader,
+                                                    currBlock))
+                            startBUG1A = currBlock
+                            printHeader = '      '
+                    else:
+                        txt = "{}{:8d}: LCHEAPO BUG #1. CH{:d} " +\
+                              "Expected Time: {}, Got: {} "
+                        logging.info(
+                            txt.format(printHeader, currBlock,
+                                       lcData.muxChannel, expect_time, t))
+                    counters.bug1 += 1
+                    t = expect_time
+                    lcData.changeTime(t)
+                    # FIFO: remove 1st elem & add new last
+                    self.lastBUG1s.pop(0)
+                    self.lastBUG1s.append(currBlock)
+        else:
+            if self.forceTime and (self.consecIdentTimeErrors > 0):
+                logging.info(self.forceTimeErrorStr +
+                             "{:d} blocks".format(self.consecIdentTimeErrors))
+                self.consecIdentTimeErrors = 0
+
+        # Handle bad muxChannel numbers without crashing
+        # iCh = lcData.muxChannel % lcHeader.numberOfChannels
+        lastTime[lcData.muxChannel] = t
+        self.prev_mux_chan = lcData.muxChannel
+
+
+class _WindowLookahead():
+    """
+    Times of a channel's following blocks, from a sliding window of block
+    headers
+
+    The file is memory-mapped and its headers are decoded once, in chunks
+    that are dropped once the blocks being fixed are past them.
+    """
+    def __init__(self, fname, lastBlock):
+        """
+        :param fname: input file name (with path)
+        :param lastBlock: last block number to look at
+        """
+        self.fname = fname
+        self.lastBlock = lastBlock
+        self.lcfile = None
+        self.chunks = None
+        self.window = collections.deque()  # (first block, times, muxChannels)
+
+    def next_time(self, block, channel, n):
+        """
+        Return the time of the channel's n'th next block (None if beyond
+        the end of the file)
+        """
+        if self.lcfile is None:
+            self.lcfile = LCFile(self.fname, read_header=False)
+            self.chunks = iter_blocks(self.lcfile, block + 1,
+                                      self.lastBlock - block)
+        while self.window and self.window[0][0] + len(self.window[0][1]) \
+                <= block + 1:
+            self.window.popleft()
+        k = 0
+        while True:
+            if k == len(self.window):
+                try:
+                    first, blocks = next(self.chunks)
+                except StopIteration:
+                    return None
+                self.window.append((first, block_times_msec(blocks).tolist(),
+                                    blocks['muxChannel'].tolist()))
+            first, times, mux = self.window[k]
+            for j in range(max(0, block + 1 - first), len(mux)):
+                if mux[j] == channel:
+                    n -= 1
+                    if n == 0:
+                        return msec_to_datetime(times[j])
+            k += 1
+
+    def close(self):
+        self.window.clear()
+        self.chunks = None
+        if self.lcfile is not None:
+            self.lcfile.close()
+
+
+class _ArrayLookahead():
+    """
+    Times of a channel's following blocks, from the block time arrays
+    """
+    def __init__(self, firstBlock, channel_inds, times):
+        """
+        :param firstBlock: block number of the first array element
+        :param channel_inds: array indices of each channel's blocks
+        :param times: block times (msec since 1970)
+        """
+        self.firstBlock = firstBlock
+        self.channel_inds = channel_inds
+        self.times = times
+
+    def next_time(self, block, channel, n):
+        """
+        Return the time of the channel's n'th next block (None if beyond
+        the end of the file)
+        """
+        inds = self.channel_inds[channel]
+        k = np.searchsorted(inds, block - self.firstBlock, side='right')
+        if k + n - 1 >= len(inds):
+            return None
+        return msec_to_datetime(self.times[inds[k + n - 1]])
+
+
+def _fix_blocks_loop(fixer, ifp1, firstInpBlock, lastInpBlock, patches,
+                     verbosity, commandQ=None, responseQ=None, debug=False):
+    """
+    Verify and correct the blocks one by one
+
+    :param fixer: the file's time verification and correction state
+    :type  fixer: :class: `_BlockFixer`
+    :param ifp1: input file pointer
+    :param patches: filled with the packed headers of the corrected blocks,
+        keyed by block number
+    :type  patches: dict
+    :returns: last block number (None if stopped)
+    """
+    lcData = LCDataBlock()
+    lookahead = _WindowLookahead(ifp1.name, lastInpBlock)
+    # Loop over blocks, comparing expected and actual times.
+    for i in range(firstInpBlock, lastInpBlock+1):
+        if debug and (i > lastInpBlock-10):
+            logging.info("  BLOCK {:d}".format(i))
+        lcData.readBlock(ifp1)
+        if debug and (i > lastInpBlock - 10):
+            logging.info("  READ")
+        currBlock = int(ifp1.tell() / 512) - 1
+        fixer.check_bug1a_end(currBlock)
+        if i != currBlock:
+            raise ValueError(
+                f"Current Block ({currBlock:d}) != expected ({i:d})")
+        if verbosity > 1:  # Very verbose, print each block header
+            logging.info("{:8d}({:d}): ".format(i, ifp1.tell()))
+            lcData.prettyPrintHeader()
+        orig_values = _time_and_channel(lcData)
+        fixer.fix_block(lcData, currBlock, lookahead)
+        if _time_and_channel(lcData) != orig_values:
+            patches[currBlock] = lcData.packHeader()
+        # Report status (if necessary)
+        if (i % 5000 == 0):
+            if __stopProcess(commandQ):
+                lookahead.close()
+                return None
+            if responseQ:
+                responseQ.put((i, lastInpBlock, fixer.counters.bug1,
+                               fixer.counters.time_tear))
+    # END LOOP THROUGH EVERY BLOCK
+    lookahead.close()
+    if responseQ:
+        responseQ.put((i, lastInpBlock, fixer.counters.bug1,
+                       fixer.counters.time_tear))
+    return i
+
+
+def _fix_blocks_vector(fixer, ifp1, firstInpBlock, lastInpBlock, patches,
+                       commandQ=None, responseQ=None, jobs=1, dirOrigin=None,
+                       index=None, arrays=None):
+    """
+    Verify and correct the blocks using block arrays
+
+    All block times are compared to their expected values as arrays.  Only
+    the blocks that differ from expectations (and the blocks following
+    them, until the corrected times match the file's again) go through
+    the fixer, so the counters, messages and corrections are the same as
+    for _fix_blocks_loop()
+
+    With jobs > 1, the arrays are read and compared in parallel, in shards
+    starting at directory entry boundaries.  The fixer then goes through
+    the blocks to check in order, which handles the BUG1a series and time
+    tears that cross shard boundaries.  If the file's index is given, the
+    arrays are taken from it instead of being read.
+
+    :param fixer: the file's time verification and correction state
+    :type  fixer: :class: `_BlockFixer`
+    :param ifp1: input file pointer
+    :param patches: filled with the packed headers of the corrected blocks,
+        keyed by block number
+    :type  patches: dict
+    :param jobs: number of processes
+    :param dirOrigin: block number of a directory entry (default:
+        firstInpBlock)
+    :param index: the input file's index
+    :type  index: :class: `lcheapo:LCIndex`
+    :param arrays: if given, filled with the (uncorrected) block times and
+        muxChannels, from firstInpBlock to lastInpBlock
+    :type  arrays: list
+    :returns: last block number (None if stopped)
+    """
+    n_ch = fixer.n_channels
+    block_msec = _to_msec(fixer.blockTimeDelta)
+    first_msec = [datetime_to_msec(t) for t in fixer.lastTime]
+    if dirOrigin is None:
+        dirOrigin = firstInpBlock
+    shards = _shard_limits(firstInpBlock, lastInpBlock, dirOrigin)
+    shard_args = [(ifp1.name, first, last, n_ch, block_msec, firstInpBlock,
+                   first_msec) for first, last in shards]
+    if index is None and jobs > 1 and len(shards) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_read_shard, *zip(*shard_args)))
+    else:
+        results = [_read_shard(*x, ifp1=ifp1, index=index)
+                   for x in shard_args]
+    times, mux, hdr_ok, to_check = [np.concatenate(x)
+                                    for x in zip(*results)]
+    del results
+    if arrays is not None:
+        arrays[:] = [times, mux]
+    channel_inds = [np.flatnonzero(mux == c) for c in range(n_ch)]
+    to_check = to_check.tolist()
+    heapq.heapify(to_check)
+
+    lcData = LCDataBlock()
+    lookahead = _ArrayLookahead(firstInpBlock, channel_inds, times)
+    prev_block = firstInpBlock - 1
+    raw_last = list(first_msec)    # last raw time of each channel
+    while to_check:
+        block = heapq.heappop(to_check)
+        if block > lastInpBlock:
+            break
+        if block <= prev_block:
+            continue
+        ind = block - firstInpBlock
+        if block > prev_block + 1:
+            # Skipped blocks were as expected: take the state from them
+            fixer.prev_mux_chan = int(mux[ind - 1])
+            raw_last = [int(_last_msec(ind - 1, channel_inds[c], times,
+                                       first_msec[c]))
+                        for c in range(n_ch)]
+            fixer.lastTime = [msec_to_datetime(x) for x in raw_last]
+        prev_block = block
+        lcData.seekBlock(ifp1, block)
+        lcData.readBlock(ifp1)
+        fixer.check_bug1a_end(block)
+        orig_values = _time_and_channel(lcData)
+        fixer.fix_block(lcData, block, lookahead)
+        if _time_and_channel(lcData) != orig_values:
+            patches[block] = lcData.packHeader()
+        # Keep checking until the fixer's state matches the raw block values
+        raw_mux = int(mux[ind])
+        if raw_mux < n_ch:
+            raw_last[raw_mux] = int(times[ind])
+        if startBUG1A >= 0:
+            heapq.heappush(to_check, max(block + 1,
+                                         fixer.lastBUG1s[0] + 501))
+        if fixer.prev_mux_chan != raw_mux or \
+                (fixer.forceTime and fixer.consecIdentTimeErrors > 0) or \
+                any(datetime_to_msec(t) != x
+                    for t, x in zip(fixer.lastTime, raw_last)):
+            heapq.heappush(to_check, block + 1)
+    if __stopProcess(commandQ):
+        return None
+    if responseQ:
+        responseQ.put((lastInpBlock, lastInpBlock, fixer.counters.bug1,
+                       fixer.counters.time_tear))
+    return lastInpBlock
+
+
+def _shard_limits(firstBlock, lastBlock, dirOrigin):
+    """
+    Split blocks into shards starting at directory entry boundaries
+
+    :param dirOrigin: block number of a directory entry
+    :returns: list of (first block, last block)
+    """
+    starts = list(range(dirOrigin + DIRBLOCKS * int(np.ceil(
+        (firstBlock - dirOrigin) / DIRBLOCKS)), lastBlock + 1, DIRBLOCKS))
+    if not starts or starts[0] != firstBlock:
+        starts.insert(0, firstBlock)
+    return [(a, b - 1) for a, b in zip(starts, starts[1:] + [lastBlock + 1])]
+
+
+def _read_shard(fname, firstBlock, lastBlock, n_ch, block_msec,
+                firstInpBlock, first_msec, ifp1=None, index=None):
+    """
+    Read a shard's block arrays and find the blocks that the fixer has to
+    look at
+
+    A block is checked if its non-time header values are unexpected, if
+    its channel does not follow the previous block's or if its time does
+    not follow that of the channel's previous block.  The previous blocks
+    of a shard's first blocks are looked for at the end of the preceding
+    shard.
+
+    :param fname: input file name (with path)
+    :param firstInpBlock: first data block in the file
+    :param first_msec: time of each channel's block before firstInpBlock
+    :param ifp1: input file pointer (opened from fname if None)
+    :param index: the input file's index (the blocks are read if None)
+    :returns: times, muxChannels, header values OK, blocks to check
+    """
+    if ifp1 is None:
+        with open(fname, 'rb') as fp:
+            return _read_shard(fname, firstBlock, lastBlock, n_ch,
+                               block_msec, firstInpBlock, first_msec, fp,
+                               index)
+    times, mux, hdr_ok = _read_block_arrays(ifp1, firstBlock, lastBlock,
+                                            index)
+    prev_mux = None
+    prev_msec = list(first_msec)
+    if firstBlock > firstInpBlock:
+        # Get the previous values from the preceding shard's tail
+        tail_first = max(firstInpBlock, firstBlock - SHARD_TAIL_BLOCKS)
+        tail_times, tail_mux, _ = _read_block_arrays(ifp1, tail_first,
+                                                     firstBlock - 1, index)
+        prev_mux = int(tail_mux[-1])
+        for c in range(n_ch):
+            inds = np.flatnonzero(tail_mux == c)
+            if len(inds):
+                prev_msec[c] = int(tail_times[inds[-1]])
+            elif tail_first > firstInpBlock:
+                prev_msec[c] = None     # Unknown, check the first block
+    check = ~hdr_ok
+    if prev_mux is None:
+        check[0] = True
+    else:
+        check[0] |= int(mux[0]) != (prev_mux + 1) % n_ch
+    check[1:] |= mux[1:] != (mux[:-1].astype(int) + 1) % n_ch
+    for c in range(n_ch):
+        inds = np.flatnonzero(mux == c)
+        if not len(inds):
+            continue
+        if prev_msec[c] is None:
+            check[inds[0]] = True
+            expect = np.concatenate(([times[inds[0]] - block_msec],
+                                     times[inds[:-1]]))
+        else:
+            expect = np.concatenate(([prev_msec[c]], times[inds[:-1]]))
+        check[inds[times[inds] != expect + block_msec]] = True
+    return times, mux, hdr_ok, np.flatnonzero(check) + firstBlock
+
+
+def _read_block_arrays(ifp1, firstBlock, lastBlock, index=None):
+    """
+    Read block times, channels and non-time header validity as arrays
+
+    :param index: the input file's index (the blocks are read if None)
+    :returns: times (msec since 1970), muxChannels, header values OK
+    """
+    if index is not None:
+        sl = slice(firstBlock, lastBlock + 1)
+        return (np.array(index.times[sl]), np.array(index.mux[sl]),
+                (index.flags[sl] & INDEX_BAD_HEADER) == 0)
+    times, mux, hdr_ok = [], [], []
+    for _, blocks in iter_blocks(ifp1, firstBlock, lastBlock - firstBlock + 1):
+        times.append(block_times_msec(blocks))
+        mux.append(blocks['muxChannel'].copy())
+        hdr_ok.append((blocks['blockFlag'] == 73)
+                      & (blocks['numberOfSamples'] == 166)
+                      & (blocks['U1'] == 3) & (blocks['U2'] == 166))
+    return np.concatenate(times), np.concatenate(mux), np.concatenate(hdr_ok)
+
+
+def _last_msec(ind, inds, times, default):
+    """
+    Time of the last of a channel's blocks up to array index ind
+
+    :param inds: array indices of the channel's blocks
+    :param default: value to return if there is no such block
+    """
+    k = np.searchsorted(inds, ind, side='right') - 1
+    if k < 0:
+        return default
+    return times[inds[k]]
+
+
+def _write_split_files(ifp1, lcHeader, firstBlock, lastBlock, patches,
+                       fileRoot, split, hasHeader, arrays=None):
+    """
+    Write the corrected blocks to one LCHEAPO file per period
+
+    Daily and hourly files start at the first channel 0 block of each
+    day/hour (corrected times), other files every split blocks (rounded to
+    whole channel groups).  Each file has the disk header, data starting at
+    dataStart and a directory pointing to its blocks.
+
+    :param ifp1: input file pointer
+    :param lcHeader: disk header
+    :param patches: new packed block headers, keyed by block number
+    :param fileRoot: output file root (with path), the first block time is
+        appended to it as in __makeOutFileRoot()
+    :param split: 'daily', 'hourly' or number of blocks per file (str)
+    :param hasHeader: does the input file have a header?
+    :param arrays: uncorrected block times and muxChannels from firstBlock
+        to lastBlock, as filled by _fix_blocks_vector() (modified).  They
+        are taken from the file's index (built if needed) if None
+    :returns: output file names
+    """
+    with LCFile(ifp1.name, read_header=hasHeader) as lcfile:
+        if arrays is None:
+            index = lcfile.getIndex(build=True, save=False)
+            arrays = [np.array(index.times[firstBlock:lastBlock + 1]),
+                      np.array(index.mux[firstBlock:lastBlock + 1])]
+            del index
+        lcDir = None
+        if hasHeader and len(lcfile.directory):
+            lcDir = LCDirEntry()
+            lcDir.readRecord(lcfile.directory[0])
+    times, mux = arrays
+    if patches:
+        blocks = np.array(sorted(patches))
+        headers = np.frombuffer(b''.join(patches[x] for x in blocks),
+                                dtype=BLOCK_HEADER_DTYPE)
+        times[blocks - firstBlock] = block_times_msec(headers)
+        mux[blocks - firstBlock] = headers['muxChannel']
+
+    n_ch = lcHeader.numberOfChannels
+    if split in ('daily', 'hourly'):
+        period = 86400000 if split == 'daily' else 3600000
+        ch0 = np.flatnonzero(mux == 0)
+        keys = np.floor_divide(times[ch0], period)
+        starts = ch0[np.flatnonzero(keys[1:] != keys[:-1]) + 1].tolist()
+    else:
+        n_split = max(int(split) - int(split) % n_ch, n_ch)
+        starts = list(range(n_split, len(times), n_split))
+    starts = [0] + starts
+    pieces = list(zip(starts, starts[1:] + [len(times)]))
+    outfilenames = [fileRoot + '_' + msec_to_datetime(times[a]).strftime(
+        "%Y%m%dT%H%M%S") + '.fix.lch' for a, b in pieces]
+    for outfilename in outfilenames:
+        if os.path.exists(outfilename):
+            print(f"output file {outfilename} exists already! Quitting")
+            sys.exit(2)
+
+    lcData = LCDataBlock()
+    for (a, b), outfilename in zip(pieces, outfilenames):
+        first, last = firstBlock + a, firstBlock + b - 1
+        with open(outfilename, 'wb') as ofp:
+            lcData.seekBlock(ofp, lcHeader.dataStart)
+            _copy_blocks_patched(ifp1, ofp, first, last,
+                                 {k: v for k, v in patches.items()
+                                  if first <= k <= last})
+            dir_times = [msec_to_datetime(x)
+                         for x in times[a:b:DIRBLOCKS].tolist()]
+            write_header_and_directory(ofp, lcHeader, b - a, dir_times,
+                                       lcDir)
+    return outfilenames
+
+
+def _count_bad_dir_entries(ifp1, lcHeader, lastBlock):
+    """
+    Count the directory entries with BAD_DIRBLOCKS blocks (BUG3)
+
+    :param lastBlock: last block of the file
+    """
+    lcDir = LCDirEntry()
+    lcDir.seekBlock(ifp1, lcHeader.dirStart)
+    n_bad = 0
+    for _ in range(lcHeader.dirCount):
+        lcDir.readDirEntry(ifp1)
+        if lcDir.blockNumber > lastBlock:
+            break
+        if lcDir.numBlocks == BAD_DIRBLOCKS:
+            n_bad += 1
+    return n_bad
+
+
+def _copy_blocks_patched(ifp1, ofp1, firstBlock, lastBlock, patches):
+    """
+    Copy blocks to the output file, then replace some block headers
+
+    :param ofp1: output file pointer, positioned at the first output block
+    :param patches: new packed block headers, keyed by block number
+    """
+    ofp1.flush()
+    outBlock = int(ofp1.tell() / BLOCK_SIZE)
+    n_blocks = lastBlock + 1 - firstBlock
+    copy_blocks(ifp1, ofp1, firstBlock, n_blocks, outBlock)
+    for block in sorted(patches):
+        ofp1.seek((outBlock + block - firstBlock) * BLOCK_SIZE)
+        ofp1.write(patches[block])
+    ofp1.seek((outBlock + n_blocks) * BLOCK_SIZE)
+
+
+class _PatchedFile():
+    """
+    An LCHEAPO file whose writes are held in memory until commit()
+
+    Reads return the file contents with the pending writes applied.
+    Writes that do not change the file's contents are dropped.  Each write
+    must stay within one of the file's blocks.
+    """
+    def __init__(self, filename, _pending=None, _sorted=None):
+        self.filename = filename
+        self.fp = open(filename, 'rb')
+        # (original, new) bytes, keyed by file offset
+        self.pending = {} if _pending is None else _pending
+        # Sorted offsets of the pending writes
+        self._sorted = [] if _sorted is None else _sorted
+
+    def reopen(self):
+        """
+        Return a second pointer to the file, sharing the pending writes
+        """
+        return _PatchedFile(self.filename, self.pending, self._sorted)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.fp.seek(offset, whence)
+
+    def tell(self):
+        return self.fp.tell()
+
+    def read(self, size):
+        pos = self.fp.tell()
+        buf = self.fp.read(size)
+        offsets = self._sorted
+        first = bisect.bisect_left(offsets, pos - BLOCK_SIZE)
+        last = bisect.bisect_left(offsets, pos + len(buf))
+        if first == last:
+            return buf
+        buf = bytearray(buf)
+        for offset in offsets[first:last]:
+            new = self.pending[offset][1]
+            start, end = max(offset, pos), min(offset + len(new),
+                                               pos + len(buf))
+            if start < end:
+                buf[start - pos:end - pos] = new[start - offset:end - offset]
+        return bytes(buf)
+
+    def write(self, data):
+        pos = self.fp.tell()
+        original = self.fp.read(len(data))
+        if original == data:
+            if self.pending.pop(pos, None) is not None:
+                del self._sorted[bisect.bisect_left(self._sorted, pos)]
+        else:
+            if pos not in self.pending:
+                bisect.insort(self._sorted, pos)
+            self.pending[pos] = (original, bytes(data))
+
+    def commit(self, journal_name):
+        """
+        Save the original bytes to an undo journal, then write the changes
+
+        :param journal_name: undo journal file name
+        :returns: number of records written
+        """
+        records = [[offset, orig.hex(), new.hex()]
+                   for offset, (orig, new) in sorted(self.pending.items())]
+        with open(journal_name, 'w') as fp:
+            json.dump({'file': os.path.split(self.filename)[1],
+                       'size': os.path.getsize(self.filename),
+                       'records': records}, fp, indent=0)
+            fp.flush()
+            os.fsync(fp.fileno())
+        _write_records(self.filename, [(x[0], x[2]) for x in records])
+        self.pending.clear()
+        self._sorted.clear()
+        return len(records)
+
+    def close(self):
+        self.fp.close()
+
+
+def _write_records(filename, records):
+    """
+    Write (offset, hex string) records into a file
+    """
+    with open(filename, 'r+b') as fp:
+        for offset, hexdata in records:
+            fp.seek(offset)
+            fp.write(bytes.fromhex(hexdata))
+        fp.flush()
+        os.fsync(fp.fileno())
+
+
+def _undo_in_place(filename, journal_name):
+    """
+    Restore a file corrected by --in-place, using its undo journal
+
+    :param filename: the corrected file
+    :param journal_name: undo journal file name
+    :returns: message
+    """
+    if not os.path.exists(journal_name):
+        print(f"undo journal {journal_name} not found! Quitting")
+        sys.exit(2)
+    with open(journal_name, 'r') as fp:
+        journal = json.load(fp)
+    if os.path.getsize(filename) != journal['size']:
+        print(f"{filename} size does not match {journal_name}! Quitting")
+        sys.exit(2)
+    # Only undo if the file still holds the corrections
+    with open(filename, 'rb') as fp:
+        for offset, _, hexdata in journal['records']:
+            fp.seek(offset)
+            if fp.read(len(hexdata) // 2).hex() != hexdata:
+                print(f"{filename} was modified after {journal_name} was "
+                      "written! Quitting")
+                sys.exit(2)
+    _write_records(filename, [(x[0], x[1]) for x in journal['records']])
+    os.remove(journal_name)
+    return "  {}: {:d} records restored from {}".format(
+        os.path.split(filename)[1], len(journal['records']),
+        os.path.split(journal_name)[1])
+
+
+def _time_and_channel(lcData):
+    """
+    Return the block header values that the fixer can change
+    """
+    return (lcData.msec, lcData.second, lcData.minute, lcData.hour,
+            lcData.day, lcData.month, lcData.year, lcData.muxChannel)
+
+
 def _log_error_2(type, printHeader, currBlock, chan, expect_time, t):
     # LCHEAPO BUG 2 - Isolated time tag error
     logging.info(
@@ -870,16 +1741,6 @@ def _print_blockloop_message(fname, outfilename, forceTime, i,
     return msg
 
 
-def _get_next_time(ifp1, channel, pos):
-    # Get the time at the next occurence of same channel
-    tempData = LCDataBlock()
-    tempData.readBlock(ifp1)
-    while channel != tempData.muxChannel:
-        tempData.readBlock(ifp1)
-    tempTime = tempData.getDateTime()
-    return tempTime
-
-
 # ---------------------------------------------------------------------------
 # Run 'main' if the script is not imported as a module
 # ---------------------------------------------------------------------------
@@ -8,10 +8,15 @@ from __future__ import (absolute_import, division, print_function,
 from future.builtins import *  # NOQA @UnusedWildImport
 
 import sys
+import copy
 import datetime
 import struct
 # import string
 import os
+import mmap
+import zlib
+
+import numpy as np
 
 # ------------------------------------
 # Global Variable Declarations
@@ -20,6 +25,50 @@ PROGRAM_NAME = "lcheapo.py"
 VERSION = "0.3.0"
 HEADER_START = 2
 BLOCK_SIZE = 512
+BLOCK_HEADER_SIZE = 14
+SAMPLES_PER_BLOCK = 166
+MAX_BLOCK_READ = 2048   # max number of blocks to read at once
+DIRBLOCKS = 14336       # blocks per directory entry
+BAD_DIRBLOCKS = 16384   # wrong numBlocks of some directory entries (BUG3)
+TIME_PROBE_BLOCKS = 256  # max blocks probed around bad times by find_block()
+MAX_TIME_JUMP_MSEC = 86400000   # largest forward time jump in valid data
+
+# Data block header, packed big endian (see LCDataBlock.readBlock)
+_BLOCK_HEADER_FIELDS = [('msec', '>u2'), ('second', 'u1'), ('minute', 'u1'),
+                        ('hour', 'u1'), ('day', 'u1'), ('month', 'u1'),
+                        ('year', 'u1'), ('blockFlag', 'u1'),
+                        ('muxChannel', 'u1'), ('numberOfSamples', '>u2'),
+                        ('U1', 'u1'), ('U2', 'u1')]
+BLOCK_HEADER_DTYPE = np.dtype(_BLOCK_HEADER_FIELDS)
+BLOCK_DTYPE = np.dtype(_BLOCK_HEADER_FIELDS
+                       + [('data', 'V{:d}'.format(BLOCK_SIZE
+                                                  - BLOCK_HEADER_SIZE))])
+# Block headers seen in place within full blocks (no copy)
+BLOCK_HEADER_VIEW_DTYPE = np.dtype(
+    {'names': [x[0] for x in _BLOCK_HEADER_FIELDS],
+     'formats': [x[1] for x in _BLOCK_HEADER_FIELDS],
+     'offsets': [BLOCK_DTYPE.fields[x[0]][1] for x in _BLOCK_HEADER_FIELDS],
+     'itemsize': BLOCK_SIZE})
+# Directory entry, packed big endian (see LCDirEntry.readDirEntry)
+DIR_ENTRY_DTYPE = np.dtype([('msec', '>u2'), ('second', 'u1'),
+                            ('minute', 'u1'), ('hour', 'u1'), ('day', 'u1'),
+                            ('month', 'u1'), ('year', 'u1'),
+                            ('blockNumber', '>u4'), ('recordLength', '>u4'),
+                            ('sampleRate', '>u2'), ('numBlocks', '>u2'),
+                            ('flag', 'u1'), ('muxChannel', 'u1'),
+                            ('U1', 'V10')])
+# getDateTime() value for unreadable times (1900-01-01), in msec since 1970
+BOGUS_MSEC = -2208988800000
+# Block index file (see LCIndex)
+INDEX_SUFFIX = '.lchidx'
+INDEX_VERSION = 1
+INDEX_BAD_HEADER = 1    # Unexpected non-time header values
+INDEX_BAD_TIME = 2      # Impossible time (BOGUS_MSEC)
+INDEX_BAD_CHANNEL = 4   # muxChannel >= number of channels
+# magic, version, header checksum, file size, file mtime (ns), n_blocks,
+# n_dir, last valid block, n_channels
+_INDEX_HEADER = struct.Struct('<8sIIqqqqqi4x')
+_INDEX_MAGIC = b'LCHEAPO\0'
 
 
 class LCCommon:
@@ -286,6 +335,16 @@ class LCDirEntry (LCCommon):
         (self.flag, self.muxChannel) = struct.unpack('>2B', fp.read(2))
         self.U1 = struct.unpack('>10B', fp.read(10))  # Unused
 
+    def readRecord(self, rec):
+        """
+        Fill the directory entry from a DIR_ENTRY_DTYPE record
+        """
+        (self.msec, self.second, self.minute, self.hour, self.day,
+         self.month, self.year, self.blockNumber, self.recordLength,
+         self.sampleRate, self.numBlocks, self.flag, self.muxChannel) =\
+            [int(rec[x]) for x in DIR_ENTRY_DTYPE.names[:-1]]
+        self.U1 = tuple(rec['U1'].tobytes())  # Unused
+
     def writeDirEntry(self, fp):
         """
         Write an LCheapo directory entry (packed big endian format)
@@ -333,17 +392,32 @@ class LCDataBlock (LCCommon):
         (self.U1, self.U2) = struct.unpack('>BB', fp.read(2))
         self.data = fp.read(498)
 
-    def writeBlock(self, fp):
-        "Write a block of LCheapo data to the specified pointer."
+    def readRecord(self, rec):
+        """
+        Fill the block from a BLOCK_DTYPE or BLOCK_HEADER_DTYPE record
+
+        If the record has no data field, self.data is not changed
+        """
+        (self.msec, self.second, self.minute, self.hour, self.day,
+         self.month, self.year, self.blockFlag, self.muxChannel,
+         self.numberOfSamples, self.U1, self.U2) =\
+            [int(rec[x[0]]) for x in _BLOCK_HEADER_FIELDS]
+        if 'data' in rec.dtype.names:
+            self.data = rec['data'].tobytes()
+
+    def packHeader(self):
+        "Return the block header, packed big endian."
         timeData = struct.pack('>HBBBBBB', self.msec, self.second,
                                self.minute, self.hour, self.day, self.month,
                                self.year)
         flagData = struct.pack('>BBH', self.blockFlag, self.muxChannel,
                                self.numberOfSamples)
         uData = struct.pack('>BB', self.U1, self.U2)
-        fp.write(timeData)
-        fp.write(flagData)
-        fp.write(uData)
+        return timeData + flagData + uData
+
+    def writeBlock(self, fp):
+        "Write a block of LCheapo data to the specified pointer."
+        fp.write(self.packHeader())
         fp.write(self.data)
 
     def printHexDumpOfHeader(self, annotated=False):
@@ -359,59 +433,27 @@ class LCDataBlock (LCCommon):
 
     def printDecimalDumpOfHeader(self, annotated=False):
         "Print out the data header in decimal format."
-        if annotated:
-            fmt = "ms:{:4d} s:{:02d} mn:{:02d} hr:{:02d} dy:{:02d} " +\
-                  "mo:{:02d} yr:{:02d} Flag:{:03d} Chan:{:02d} Samples:{:4d}"
-        else:
-            fmt = "{:4d} {:02d} {:02d} {:02d} {:02d} {:02d} {:02d} " +\
-                  "{:03d} {:02d} {:4d}"
-        print(fmt.format(self.msec, self.second, self.minute, self.hour,
-                         self.day, self.month, self.year, self.blockFlag,
-                         self.muxChannel, self.numberOfSamples))
+        fmt, fields = _HEADER_DUMP_FMTS['decimal', annotated]
+        print(fmt.format(*[getattr(self, x) for x in fields]))
 
     def prettyPrintHeader(self, annotated=False):
         "Print out the data header in pretty format."
-        if annotated:
-            fmt = "DateTime:{:02d}/{:02d}/{:02d}-{:02d}:{:02d}:{:02d}." +\
-                  "{:03d} Flag:{:03d} Chan:{:02d} Samples:{:4d} " +\
-                  "U1:{:03d} U2:{:03d}"
-        else:
-            fmt = "{:02d}/{:02d}/{:02d}-{:02d}:{:02d}:{:02d}.{:03d}" +\
-                  "  F{:03d} CH{:02d} {:4d} samps U1={:03d} U2={:03d}"
-        print(fmt.format(self.year, self.month, self.day, self.hour,
-                         self.minute, self.second, self.msec,
-                         self.blockFlag, self.muxChannel,
-                         self.numberOfSamples, self.U1, self.U2))
+        fmt, fields = _HEADER_DUMP_FMTS['pretty', annotated]
+        print(fmt.format(*[getattr(self, x) for x in fields]))
 
     def convertDataTo24BitValues(self):
         "Convert the data block into a list of 24-bit values."
-        data = [x * (1 << 16) + y * (1 << 8) + z
-                for x, y, z in [struct.unpack(">bBB", self.data[x:x + 3])
-                                for x in range(0, 498, 3)]]
-        return data
+        return data_to_int32(self.data).tolist()
 
     def printHexDumpOfData(self):
         "Print out the data block in hexidecimal format."
-        count = 0
-        for i in struct.unpack(">498B", self.data):
-            sys.stdout.write("{:02x}".format(i))
-            count += 1
-            if count % 3 == 0:
-                sys.stdout.write("  ")
-            if count % 30 == 0:
-                sys.stdout.write("\n")
-        sys.stdout.write("\n")
+        sys.stdout.write(_hex_dump(
+            np.frombuffer(self.data, dtype=np.uint8).reshape(1, -1))[0])
 
     def printDecimalDumpOfData(self):
         "Print out the data block in decimal format."
-        count = 0
-        data = self.convertDataTo24BitValues()
-        for i in data:
-            sys.stdout.write("{:8d} ".format(i))
-            count += 1
-            if count % 8 == 0:
-                sys.stdout.write("\n")
-        sys.stdout.write("\n")
+        sys.stdout.write(_DECIMAL_DUMP_FMT.format(
+            *self.convertDataTo24BitValues()))
 
     def __str__(self):
         ch_str = "CH:{:d}".format(self.muxChannel)
@@ -422,6 +464,950 @@ class LCDataBlock (LCCommon):
         return "{}  {}  {}".format(ch_str, samp_str, date_str)
 
 
+class LCFile:
+    """
+    Memory-mapped LCHEAPO file
+
+    Gives zero-copy (read-only) views of the file contents:
+        - header: the disk header (LCDiskHeader, None if there is none)
+        - directory: the directory entries (array of DIR_ENTRY_DTYPE)
+        - blocks: all full blocks of the file (array of BLOCK_DTYPE),
+          f.blocks[i] or f.blocks[a:b]
+        - headers: the block headers (array of BLOCK_HEADER_VIEW_DTYPE),
+          f.headers[a:b]
+
+    Indices are file block numbers, as used by seekBlock() and lcdump.
+    Use as a context manager, or call close() when done
+    """
+    def __init__(self, filename, read_header=True):
+        """
+        :param filename: LCHEAPO file name
+        :param read_header: read the disk header and directory (set False
+            for headerless files)
+        """
+        self.filename = str(filename)
+        self._fp = open(filename, 'rb')
+        self.n_blocks = int(os.fstat(self._fp.fileno()).st_size / BLOCK_SIZE)
+        if self.n_blocks > 0:
+            self._mm = mmap.mmap(self._fp.fileno(),
+                                 self.n_blocks * BLOCK_SIZE,
+                                 access=mmap.ACCESS_READ)
+        else:
+            self._mm = None
+        self.blocks = np.frombuffer(self._mm or b'', dtype=BLOCK_DTYPE,
+                                    count=self.n_blocks)
+        self.headers = self.blocks.view(BLOCK_HEADER_VIEW_DTYPE)
+        self.header = None
+        self.directory = np.zeros(0, dtype=DIR_ENTRY_DTYPE)
+        self._index = None
+        if read_header and self.n_blocks > HEADER_START:
+            self.header = LCDiskHeader()
+            if self.header.readHeader(self._mm) == 0:
+                self.header = None
+            else:
+                n_dir = min(self.header.dirCount,
+                            int((self.n_blocks - self.header.dirStart)
+                                * BLOCK_SIZE / DIR_ENTRY_DTYPE.itemsize))
+                if n_dir > 0:
+                    self.directory = np.frombuffer(
+                        self._mm, dtype=DIR_ENTRY_DTYPE, count=n_dir,
+                        offset=self.header.dirStart * BLOCK_SIZE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.n_blocks
+
+    def getBlock(self, block):
+        """
+        Return an LCDataBlock for the given block number
+
+        The block's data is a memoryview into the file (no copy)
+        """
+        if not 0 <= block < self.n_blocks:
+            raise IndexError(f'block {block:d} is outside of file '
+                             f'(0-{self.n_blocks - 1:d})')
+        lcData = LCDataBlock()
+        lcData.readRecord(self.headers[block])
+        offset = block * BLOCK_SIZE
+        lcData.data = memoryview(self._mm)[offset + BLOCK_HEADER_SIZE:
+                                           offset + BLOCK_SIZE]
+        return lcData
+
+    def getIndex(self, build=False, save=True):
+        """
+        Return the file's block index
+
+        The index is read from the file's index file if it is up to date
+
+        :param build: build the index if there is no up to date index file
+        :param save: save a built index to the index file
+        :returns: LCIndex (None if there is none and build is False)
+        """
+        if self._index is None:
+            self._index = load_index(self.filename)
+        if self._index is None and build:
+            self._index = build_index(self)
+            if save:
+                self._index.save(self.filename)
+        return self._index
+
+    def close(self):
+        """
+        Release the views and close the file
+        """
+        self.blocks = self.headers = self.directory = self._index = None
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                pass    # views still in use, closed when they are deleted
+            self._mm = None
+        self._fp.close()
+
+
+def data_to_int32(data):
+    """
+    Decode big endian 24-bit samples
+
+    :param data: bytes-like or uint8 array, whose last dimension holds the
+        3-byte samples (e.g. one block's data, or an (N, 498) array)
+    :returns: numpy int32 array with one less byte per sample (e.g. (166,)
+        or (N, 166))
+    """
+    data = np.asarray(np.frombuffer(data, dtype=np.uint8)
+                      if not isinstance(data, np.ndarray) else data)
+    samples = data.reshape(data.shape[:-1] + (-1, 3))
+    # Pad each sample to 4 bytes and shift back down to sign extend
+    padded = np.zeros(samples.shape[:-1] + (4,), dtype=np.uint8)
+    padded[..., :3] = samples
+    return (padded.view('>i4')[..., 0] >> 8).astype(np.int32)
+
+
+def blocks_to_int32(blocks):
+    """
+    Decode the samples of a run of data blocks in one pass
+
+    :param blocks: array of BLOCK_DTYPE (e.g. LCFile.blocks[a:b]), or
+        bytes-like holding whole blocks
+    :returns: (N, SAMPLES_PER_BLOCK) numpy int32 array
+    """
+    if isinstance(blocks, np.ndarray):
+        raw = np.ascontiguousarray(blocks).view(np.uint8)
+    else:
+        raw = np.frombuffer(blocks, dtype=np.uint8)
+    raw = raw.reshape(-1, BLOCK_SIZE)
+    return data_to_int32(raw[:, BLOCK_HEADER_SIZE:])
+
+
+def iter_blocks(fp, first_block=0, n_blocks=None,
+                chunk_blocks=MAX_BLOCK_READ):
+    """
+    Read consecutive data blocks in chunks
+
+    :param fp: input file pointer, or LCFile (chunks are then views of
+        the file, without copy)
+    :param first_block: first block to read
+    :param n_blocks: number of blocks to read (None = to end of file)
+    :param chunk_blocks: maximum number of blocks per chunk
+    :returns: generator of (chunk first block, BLOCK_DTYPE array)
+    """
+    if isinstance(fp, LCFile):
+        if n_blocks is None:
+            n_blocks = fp.n_blocks - first_block
+        last = min(first_block + n_blocks, fp.n_blocks)
+        for block in range(first_block, last, chunk_blocks):
+            yield block, fp.blocks[block:min(block + chunk_blocks, last)]
+        return
+    if n_blocks is None:
+        fp.seek(0, os.SEEK_END)
+        n_blocks = int(fp.tell() / BLOCK_SIZE) - first_block
+    fp.seek(first_block * BLOCK_SIZE, os.SEEK_SET)
+    block = first_block
+    while n_blocks > 0:
+        buf = fp.read(min(n_blocks, chunk_blocks) * BLOCK_SIZE)
+        n_read = int(len(buf) / BLOCK_SIZE)
+        if n_read == 0:
+            break
+        yield block, np.frombuffer(buf, dtype=BLOCK_DTYPE, count=n_read)
+        block += n_read
+        n_blocks -= n_read
+
+
+def copy_blocks(ifp, ofp, first_block, n_blocks, out_block):
+    """
+    Copy consecutive data blocks from one file to another
+
+    The copy is done by the kernel if possible (os.copy_file_range(),
+    which can share the blocks on filesystems that support reflinks, then
+    os.sendfile()), otherwise by reading chunks into a reusable buffer.
+    The file positions are not changed, except by the buffered copy.
+
+    :param ifp: input file pointer
+    :param ofp: output file pointer (opened for writing, unbuffered or
+        flushed)
+    :param first_block: first input block to copy
+    :param n_blocks: number of blocks to copy
+    :param out_block: output block to copy the first block to
+    :returns: number of bytes copied
+    """
+    in_offset, out_offset = first_block * BLOCK_SIZE, out_block * BLOCK_SIZE
+    n_bytes = n_blocks * BLOCK_SIZE
+    in_fd, out_fd = ifp.fileno(), ofp.fileno()
+    done = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while done < n_bytes:
+                n = os.copy_file_range(in_fd, out_fd, n_bytes - done,
+                                       in_offset + done, out_offset + done)
+                if n == 0:
+                    break
+                done += n
+        except OSError:  # Not supported for these files
+            pass
+    if done < n_bytes and hasattr(os, 'sendfile'):
+        out_pos = os.lseek(out_fd, 0, os.SEEK_CUR)
+        try:
+            os.lseek(out_fd, out_offset + done, os.SEEK_SET)
+            while done < n_bytes:
+                n = os.sendfile(out_fd, in_fd, in_offset + done,
+                                n_bytes - done)
+                if n == 0:
+                    break
+                done += n
+        except OSError:  # Not supported for these files
+            pass
+        finally:
+            os.lseek(out_fd, out_pos, os.SEEK_SET)
+    if done < n_bytes:
+        buf = bytearray(MAX_BLOCK_READ * BLOCK_SIZE)
+        view = memoryview(buf)
+        ifp.seek(in_offset + done, os.SEEK_SET)
+        ofp.seek(out_offset + done, os.SEEK_SET)
+        while done < n_bytes:
+            n = ifp.readinto(view[:min(len(buf), n_bytes - done)])
+            if not n:
+                break
+            ofp.write(view[:n])
+            done += n
+    return done
+
+
+def write_header_and_directory(fp, lcHeader, n_blocks, dir_times,
+                               lcDir=None):
+    """
+    Write the disk header and directory of n_blocks data blocks at dataStart
+
+    The directory has an entry every DIRBLOCKS blocks from dataStart.  The
+    header's directory count and block and its write block are set to
+    correspond.
+
+    :param fp: output file pointer
+    :param lcHeader: disk header (is not modified)
+    :type  lcHeader: :class: `LCDiskHeader`
+    :param n_blocks: number of data blocks
+    :param dir_times: times of the blocks pointed to by each directory entry
+        (dataStart + i*DIRBLOCKS)
+    :type  dir_times: list of :class: `datetime.datetime`
+    :param lcDir: directory entry giving the other entry values (default:
+        lcHeader's sample rate and flag 73)
+    :type  lcDir: :class: `LCDirEntry`
+    """
+    if lcDir is None:
+        lcDir = LCDirEntry()
+        lcDir.recordLength, lcDir.flag, lcDir.muxChannel = 0, 73, 0
+        lcDir.sampleRate = lcHeader.sampleRate
+    lcDir = copy.copy(lcDir)
+    lcDir.seekBlock(fp, lcHeader.dirStart)
+    for offset, tm in zip(range(0, n_blocks, DIRBLOCKS), dir_times):
+        lcDir.blockNumber = lcHeader.dataStart + offset
+        lcDir.numBlocks = min(DIRBLOCKS, n_blocks - offset)
+        lcDir.changeTime(tm)
+        lcDir.writeDirEntry(fp)
+    lcHeader = copy.copy(lcHeader)
+    lcHeader.dirCount = len(range(0, n_blocks, DIRBLOCKS))
+    lcHeader.dirBlock = lcHeader.dirStart + int(lcHeader.dirCount / 16)
+    lcHeader.writeBlock = lcHeader.dataStart + n_blocks
+    lcHeader.seekHeaderPosition(fp)
+    lcHeader.writeHeader(fp)
+
+
+def read_block_headers(fp, first_block=0, n_blocks=None,
+                       chunk_blocks=MAX_BLOCK_READ):
+    """
+    Read the headers of consecutive data blocks in one call
+
+    Columns are accessed by field name, e.g. headers['muxChannel']
+
+    :param fp: input file pointer
+    :param first_block: first block to read
+    :param n_blocks: number of blocks to read (None = to end of file)
+    :param chunk_blocks: maximum number of blocks read at once
+    :returns: numpy array of BLOCK_HEADER_DTYPE
+    """
+    chunks = [blocks.view(BLOCK_HEADER_VIEW_DTYPE).astype(BLOCK_HEADER_DTYPE)
+              for _, blocks in iter_blocks(fp, first_block, n_blocks,
+                                           chunk_blocks)]
+    if not chunks:
+        return np.zeros(0, dtype=BLOCK_HEADER_DTYPE)
+    return np.concatenate(chunks)
+
+
+def iter_channel_samples(fp, n_channels, first_block=0, n_blocks=None,
+                         chunk_blocks=MAX_BLOCK_READ):
+    """
+    Demultiplex data blocks into per-channel sample streams
+
+    The blocks are read in chunks of at most chunk_blocks blocks (rounded
+    to a multiple of n_channels), so memory use does not depend on the
+    number of blocks.  Blocks are assigned to channels using their
+    muxChannel, blocks with impossible channel numbers are skipped.
+
+    :param fp: input file pointer or LCFile
+    :param n_channels: number of channels (LCDiskHeader.numberOfChannels)
+    :param first_block: first block to read (should be a channel 0 block)
+    :param n_blocks: number of blocks to read (None = to end of file)
+    :param chunk_blocks: maximum number of blocks per chunk
+    :returns: generator of (start_times, samples) for each chunk, where
+        start_times[c] is the time of channel c's first block in the chunk
+        (msec since 1970, None if there is none) and samples[c] is a
+        contiguous int32 array of channel c's samples in the chunk
+    """
+    chunk_blocks = max(chunk_blocks - chunk_blocks % n_channels, n_channels)
+    for _, blocks in iter_blocks(fp, first_block, n_blocks, chunk_blocks):
+        mux = blocks['muxChannel']
+        samples = blocks_to_int32(blocks)
+        times = block_times_msec(blocks)
+        start_times, channel_samples = [], []
+        for channel in range(n_channels):
+            inds = np.flatnonzero(mux == channel)
+            start_times.append(int(times[inds[0]]) if len(inds) else None)
+            channel_samples.append(samples[inds].ravel())
+        yield start_times, channel_samples
+
+
+def format_block_headers(headers, style='pretty', annotated=False):
+    """
+    Format block headers like LCDataBlock.prettyPrintHeader() or
+    LCDataBlock.printDecimalDumpOfHeader()
+
+    :param headers: array of BLOCK_HEADER_DTYPE (or BLOCK_DTYPE, or
+        LCFile.headers)
+    :param style: 'pretty' or 'decimal'
+    :param annotated: use the annotated format
+    :returns: list of str, one per block (without newline)
+    """
+    fmt, fields = _HEADER_DUMP_FMTS[style, annotated]
+    columns = [headers[x].tolist() for x in fields]
+    return [fmt.format(*x) for x in zip(*columns)]
+
+
+def hex_dump_blocks(blocks):
+    """
+    Format the data of whole blocks like LCDataBlock.printHexDumpOfData()
+
+    :param blocks: array of BLOCK_DTYPE (e.g. LCFile.blocks[a:b])
+    :returns: list of str, one per block (ending with a newline)
+    """
+    raw = np.ascontiguousarray(blocks).view(np.uint8)
+    return _hex_dump(raw.reshape(-1, BLOCK_SIZE)[:, BLOCK_HEADER_SIZE:])
+
+
+def _hex_dump(raw):
+    """
+    Hexadecimal dump of equal length byte strings
+
+    Bytes are written in groups of 3 followed by 2 spaces, 10 groups per
+    line
+
+    :param raw: (N, n_bytes) numpy uint8 array
+    :returns: list of N str
+    """
+    n_bytes = raw.shape[1]
+    chars = np.empty((raw.shape[0], 2 * n_bytes + 2), dtype=np.uint8)
+    chars[:, 0:2 * n_bytes:2] = _HEX_DIGITS[raw >> 4]
+    chars[:, 1:2 * n_bytes:2] = _HEX_DIGITS[raw & 15]
+    chars[:, -2:] = [ord(' '), ord('\n')]
+    # Positions in chars of each output character
+    index = []
+    for i in range(n_bytes):
+        index += [2 * i, 2 * i + 1]
+        if (i + 1) % 3 == 0:
+            index += [2 * n_bytes] * 2
+        if (i + 1) % 30 == 0:
+            index.append(2 * n_bytes + 1)
+    index.append(2 * n_bytes + 1)
+    text = np.ascontiguousarray(chars[:, index])
+    return [x.decode('ascii') for x in text.view('S{:d}'.format(
+        len(index))).ravel().tolist()]
+
+
+def block_times_msec(headers):
+    """
+    Return block header times as milliseconds since 1970-01-01
+
+    Gives the same times as LCCommon.getDateTime(), including the bogus
+    date (BOGUS_MSEC) for impossible time values
+
+    :param headers: array of BLOCK_HEADER_DTYPE (or BLOCK_DTYPE)
+    :returns: numpy int64 array
+    """
+    year = headers['year'].astype(np.int64)
+    year = np.where(year < 50, year + 2000,
+                    np.where((year > 50) & (year < 100), year + 1900, year))
+    month = headers['month'].astype(np.int64)
+    day = headers['day'].astype(np.int64)
+    hour = headers['hour'].astype(np.int64)
+    minute = headers['minute'].astype(np.int64)
+    second = headers['second'].astype(np.int64)
+    msec = headers['msec'].astype(np.int64)
+    valid = ((month >= 1) & (month <= 12) & (day >= 1) & (hour < 24)
+             & (minute < 60) & (second < 60) & (msec < 1000))
+    months = np.where(valid, (year - 1970) * 12 + month - 1, 0)
+    first_day = months.astype('datetime64[M]').astype('datetime64[D]')
+    month_len = ((months + 1).astype('datetime64[M]').astype('datetime64[D]')
+                 - first_day).astype(np.int64)
+    valid &= day <= month_len
+    days = first_day.astype(np.int64) + day - 1
+    msecs = (((days * 24 + hour) * 60 + minute) * 60 + second) * 1000 + msec
+    return np.where(valid, msecs, BOGUS_MSEC)
+
+
+def msec_to_datetime(msec):
+    """
+    Convert milliseconds since 1970-01-01 to a datetime
+    """
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(
+        milliseconds=int(msec))
+
+
+def datetime_to_msec(tm):
+    """
+    Convert a datetime to milliseconds since 1970-01-01
+    """
+    delta = tm - datetime.datetime(1970, 1, 1)
+    return (delta.days * 86400 + delta.seconds) * 1000 + \
+        int(delta.microseconds / 1000)
+
+
+def find_block(lcfile, time, channel=0, n_channels=None, sample_rate=None,
+               probe_blocks=TIME_PROBE_BLOCKS):
+    """
+    Find the block and sample holding a channel's data at a given time
+
+    The search range is narrowed using the directory, then by a binary
+    search over the block times, so that only O(log n) block headers are
+    read (none if the file's index is loaded).  Blocks whose time does not
+    follow from the time of the channel's next (or previous) block, such as
+    isolated bad times and time tears, are stepped over by probing at most
+    probe_blocks following blocks.  A time in a data gap gives the first
+    sample after the gap.
+
+    :param lcfile: the LCHEAPO file
+    :type  lcfile: :class: `LCFile`
+    :param time: time to look for
+    :type  time: :class: `datetime.datetime`
+    :param channel: channel number
+    :param n_channels: number of channels (default: from the disk header)
+    :param sample_rate: sampling rate (default: from the disk header)
+    :param probe_blocks: maximum number of blocks probed after a bad block
+    :returns: (block number, sample index in the block)
+    :raises ValueError: if the time is outside of the file's data, or if
+        there is no good block time in a probed block range
+    """
+    header = lcfile.header
+    if n_channels is None:
+        n_channels = header.numberOfChannels
+    if sample_rate is None:
+        sample_rate = header.realSampleRate
+    if not 0 <= channel < n_channels:
+        raise ValueError(f'channel {channel:d} is outside of 0-'
+                         f'{n_channels - 1:d}')
+    finder = _BlockTimes(lcfile, n_channels,
+                         int((SAMPLES_PER_BLOCK * (1.0 / sample_rate)) * 1000),
+                         probe_blocks)
+    msec = datetime_to_msec(time)
+
+    # Narrow down the search using the directory, then the block times
+    first = header.dataStart if header is not None else 0
+    lo = finder.goodBlock(first, finder.last + 1)
+    if lo is None:
+        raise ValueError(f'no good block time in blocks {first:d}-'
+                         f'{first + probe_blocks:d}')
+    if msec < finder.time(lo):
+        raise ValueError(f'{time} is before the start of the data '
+                         f'({msec_to_datetime(finder.time(lo))})')
+    lo, hi = finder.dirLimits(lo, msec)
+    while hi - lo > 4 * n_channels:
+        mid = int((lo + hi) / 2)
+        good = finder.goodBlock(mid, hi)
+        if good is None:
+            hi = mid    # No good time up to hi
+        elif finder.time(good) <= msec:
+            lo = good
+        else:
+            hi = mid
+
+    # Find the channel's block, looking in the neighboring blocks
+    block, block_time = None, None
+    for b in range(max(first, lo - n_channels + 1),
+                   min(hi + n_channels, finder.last + 1)):
+        t = finder.time(b)
+        if finder.mux(b) == channel and t != BOGUS_MSEC and t <= msec:
+            block, block_time = b, t
+    if block is None or msec >= block_time + finder.block_msec:
+        # In a gap: take the channel's next block
+        start = block + 1 if block is not None else lo
+        block = finder.nextChannelBlock(start, channel, msec)
+        if block is None:
+            raise ValueError(f'{time} is after the end of the data')
+        return block, 0
+    return block, min(int((msec - block_time) * sample_rate / 1000),
+                      SAMPLES_PER_BLOCK - 1)
+
+
+def find_last_block(lcfile, first_block=None, n_channels=None,
+                    sample_rate=None, probe_blocks=TIME_PROBE_BLOCKS):
+    """
+    Return the last valid data block of an LCHEAPO file
+
+    Recovered disks often end with zero-filled blocks, garbage or old data.
+    A block is valid if its date is possible, its numberOfSamples is
+    SAMPLES_PER_BLOCK and its muxChannel < n_channels, and if its time is
+    not before, nor more than MAX_TIME_JUMP_MSEC after, the time expected
+    from an earlier valid block.  The end of the data is found by a binary
+    search on windows of probe_blocks blocks, followed by a scan of the last
+    window.  When the window at the middle of the search interval has no
+    valid block, windows at doubling distances after it are also probed, so
+    that holes in the data shorter than the data after them are skipped.
+    Only O(log(n)**2) windows are read, however long the trailing garbage.
+
+    :param lcfile: the LCHEAPO file
+    :type  lcfile: :class: `LCFile`
+    :param first_block: first data block (default: dataStart if the file
+        has a header, 0 otherwise)
+    :param n_channels: number of channels (default: from the disk header,
+        channels are not verified if there is none)
+    :param sample_rate: sampling rate (default: from the disk header, the
+        times are then only required to not go backwards if there is none)
+    :param probe_blocks: window size
+    :returns: last valid block (first_block - 1 if there is no valid block
+        in the first window)
+    """
+    header = lcfile.header
+    if first_block is None:
+        first_block = header.dataStart if header is not None else 0
+    if n_channels is None:
+        n_channels = header.numberOfChannels if header is not None else 0
+    if sample_rate is None and header is not None:
+        sample_rate = header.realSampleRate
+    block_msec = (SAMPLES_PER_BLOCK * 1000. / sample_rate if sample_rate
+                  else None)
+
+    def valid_blocks(a, b, ref_block=None, ref_time=None):
+        """Return the valid blocks in [a, b) and their times"""
+        headers = lcfile.headers[a:b]
+        times = block_times_msec(headers)
+        ok = ((times != BOGUS_MSEC)
+              & (headers['numberOfSamples'] == SAMPLES_PER_BLOCK))
+        if n_channels:
+            ok &= headers['muxChannel'] < n_channels
+        if ref_block is not None:
+            ok &= times >= ref_time
+            if block_msec:
+                groups = (np.arange(a, b) - ref_block) // max(n_channels, 1)
+                ok &= (times <= ref_time + (groups + 1) * block_msec
+                       + MAX_TIME_JUMP_MSEC)
+        return a + np.flatnonzero(ok), times[ok]
+
+    blocks, times = valid_blocks(first_block, min(first_block + probe_blocks,
+                                                  lcfile.n_blocks))
+    if len(blocks) == 0:
+        return first_block - 1
+    start, start_time = int(blocks[0]), int(times[0])
+    lo, lo_time = start, start_time
+    hi = lcfile.n_blocks    # Blocks from hi on are not valid
+    while hi - lo > probe_blocks:
+        mid = (lo + hi) // 2
+        a, step = mid, probe_blocks
+        while a < hi:    # Skip holes
+            blocks, times = valid_blocks(a, min(a + probe_blocks, hi),
+                                         lo, lo_time)
+            if len(blocks):
+                break
+            a, step = mid + step, 2 * step
+        if len(blocks):
+            lo, lo_time = int(blocks[-1]), int(times[-1])
+        else:
+            hi = mid    # Older data or nothing from mid on
+    return int(valid_blocks(lo, hi, lo, lo_time)[0][-1])
+
+
+def parse_time(string):
+    """
+    Read an ISO format time (UTC if no time zone is given)
+
+    :returns: datetime (None if string is None)
+    """
+    if string is None:
+        return None
+    t = datetime.datetime.fromisoformat(string.rstrip('Z'))
+    if t.tzinfo is not None:
+        t = t.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return t
+
+
+def time_window_blocks(lcfile, starttime, endtime):
+    """
+    Return the blocks holding a time window, in whole block groups
+
+    The first block is the channel 0 block holding starttime (the first
+    data block if starttime is None or before the data), the last block is
+    the last block of the group holding endtime (the last block if endtime
+    is None or after the data).
+
+    :param lcfile: the LCHEAPO file (with a disk header)
+    :type  lcfile: :class: `lcheapo:LCFile`
+    :param starttime: start time (None for start of data)
+    :param endtime: end time (None for end of data)
+    :returns: first block, last block, message
+    :raises ValueError: if the file has no (possible) disk header, or if
+        there is no data in the window
+    """
+    header = lcfile.header
+    if (header is None or header.numberOfChannels <= 0
+            or header.dataStart >= lcfile.n_blocks):
+        raise ValueError(f'{lcfile.filename} has no disk header, cannot '
+                         'find times')
+    n_ch = header.numberOfChannels
+    first, last = lcfile.header.dataStart, find_last_block(lcfile)
+    last -= (last - first + 1) % n_ch     # Last whole group
+    start, end = first, last
+    if starttime is not None:
+        try:
+            start = find_block(lcfile, starttime, 0)[0]
+        except ValueError:
+            if starttime >= _block_time(lcfile, first):
+                raise
+    if endtime is not None:
+        try:
+            block, sample = find_block(lcfile, endtime, 0)
+            if sample == 0 and _block_time(lcfile, block) > endtime:
+                block -= n_ch       # endtime is in a gap
+            end = min(block + n_ch - 1, last)
+        except ValueError:
+            if endtime <= _block_time(lcfile, last):
+                raise
+    if end < start:
+        raise ValueError(f'no data between {starttime} and {endtime}')
+    return start, end, (f'Times {starttime or "start"} - {endtime or "end"}: '
+                        f'blocks {start:d}-{end:d}')
+
+
+def _block_time(lcfile, block):
+    """
+    Return a block's time as a datetime
+    """
+    return msec_to_datetime(
+        block_times_msec(lcfile.headers[block:block + 1])[0])
+
+
+class _BlockTimes:
+    """
+    Block times and channels read one by one, from the index if there
+    is one
+    """
+    def __init__(self, lcfile, n_channels, block_msec, probe_blocks):
+        self.lcfile = lcfile
+        self.n_channels = n_channels
+        self.block_msec = block_msec
+        self.probe_blocks = probe_blocks
+        self.index = lcfile.getIndex()
+        self.last = lcfile.n_blocks - 1
+        if self.index is not None and self.index.last_valid_block >= 0:
+            self.last = self.index.last_valid_block
+
+    def time(self, block):
+        if self.index is not None:
+            return int(self.index.times[block])
+        return int(block_times_msec(self.lcfile.headers[block:block + 1])[0])
+
+    def mux(self, block):
+        if self.index is not None:
+            return int(self.index.mux[block])
+        return int(self.lcfile.headers[block]['muxChannel'])
+
+    def isGood(self, block):
+        """
+        Is a block's time that of the same channel's next or previous block
+        minus or plus the block duration?
+        """
+        t = self.time(block)
+        if t == BOGUS_MSEC:
+            return False
+        n_ch = self.n_channels
+        if block + n_ch <= self.last:
+            return self.time(block + n_ch) == t + self.block_msec
+        return self.time(block - n_ch) == t - self.block_msec
+
+    def goodBlock(self, block, end):
+        """
+        Return the first block with a good time from block to end (excluded)
+
+        :returns: block number, None if there is none before end
+        :raises ValueError: if there is none in the probed blocks
+        """
+        for b in range(block, min(block + self.probe_blocks + 1, end)):
+            if self.isGood(b):
+                return b
+        if block + self.probe_blocks + 1 < end:
+            raise ValueError(f'no good block time in blocks {block:d}-'
+                             f'{block + self.probe_blocks:d}')
+        return None
+
+    def dirLimits(self, lo, msec):
+        """
+        Return the search limits given by the directory entries
+
+        :param lo: first block with a good time before msec
+        :returns: (first block with a good time before msec, block after
+            the last block to search)
+        """
+        hi = self.last + 1
+        if self.index is not None:
+            dir_times, dir_blocks = self.index.dir_times, self.index.dir_blocks
+        else:
+            dir_times = block_times_msec(self.lcfile.directory)
+            dir_blocks = self.lcfile.directory['blockNumber']
+        entries = [(t, b) for t, b in zip(dir_times.tolist(),
+                                          dir_blocks.tolist())
+                   if t != BOGUS_MSEC and lo < b < hi]
+        before = [b for t, b in entries if t <= msec]
+        if before:
+            try:
+                good = self.goodBlock(before[-1], hi)
+            except ValueError:
+                good = None
+            if good is not None and self.time(good) <= msec:
+                lo = good
+        after = [b for t, b in entries if t > msec and b > lo]
+        if after and self.isGood(after[0]) and self.time(after[0]) > msec:
+            hi = after[0]
+        return lo, hi
+
+    def nextChannelBlock(self, block, channel, msec):
+        """
+        Return the channel's first block after msec, starting at block
+        """
+        for b in range(block, min(block + self.probe_blocks + 1,
+                                  self.last + 1)):
+            t = self.time(b)
+            if self.mux(b) == channel and t != BOGUS_MSEC and t > msec:
+                return b
+        return None
+
+
+class LCIndex:
+    """
+    Block index of an LCHEAPO file
+
+    Holds, for each block of the file:
+        - times: block time (msec since 1970, int64, BOGUS_MSEC if
+          impossible)
+        - mux: muxChannel (uint8)
+        - flags: INDEX_BAD_HEADER | INDEX_BAD_TIME | INDEX_BAD_CHANNEL
+          (uint8, 0 if the block is as expected)
+    and for the directory entries:
+        - dir_times: entry times (msec since 1970)
+        - dir_blocks: entry block numbers
+    as well as the last valid block (flags == 0, after dataStart if there
+    is a header, -1 if there is none)
+
+    The index is saved next to the file (file name + INDEX_SUFFIX) and is
+    valid as long as the file's size, modification time and header blocks
+    are unchanged.  The arrays of a loaded index are memory-mapped, so
+    loading does not depend on the file size.
+    """
+    def __init__(self, key, n_channels, times, mux, flags, dir_times,
+                 dir_blocks, last_valid_block):
+        """
+        :param key: (header checksum, file size, modification time (ns)),
+            see index_key()
+        :param n_channels: number of channels used for INDEX_BAD_CHANNEL
+            (0 if unknown)
+        """
+        self.key = tuple(key)
+        self.n_channels = n_channels
+        self.times = times
+        self.mux = mux
+        self.flags = flags
+        self.dir_times = dir_times
+        self.dir_blocks = dir_blocks
+        self.last_valid_block = last_valid_block
+
+    def __len__(self):
+        return len(self.times)
+
+    def save(self, filename):
+        """
+        Write the index file of an LCHEAPO file
+
+        Errors (e.g. read-only directory) are ignored: the index is then
+        rebuilt when needed.
+
+        :param filename: LCHEAPO file name (not the index file's)
+        :returns: True if the index file was written
+        """
+        ifname = index_filename(filename)
+        tmpname = ifname + '.tmp'
+        try:
+            with open(tmpname, 'wb') as fp:
+                fp.write(_INDEX_HEADER.pack(
+                    _INDEX_MAGIC, INDEX_VERSION, self.key[0], self.key[1],
+                    self.key[2], len(self.times), len(self.dir_times),
+                    self.last_valid_block, self.n_channels))
+                for arr, dtype in ((self.times, '<i8'),
+                                   (self.dir_times, '<i8'),
+                                   (self.dir_blocks, '<i8'),
+                                   (self.mux, 'u1'), (self.flags, 'u1')):
+                    fp.write(np.ascontiguousarray(arr, dtype=dtype).data)
+            os.replace(tmpname, ifname)
+        except OSError:
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
+            return False
+        return True
+
+
+def index_filename(filename):
+    """
+    Return the name of an LCHEAPO file's index file
+    """
+    return str(filename) + INDEX_SUFFIX
+
+
+def index_key(filename):
+    """
+    Return the values that an LCHEAPO file's index is valid for
+
+    :returns: (checksum of the header blocks, file size, modification
+        time (ns))
+    """
+    with open(filename, 'rb') as fp:
+        stat = os.fstat(fp.fileno())
+        crc = zlib.crc32(fp.read((HEADER_START + 1) * BLOCK_SIZE))
+    return crc, stat.st_size, stat.st_mtime_ns
+
+
+def build_index(lcfile, n_channels=None):
+    """
+    Build the block index of an LCHEAPO file in one pass
+
+    :param lcfile: the LCHEAPO file
+    :type  lcfile: :class: `LCFile`
+    :param n_channels: number of channels (default: from the disk header,
+        channels are not verified if there is none)
+    :returns: LCIndex
+    """
+    if n_channels is None:
+        n_channels = (lcfile.header.numberOfChannels
+                      if lcfile.header is not None else 0)
+    times = np.empty(lcfile.n_blocks, dtype=np.int64)
+    mux = np.empty(lcfile.n_blocks, dtype=np.uint8)
+    flags = np.empty(lcfile.n_blocks, dtype=np.uint8)
+    for first, blocks in iter_blocks(lcfile):
+        last = first + len(blocks)
+        times[first:last] = block_times_msec(blocks)
+        mux[first:last] = blocks['muxChannel']
+        bad_hdr = ((blocks['blockFlag'] != 73)
+                   | (blocks['numberOfSamples'] != SAMPLES_PER_BLOCK)
+                   | (blocks['U1'] != 3) | (blocks['U2'] != 166))
+        flags[first:last] = (bad_hdr * INDEX_BAD_HEADER
+                             + (times[first:last] == BOGUS_MSEC)
+                             * INDEX_BAD_TIME)
+        if n_channels:
+            flags[first:last] |= ((mux[first:last] >= n_channels)
+                                  * INDEX_BAD_CHANNEL).astype(np.uint8)
+    data_start = lcfile.header.dataStart if lcfile.header is not None else 0
+    valid = np.flatnonzero(flags[data_start:] == 0)
+    last_valid = int(valid[-1]) + data_start if len(valid) else -1
+    return LCIndex(index_key(lcfile.filename), n_channels, times, mux, flags,
+                   block_times_msec(lcfile.directory),
+                   lcfile.directory['blockNumber'].astype(np.int64),
+                   last_valid)
+
+
+def load_index(filename):
+    """
+    Load an LCHEAPO file's index file
+
+    :param filename: LCHEAPO file name (not the index file's)
+    :returns: LCIndex, or None if there is no index file or if it does not
+        correspond to the file's current contents
+    """
+    ifname = index_filename(filename)
+    try:
+        with open(ifname, 'rb') as fp:
+            values = _INDEX_HEADER.unpack(fp.read(_INDEX_HEADER.size))
+        key = index_key(filename)
+    except (OSError, struct.error):
+        return None
+    (magic, version, crc, size, mtime_ns, n_blocks, n_dir, last_valid,
+     n_channels) = values
+    if (magic != _INDEX_MAGIC or version != INDEX_VERSION
+            or (crc, size, mtime_ns) != key
+            or n_blocks != int(size / BLOCK_SIZE)):
+        return None
+    buf = np.memmap(ifname, dtype=np.uint8, mode='r')
+    if len(buf) != _INDEX_HEADER.size + n_blocks * 10 + n_dir * 16:
+        return None
+    arrays, offset = [], _INDEX_HEADER.size
+    for n, dtype in ((n_blocks, '<i8'), (n_dir, '<i8'), (n_dir, '<i8'),
+                     (n_blocks, 'u1'), (n_blocks, 'u1')):
+        size = n * np.dtype(dtype).itemsize
+        arrays.append(buf[offset:offset + size].view(dtype))
+        offset += size
+    times, dir_times, dir_blocks, mux, flags = arrays
+    return LCIndex(key, n_channels, times, mux, flags, dir_times, dir_blocks,
+                   last_valid)
+
+
+# Block header dump formats and fields (LCDataBlock attribute names), by
+# (style, annotated)
+_HEADER_DUMP_FMTS = {
+    ('decimal', True): (
+        "ms:{:4d} s:{:02d} mn:{:02d} hr:{:02d} dy:{:02d} mo:{:02d} yr:{:02d} "
+        "Flag:{:03d} Chan:{:02d} Samples:{:4d}",
+        ('msec', 'second', 'minute', 'hour', 'day', 'month', 'year',
+         'blockFlag', 'muxChannel', 'numberOfSamples')),
+    ('decimal', False): (
+        "{:4d} {:02d} {:02d} {:02d} {:02d} {:02d} {:02d} {:03d} {:02d} {:4d}",
+        ('msec', 'second', 'minute', 'hour', 'day', 'month', 'year',
+         'blockFlag', 'muxChannel', 'numberOfSamples')),
+    ('pretty', True): (
+        "DateTime:{:02d}/{:02d}/{:02d}-{:02d}:{:02d}:{:02d}.{:03d} "
+        "Flag:{:03d} Chan:{:02d} Samples:{:4d} U1:{:03d} U2:{:03d}",
+        ('year', 'month', 'day', 'hour', 'minute', 'second', 'msec',
+         'blockFlag', 'muxChannel', 'numberOfSamples', 'U1', 'U2')),
+    ('pretty', False): (
+        "{:02d}/{:02d}/{:02d}-{:02d}:{:02d}:{:02d}.{:03d}  F{:03d} CH{:02d} "
+        "{:4d} samps U1={:03d} U2={:03d}",
+        ('year', 'month', 'day', 'hour', 'minute', 'second', 'msec',
+         'blockFlag', 'muxChannel', 'numberOfSamples', 'U1', 'U2'))}
+_HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+
+# printDecimalDumpOfData() format: 8 samples per line
+_DECIMAL_DUMP_FMT = "\n".join(
+    ["{:8d} " * 8] * int(SAMPLES_PER_BLOCK / 8)
+    + ["{:8d} " * (SAMPLES_PER_BLOCK % 8)]) + "\n"
+
+
 def _str_from_cstr(cstr):
     """
     Convert a C string to Python
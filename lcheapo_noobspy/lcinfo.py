@@ -4,20 +4,50 @@
 Return basic information about LCHEAPO files
 
 By default, returns number of channels, samp_rate and start
-and end of each file
+and end of each file.  The files' index files (FILE.lchidx) are used if they
+are up to date.  With --json, prints one JSON record per file instead.
+
+With --stats, also returns per-channel sample statistics, computed in one
+pass over the data.
+
+With --timeline, also returns the continuous data segments of each file
+and, for each station (files with the same header description, e.g. the
+disks of a multi-disk station or re-recovered copies), the gaps and overlaps
+between segments, in samples.
+
+With --cache, the information is saved in BASE_DIR/.lcinfo_cache.jsonl and
+reused while the files' size and modification time do not change.
 """
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 from future.builtins import *  # NOQA @UnusedWildImport
 
 from . import sdpchain
-from .lcheapo import (LCDataBlock, LCDiskHeader)
+from .lcheapo import (LCFile, SAMPLES_PER_BLOCK, INDEX_BAD_HEADER,
+                      MAX_BLOCK_READ, BOGUS_MSEC, msec_to_datetime,
+                      find_last_block, iter_channel_samples,
+                      block_times_msec)
+import numpy as np
 import argparse
+import contextlib
 import os
+import sys
 import datetime
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from .version import __version__
 
+INFO_CACHE_FILENAME = '.lcinfo_cache.jsonl'
+INFO_CACHE_SIZE = 10000   # default maximum number of cached files
+STATS_CHUNK_BLOCKS = 16 * MAX_BLOCK_READ   # blocks read at once by --stats
+CLIP_VALUES = (-2**23, 2**23 - 1)   # 24-bit sample limits
+TIMELINE_CHUNK_BLOCKS = 32 * MAX_BLOCK_READ   # blocks read by --timeline
+BUG1_MAX_MSEC = 1100    # larger time errors are BUG2s or time tears (lcfix)
+BUG2_MAX_BLOCKS = 3     # longest run of blocks with a BUG2 (lcfix)
+
 
 def main():
     global warnings
@@ -26,12 +56,49 @@ def main():
     args = getOptions()
     in_filename_path, out_filename_path = sdpchain.setup_paths(args)
 
-    for filename in args.infiles:
-        with open(os.path.join(in_filename_path, filename),
-                  'rb') as fp:
-            print('-'*60)
-            print(filename)
-            _print_Info(fp)
+    # With --jobs, files are inspected in parallel threads (the work is
+    # mostly waiting for reads), results are printed in the input order.
+    # With --json, other messages go to stderr
+    paths = [os.path.join(in_filename_path, x) for x in args.infiles]
+    cache = None
+    if args.use_cache:
+        cache = _InfoCache(os.path.join(args.base_dir, INFO_CACHE_FILENAME),
+                           args.cache_size, args.refresh)
+
+    def get_info(path):
+        return _get_file_Info(path, args.build_index, cache, args.stats,
+                              args.timeline)
+
+    out = sys.stdout
+    with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as executor, \
+            contextlib.redirect_stdout(sys.stderr if args.json else out):
+        if args.jobs > 1:
+            infos = iter(executor.map(get_info, paths))
+        else:
+            infos = (get_info(x) for x in paths)
+        file_infos = []
+        for filename in args.infiles:
+            if not args.json:
+                print('-'*60)
+                print(filename)
+            info = next(infos)
+            info['filename'] = filename
+            if args.json:
+                print(json.dumps(info, default=datetime.datetime.isoformat),
+                      file=out)
+            else:
+                _print_Info(info)
+            file_infos.append(info)
+        if args.timeline:
+            for station in _get_timeline(file_infos):
+                if args.json:
+                    print(json.dumps(station,
+                                     default=datetime.datetime.isoformat),
+                          file=out)
+                else:
+                    _print_timeline(station)
+    if cache is not None:
+        cache.save()
 
 
 def getOptions():
@@ -50,48 +117,517 @@ def getOptions():
                                           "or relative to base_dir)")
     parser.add_argument("-o", dest="out_dir", metavar="IN_DIR",
                         default='.', help="unused")
+    parser.add_argument("--index", dest="build_index", action='store_true',
+                        help="build missing or outdated index files")
+    parser.add_argument("--jobs", dest="jobs", type=int, default=1,
+                        metavar="N",
+                        help="number of files inspected in parallel")
+    parser.add_argument("--json", dest="json", action='store_true',
+                        help="print one JSON record per file")
+    parser.add_argument("--stats", dest="stats", action='store_true',
+                        help="print per-channel sample statistics (min, max, "
+                             "mean, RMS, clipped samples, longest constant "
+                             "run, all-zero blocks)")
+    parser.add_argument("--timeline", dest="timeline", action='store_true',
+                        help="print each file's continuous segments and the "
+                             "gaps and overlaps between the files of each "
+                             "station")
+    parser.add_argument("--cache", dest="use_cache", action='store_true',
+                        help="use and update the information cache "
+                             "(BASE_DIR/{})".format(INFO_CACHE_FILENAME))
+    parser.add_argument("--refresh", dest="refresh", action='store_true',
+                        help="re-read the files instead of using the cache")
+    parser.add_argument("--cache-size", dest="cache_size", type=int,
+                        default=INFO_CACHE_SIZE, metavar="N",
+                        help="maximum number of files in the cache (the "
+                             "least recently used are dropped) [%(default)d]")
     parser.add_argument("--version", action='version',
                         version='%(prog)s {:s}'.format(__version__))
     args = parser.parse_args()
     return args
 
 
-def _get_times(fp, block_num, samp_rate):
+def _get_times(lcfile, block_num, samp_rate, index=None):
     """
     Get start and end time of the given block
+
+    The block is only read if it is not in the index or if its header
+    values are unexpected
     """
-    lcData = LCDataBlock()
-    lcData.seekBlock(fp, block_num)
-    lcData.readBlock(fp)
-    first_time = lcData.getDateTime()
-    last_time = first_time + datetime.timedelta(
-        seconds=lcData.numberOfSamples / samp_rate)
+    if index is not None and not index.flags[block_num] & INDEX_BAD_HEADER:
+        first_time = msec_to_datetime(index.times[block_num])
+        n_samples = SAMPLES_PER_BLOCK
+    else:
+        lcData = lcfile.getBlock(block_num)
+        first_time = lcData.getDateTime()
+        n_samples = lcData.numberOfSamples
+    last_time = first_time + datetime.timedelta(seconds=n_samples / samp_rate)
     return first_time, last_time
 
 
-def _print_Info(fp):
+def _get_file_Info(filename, build_index=False, cache=None, stats=False,
+                   segments=False):
+    """
+    Return information about an LCHEAPO file
+
+    :param filename: the LCHEAPO file name
+    :param build_index: build a missing or outdated index file
+    :param cache: information cache, the file is only read if it is not in
+        it
+    :type  cache: :class: `_InfoCache`
+    :param stats: add the channel statistics
+    :param segments: add the continuous data segments
+    :returns: dict (see _get_Info()), with the error message under 'error'
+        if the file could not be read
+    """
+    wanted = [k for k, x in (('stats', stats), ('segments', segments)) if x]
+    try:
+        stat = os.stat(filename)
+        if cache is not None:
+            info = cache.get(filename, stat)
+            if info is not None and ('start_time' not in info
+                                     or all(k in info for k in wanted)):
+                return info
+        with LCFile(filename) as lcfile:
+            info = _get_Info(lcfile, lcfile.getIndex(build=build_index),
+                             stats, segments)
+    except (OSError, ValueError) as e:
+        return {'error': str(e)}
+    if cache is not None:
+        cache.put(filename, stat, info)
+    return info
+
+
+def _get_Info(lcfile, index=None, stats=False, segments=False):
+    """
+    Return file information
+
+    :param lcfile: the LCHEAPO file
+    :type  lcfile: :class: `lcheapo:LCFile`
+    :param index: the file's index
+    :type  index: :class: `lcheapo:LCIndex`
+    :param stats: add the channel statistics (see _get_stats())
+    :param segments: add the continuous data segments (see _get_segments())
+    :returns: dict with has_header, n_blocks (in the file) and, if the file
+        has a disk header, header (the LCDiskHeader values), n_channels,
+        sample_rate, data_start, n_data_blocks (to the last valid block),
+        start_time and end_time (datetimes), stats and segments
+    """
+    info = {'has_header': lcfile.header is not None,
+            'n_blocks': lcfile.n_blocks}
+    lcHeader = lcfile.header
+    if lcHeader is None:
+        return info
+    info['header'] = {k: v for k, v in vars(lcHeader).items()
+                      if isinstance(v, (int, float, str))}
+    sample_rate = lcHeader.realSampleRate
+    first_data_block = lcHeader.dataStart
+    last_data_block = find_last_block(lcfile)   # Skips trailing garbage
+    info.update({'n_channels': lcHeader.numberOfChannels,
+                 'sample_rate': sample_rate,
+                 'data_start': first_data_block,
+                 'n_data_blocks': max(last_data_block - first_data_block + 1,
+                                      0)})
+    if last_data_block < first_data_block:
+        return info
+
+    info['start_time'] = _get_times(lcfile, first_data_block, sample_rate,
+                                    index)[0]
+    info['end_time'] = _get_times(lcfile, last_data_block, sample_rate,
+                                  index)[1]
+    if stats:
+        info['stats'] = _get_stats(lcfile, lcHeader.numberOfChannels,
+                                   first_data_block, info['n_data_blocks'])
+    if segments:
+        info['segments'] = _get_segments(lcfile, lcHeader.numberOfChannels,
+                                         sample_rate, first_data_block,
+                                         info['n_data_blocks'], index)
+    return info
+
+
+def _get_segments(lcfile, n_channels, sample_rate, first_block, n_blocks,
+                  index=None, chunk_blocks=TIMELINE_CHUNK_BLOCKS):
+    """
+    Return the continuous data segments of an LCHEAPO file
+
+    Each channel 0 block's time is compared with the time expected from
+    the start of its segment.  As in lcfix, errors of up to BUG1_MAX_MSEC
+    (BUG1s), larger errors followed within BUG2_MAX_BLOCKS blocks by a block
+    at the expected time (BUG2s) and errors in the last BUG2_MAX_BLOCKS
+    blocks are ignored, any other error starts a new segment (time tear).
+    Impossible channel numbers are replaced by the predicted ones, and
+    segments do not start on impossible times.  The block times are taken
+    from the index if there is one, otherwise from the block headers,
+    chunk_blocks blocks at a time.
+
+    :param lcfile: the LCHEAPO file
+    :type  lcfile: :class: `lcheapo:LCFile`
+    :param n_channels: number of channels
+    :param sample_rate: sampling rate
+    :param first_block: first data block
+    :param n_blocks: number of data blocks
+    :param index: the file's index
+    :type  index: :class: `lcheapo:LCIndex`
+    :param chunk_blocks: maximum number of blocks read at once
+    :returns: list of dicts with first_block, last_block, start_msec,
+        end_msec (milliseconds since 1970, end_msec is the expected end of
+        the last block) and n_samples (per channel)
+    """
+    block_msec = int(round(SAMPLES_PER_BLOCK * 1000 / sample_rate))
+    tolerance = 500 / sample_rate
+    last_block = first_block + n_blocks - 1
+    segments = []
+    seg = None      # (block, time, channel 0 block count) of segment start
+    prev_block = None   # last channel 0 block before the undecided ones
+    # Channel 0 blocks, times and counts not checked yet (lacking the
+    # following blocks)
+    blocks = times = counts = np.zeros(0, dtype=np.int64)
+    count = 0
+    prev_mux = -1
+
+    def segment(end_block, end_count):
+        return {'first_block': int(seg[0]),
+                'last_block': int(min(end_block + n_channels - 1,
+                                      last_block)),
+                'start_msec': int(seg[1]),
+                'end_msec': int(seg[1] + (end_count - seg[2]) * block_msec),
+                'n_samples': int(end_count - seg[2]) * SAMPLES_PER_BLOCK}
+
+    for a in range(first_block, last_block + 1, chunk_blocks):
+        b = min(a + chunk_blocks, last_block + 1)
+        if index is not None:
+            chunk_times, mux = index.times[a:b], index.mux[a:b]
+        else:
+            headers = lcfile.headers[a:b]
+            chunk_times, mux = block_times_msec(headers), headers['muxChannel']
+        # Replace impossible channels by the previous block's plus one
+        mux = np.r_[prev_mux, mux.astype(np.int64)]
+        ok = mux < n_channels
+        last_ok = np.maximum.accumulate(np.where(ok, np.arange(len(mux)), 0))
+        mux = np.where(ok, mux,
+                       (mux[last_ok] + np.arange(len(mux)) - last_ok)
+                       % n_channels)
+        prev_mux = mux[-1]
+        ch0 = np.flatnonzero(mux[1:] == 0)
+        blocks = np.r_[blocks, a + ch0]
+        times = np.r_[times, chunk_times[ch0].astype(np.int64)]
+        counts = np.r_[counts, count + np.arange(len(ch0))]
+        count += len(ch0)
+        n_checked = max(len(blocks) - BUG2_MAX_BLOCKS, 0)
+        i = 0
+        while i < n_checked:
+            if seg is None:
+                good = np.flatnonzero(times[i:n_checked] != BOGUS_MSEC)
+                if len(good) == 0:
+                    break
+                i += good[0]
+                seg = (blocks[i], times[i], counts[i])
+            error = np.abs(times[i:] - seg[1]
+                           - (counts[i:] - seg[2]) * block_msec)
+            on_time = error <= tolerance
+            isolated = np.zeros(len(error), dtype=bool)
+            for n in range(1, BUG2_MAX_BLOCKS + 1):
+                isolated[:-n] |= on_time[n:]
+            tears = np.flatnonzero((error[:n_checked - i] > BUG1_MAX_MSEC)
+                                   & ~isolated[:n_checked - i])
+            if len(tears) == 0:
+                break
+            k = i + tears[0]
+            segments.append(segment(blocks[k - 1] if k else prev_block,
+                                    counts[k]))
+            seg, i = None, k
+        if n_checked:
+            prev_block = blocks[n_checked - 1]
+            blocks, times, counts = (blocks[n_checked:], times[n_checked:],
+                                     counts[n_checked:])
+    if seg is None:
+        good = np.flatnonzero(times != BOGUS_MSEC)
+        if len(good) == 0:
+            return segments
+        seg = (blocks[good[0]], times[good[0]], counts[good[0]])
+    segments.append(segment(blocks[-1] if len(blocks) else prev_block,
+                            count))
+    return segments
+
+
+def _get_timeline(infos):
+    """
+    Merge the data segments of the files of each station
+
+    The files of a station have the same header description and sampling
+    rate.  Segments are sorted by start time, a gap is reported wherever a
+    segment starts after the end of all earlier ones, an overlap wherever it
+    starts before.
+
+    :param infos: file information (from _get_Info(), with segments and
+        filename)
+    :returns: list of dicts, one per station, with station (the
+        description), sample_rate, start_time and end_time (datetimes),
+        n_samples (covered by at least one file), segments (each with its
+        filename and disk number), gaps and overlaps (each with start_time,
+        end_time, n_samples and files, the files before and after a gap or
+        the overlapping files)
+    """
+    stations = {}
+    for info in infos:
+        if not info.get('segments'):
+            continue
+        key = (info['header']['description'], info['sample_rate'])
+        for seg in info['segments']:
+            stations.setdefault(key, []).append(
+                dict(seg, filename=info['filename'],
+                     disk=info['header']['diskNumber']))
+
+    timeline = []
+    for (station, sample_rate), segments in stations.items():
+        segments.sort(key=lambda x: (x['start_msec'], x['filename']))
+        gaps, overlaps = [], []
+        end, end_file = segments[0]['end_msec'], segments[0]['filename']
+        for seg in segments[1:]:
+            start = seg['start_msec']
+            n = int(round((start - end) * sample_rate / 1000))
+            if n > 0:
+                gaps.append({'start_time': msec_to_datetime(end),
+                             'end_time': msec_to_datetime(start),
+                             'n_samples': n,
+                             'files': [end_file, seg['filename']]})
+            elif n < 0:
+                overlap_end = min(end, seg['end_msec'])
+                overlaps.append({
+                    'start_time': msec_to_datetime(start),
+                    'end_time': msec_to_datetime(overlap_end),
+                    'n_samples': int(round((overlap_end - start)
+                                           * sample_rate / 1000)),
+                    'files': [end_file, seg['filename']]})
+            if seg['end_msec'] > end:
+                end, end_file = seg['end_msec'], seg['filename']
+        start, end = segments[0]['start_msec'], end
+        n_samples = (int(round((end - start) * sample_rate / 1000))
+                     - sum(x['n_samples'] for x in gaps))
+        timeline.append({'station': station, 'sample_rate': sample_rate,
+                         'start_time': msec_to_datetime(start),
+                         'end_time': msec_to_datetime(end),
+                         'n_samples': n_samples, 'segments': segments,
+                         'gaps': gaps, 'overlaps': overlaps})
+    return timeline
+
+
+def _get_stats(lcfile, n_channels, first_block, n_blocks,
+               chunk_blocks=STATS_CHUNK_BLOCKS):
+    """
+    Return per-channel sample statistics
+
+    The data is read once, chunk_blocks blocks at a time, so memory use
+    does not depend on the file size.
+
+    :param lcfile: the LCHEAPO file
+    :type  lcfile: :class: `lcheapo:LCFile`
+    :param n_channels: number of channels
+    :param first_block: first data block
+    :param n_blocks: number of data blocks
+    :param chunk_blocks: maximum number of blocks read at once
+    :returns: list with, for each channel, a dict of n_samples, min, max,
+        mean, rms, n_clipped (samples at -2^23 or 2^23-1),
+        longest_constant (longest run of equal samples) and n_zero_blocks
+        (blocks with only zeros).  Values are None if there are no samples
+    """
+    acc = [{'n_samples': 0, 'min': None, 'max': None, 'sum': 0.,
+            'sum2': 0., 'n_clipped': 0, 'longest_constant': 0,
+            'n_zero_blocks': 0, 'last': None, 'run': 0}
+           for _ in range(n_channels)]
+    for _, channel_samples in iter_channel_samples(
+            lcfile, n_channels, first_block, n_blocks, chunk_blocks):
+        for a, x in zip(acc, channel_samples):
+            if len(x) == 0:
+                continue
+            a['n_samples'] += len(x)
+            x_min, x_max = int(x.min()), int(x.max())
+            a['min'] = x_min if a['min'] is None else min(a['min'], x_min)
+            a['max'] = x_max if a['max'] is None else max(a['max'], x_max)
+            xf = x.astype(np.float64)
+            a['sum'] += xf.sum()
+            a['sum2'] += np.dot(xf, xf)
+            a['n_clipped'] += int(np.count_nonzero(
+                (x == CLIP_VALUES[0]) | (x == CLIP_VALUES[1])))
+            a['n_zero_blocks'] += int(np.count_nonzero(
+                ~x.reshape(-1, SAMPLES_PER_BLOCK).any(axis=1)))
+            # Constant runs, continuing the previous chunk's last run
+            ends = np.r_[np.flatnonzero(x[1:] != x[:-1]) + 1, len(x)]
+            runs = np.diff(np.r_[0, ends])
+            if a['last'] == int(x[0]):
+                runs[0] += a['run']
+            a['longest_constant'] = max(a['longest_constant'],
+                                        int(runs.max()))
+            a['last'], a['run'] = int(x[-1]), int(runs[-1])
+    stats = []
+    for a in acc:
+        n = a['n_samples']
+        stats.append({'n_samples': n, 'min': a['min'], 'max': a['max'],
+                      'mean': float(a['sum'] / n) if n else None,
+                      'rms': float(np.sqrt(a['sum2'] / n)) if n else None,
+                      'n_clipped': a['n_clipped'],
+                      'longest_constant': a['longest_constant'],
+                      'n_zero_blocks': a['n_zero_blocks']})
+    return stats
+
+
+class _InfoCache:
+    """
+    File information cache, saved as a JSON lines file
+
+    Each line holds a file's absolute path, size, modification time (ns),
+    last use time and information (from _get_Info()).  Entries are only
+    returned if the file's size and modification time have not changed.
+    Can be used from several threads.
+    """
+    def __init__(self, filename, max_entries=INFO_CACHE_SIZE, refresh=False):
+        """
+        :param filename: cache file name
+        :param max_entries: maximum number of entries saved (the least
+            recently used are dropped)
+        :param refresh: do not return the cached entries (they are replaced)
+        """
+        self.filename = filename
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.entries = {}
+        self.modified = False
+        self.lock = threading.Lock()
+        try:
+            with open(filename) as fp:
+                for line in fp:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry['path']] = entry
+                    except (ValueError, KeyError, TypeError):
+                        pass   # Skip damaged lines
+        except OSError:
+            pass
+
+    def get(self, filename, stat):
+        """
+        Return a file's cached information
+
+        :param filename: file name
+        :param stat: the file's os.stat() result
+        :returns: information dict, None if not cached or outdated
+        """
+        if self.refresh:
+            return None
+        with self.lock:
+            entry = self.entries.get(os.path.abspath(filename))
+            if entry is None or (entry['size'], entry['mtime_ns']) != (
+                    stat.st_size, stat.st_mtime_ns):
+                return None
+            entry['used'] = time.time()
+            self.modified = True
+            info = dict(entry['info'])
+        for key in ('start_time', 'end_time'):
+            if key in info:
+                info[key] = datetime.datetime.fromisoformat(info[key])
+        return info
+
+    def put(self, filename, stat, info):
+        """
+        Save a file's information
+
+        :param filename: file name
+        :param stat: the file's os.stat() result
+        :param info: information dict
+        """
+        path = os.path.abspath(filename)
+        entry = json.loads(json.dumps(
+            {'path': path, 'size': stat.st_size,
+             'mtime_ns': stat.st_mtime_ns, 'used': time.time(),
+             'info': info}, default=datetime.datetime.isoformat))
+        with self.lock:
+            self.entries[path] = entry
+            self.modified = True
+
+    def save(self):
+        """
+        Write the cache file, keeping the max_entries most recently used
+
+        Errors (e.g. read-only directory) are ignored
+
+        :returns: True if the cache file was written
+        """
+        if not self.modified:
+            return False
+        entries = sorted(self.entries.values(), key=lambda x: x['used'],
+                         reverse=True)[:max(self.max_entries, 0)]
+        tmpname = self.filename + '.tmp'
+        try:
+            with open(tmpname, 'w') as fp:
+                for entry in entries:
+                    fp.write(json.dumps(entry) + '\n')
+            os.replace(tmpname, self.filename)
+        except OSError:
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
+            return False
+        self.modified = False
+        return True
+
+
+def _print_Info(info):
     """
     Print out file information
+
+    :param info: file information, from _get_Info()
     """
-    lcHeader = LCDiskHeader()
-    lcHeader.seekHeaderPosition(fp)
-    status = lcHeader.readHeader(fp)
-    if status == 0:
+    if 'error' in info:
+        print('Error: {}'.format(info['error']))
+    if 'start_time' not in info:
         return
-    sample_rate = lcHeader.realSampleRate
-    n_channels = lcHeader.numberOfChannels
+    print('n_channels  = {:d}'.format(info['n_channels']))
+    print('sample rate = {:g}'.format(info['sample_rate']))
+    print('start time  = {}'.format(info['start_time']))
+    print('end time    = {}'.format(info['end_time']))
+    if 'stats' not in info:
+        return
+    print('{:>7s} {:>10s} {:>9s} {:>9s} {:>12s} {:>12s} {:>9s} {:>9s} '
+          '{:>9s}'.format('channel', 'n_samples', 'min', 'max', 'mean', 'rms',
+                          'clipped', 'constant', 'zero_blk'))
+    for channel, x in enumerate(info['stats']):
+        if x['n_samples'] == 0:
+            print('{:7d} {:10d}'.format(channel, 0))
+            continue
+        print('{:7d} {:10d} {:9d} {:9d} {:12.2f} {:12.2f} {:9d} {:9d} '
+              '{:9d}'.format(channel, x['n_samples'], x['min'], x['max'],
+                             x['mean'], x['rms'], x['n_clipped'],
+                             x['longest_constant'], x['n_zero_blocks']))
 
-    first_data_block = lcHeader.dataStart
-    fp.seek(0, 2)                # Seek end of file
-    last_data_block = int(fp.tell() / 512) - 1
 
-    start_time, temp = _get_times(fp, first_data_block, sample_rate)
-    temp, end_time = _get_times(fp, last_data_block, sample_rate)
+def _print_timeline(station):
+    """
+    Print out a station's timeline
 
-    print('n_channels  = {:d}'.format(n_channels))
-    print('sample rate = {:g}'.format(sample_rate))
-    print('start time  = {}'.format(start_time))
-    print('end time    = {}'.format(end_time))
+    :param station: station timeline, from _get_timeline()
+    """
+    print('='*60)
+    print('{} ({:g} sps): {} to {}, {:d} samples'.format(
+        station['station'], station['sample_rate'], station['start_time'],
+        station['end_time'], station['n_samples']))
+    print('{:<26s} {:<26s} {:>10s} {:>4s}  {}'.format(
+        'segment start', 'segment end', 'n_samples', 'disk', 'file'))
+    for seg in station['segments']:
+        print('{:<26s} {:<26s} {:10d} {:4d}  {} (blocks {:d}-{:d})'.format(
+            str(msec_to_datetime(seg['start_msec'])),
+            str(msec_to_datetime(seg['end_msec'])), seg['n_samples'],
+            seg['disk'], seg['filename'], seg['first_block'],
+            seg['last_block']))
+    for kind, between in (('gaps', 'between'), ('overlaps', 'of')):
+        events = station[kind]
+        print('{:d} {} ({:d} samples)'.format(
+            len(events), kind, sum(x['n_samples'] for x in events)))
+        for x in events:
+            print('    {} to {}: {:d} samples ({:g} s) {} {} and {}'.format(
+                x['start_time'], x['end_time'], x['n_samples'],
+                x['n_samples'] / station['sample_rate'], between,
+                *x['files']))
 
 
 if __name__ == '__main__':
@@ -7,13 +7,98 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 from future.builtins import *  # NOQA @UnusedWildImport
 
+import os
 from os import system
+import shutil
+import subprocess
+import sys
 import unittest
+from unittest import mock
 import filecmp
 import inspect
 import difflib
 import json
+import struct
+import io
+import logging
+from contextlib import redirect_stdout
 from pathlib import Path
+from datetime import timedelta
+
+import numpy as np
+
+from lcheapo_noobspy.lcheapo import (LCDataBlock, LCDirEntry, LCFile,
+                                     read_block_headers, block_times_msec,
+                                     blocks_to_int32, data_to_int32,
+                                     iter_channel_samples, msec_to_datetime,
+                                     copy_blocks, load_index, index_filename,
+                                     INDEX_BAD_HEADER, find_block,
+                                     format_block_headers, hex_dump_blocks,
+                                     find_last_block, BLOCK_DTYPE,
+                                     parse_time, time_window_blocks)
+from lcheapo_noobspy import lcfix, lccut
+from lcheapo_noobspy.lcfix import (_PatchedFile, _undo_in_place,
+                                   _shard_limits, _read_shard,
+                                   _write_split_files, _BlockFixer,
+                                   _fix_blocks_loop, _fix_blocks_vector)
+from lcheapo_noobspy.lccut import _write_windows, _window, _write_header
+from lcheapo_noobspy.lcdump import _time_verify, _export_headers
+from lcheapo_noobspy.lcinfo import (_get_file_Info, _InfoCache, _get_stats,
+                                    _get_segments, _get_timeline)
+
+
+def _make_blocks(time_errors, n_channels=4):
+    """
+    Return LCHEAPO data blocks at 62.5 sps, with zero samples
+
+    :param time_errors: time error (msec) of each block, the number of
+        blocks is its length
+    :returns: numpy array of BLOCK_DTYPE
+    """
+    n_blocks = len(time_errors)
+    msec = (np.datetime64('2019-07-20T11:00:00.008', 'ms')
+            + np.arange(n_blocks) // n_channels * 2656
+            + np.asarray(time_errors, dtype=np.int64))
+    days = msec.astype('datetime64[D]')
+    months = msec.astype('datetime64[M]')
+    msec_of_day = (msec - days).astype(np.int64)
+    blocks = np.zeros(n_blocks, dtype=BLOCK_DTYPE)
+    blocks['year'] = msec.astype('datetime64[Y]').astype(np.int64) - 30
+    blocks['month'] = months.astype(np.int64) % 12 + 1
+    blocks['day'] = (days - months).astype(np.int64) + 1
+    blocks['hour'] = msec_of_day // 3600000
+    blocks['minute'] = msec_of_day // 60000 % 60
+    blocks['second'] = msec_of_day // 1000 % 60
+    blocks['msec'] = msec_of_day % 1000
+    blocks['blockFlag'] = 73
+    blocks['muxChannel'] = np.arange(n_blocks) % n_channels
+    blocks['numberOfSamples'] = 166
+    blocks['U1'] = 3
+    blocks['U2'] = 166
+    return blocks
+
+
+def _write_with_header(test, fname, data=None):
+    """
+    Write a file with the LSVEL disk header, removed at the end of the test
+
+    :param test: the test case
+    :type  test: :class: `TestLCHEAPOMethods`
+    :param fname: output file name
+    :param data: the data blocks (default: BUGGY.fix_5000_5099.lch's)
+    :type  data: bytes
+    :returns: the data blocks
+    """
+    if data is None:
+        with open(Path(test.test_path) / 'BUGGY.fix_5000_5099.lch',
+                  'rb') as fp:
+            data = fp.read()
+    with open(Path(test.test_path) / 'LSVEL.header.lch', 'rb') as fp:
+        header = fp.read()
+    with open(fname, 'wb') as fp:
+        fp.write(header + data)
+    test.addCleanup(os.remove, fname)
+    return data
 
 
 class TestLCHEAPOMethods(unittest.TestCase):
@@ -87,6 +172,283 @@ class TestLCHEAPOMethods(unittest.TestCase):
 
         # WRITEOUT OF DIRECTORY
 
+    def test_lcdump_time_verify(self):
+        """
+        Test vectorized time verification (lcdump -f 3)
+        """
+        fname = 'temp_verify.lch'
+        shutil.copy(Path(self.test_path) / 'BUGGY.fix_5000_5099.lch', fname)
+        with open(fname, 'r+b') as fp:
+            lcData = LCDataBlock()
+            lcData.seekBlock(fp, 42)
+            lcData.readBlock(fp)
+            lcData.changeTime(lcData.getDateTime() + timedelta(seconds=1))
+            lcData.seekBlock(fp, 42)
+            fp.write(lcData.packHeader())
+            lcData.seekBlock(fp, 50)
+            lcData.readBlock(fp)
+            lcData.month = 13
+            lcData.seekBlock(fp, 50)
+            fp.write(lcData.packHeader())
+        with LCFile(fname, read_header=False) as lcfile, \
+                redirect_stdout(io.StringIO()) as out:
+            n_checked, n_bogus, n_dev, sum_dev, max_dev, runs = _time_verify(
+                lcfile, 0, 10, 1000, 62.5, 4)
+        self.assertEqual((n_checked, n_bogus, n_dev, max_dev), (90, 1, 1, 1.))
+        self.assertEqual(runs, [[42, 42, 1., 1.]])
+        self.assertEqual(out.getvalue().split('|')[0], '      42:  2 ')
+        # Blocks before the first data block are not checked
+        with LCFile(fname, read_header=False) as lcfile, \
+                redirect_stdout(io.StringIO()):
+            result = _time_verify(lcfile, 4, 0, 1000, 62.5, 4)
+        self.assertEqual(result[:4], (96, 1, 1, 1.))
+        Path(fname).unlink()
+
+    def test_bulk_dump_formats(self):
+        """
+        Test whole-block dump formatting against the LCDataBlock methods
+        """
+        fname = Path(self.test_path) / 'BUGGY.fix_5000_5099.lch'
+        with LCFile(fname, read_header=False) as lcfile:
+            blocks = lcfile.blocks[40:44]
+            texts = [format_block_headers(blocks),
+                     format_block_headers(lcfile.headers[40:44], 'decimal',
+                                          annotated=True),
+                     hex_dump_blocks(blocks)]
+            for i in range(4):
+                lcData = lcfile.getBlock(40 + i)
+                with redirect_stdout(io.StringIO()) as out:
+                    lcData.prettyPrintHeader()
+                    lcData.printDecimalDumpOfHeader(True)
+                    lcData.printHexDumpOfData()
+                self.assertEqual(out.getvalue(), texts[0][i] + '\n'
+                                 + texts[1][i] + '\n' + texts[2][i])
+
+    def test_lcdump_export(self):
+        """
+        Test machine-readable block header export
+        """
+        fname = Path(self.test_path) / 'BUGGY.fix_5000_5099.lch'
+        outputs = {}
+        with LCFile(fname, read_header=False) as lcfile:
+            times = block_times_msec(lcfile.headers[98:100]).tolist()
+            for export in ('csv', 'jsonl', 'npy'):
+                outputs[export] = io.BytesIO()
+                _export_headers(lcfile, 98, 10, export, outputs[export])
+        lines = outputs['csv'].getvalue().decode().splitlines()
+        self.assertEqual(lines[0], 'block,time_msec,muxChannel,blockFlag,'
+                                   'numberOfSamples,U1,U2')
+        self.assertEqual(lines[1:], [f'98,{times[0]},2,73,166,3,166',
+                                     f'99,{times[1]},3,73,166,3,166'])
+        records = [json.loads(x) for x in
+                   outputs['jsonl'].getvalue().decode().splitlines()]
+        self.assertEqual(records[1], {
+            'block': 99, 'time_msec': times[1], 'muxChannel': 3,
+            'blockFlag': 73, 'numberOfSamples': 166, 'U1': 3, 'U2': 166})
+        outputs['npy'].seek(0)
+        values = np.load(outputs['npy'])
+        self.assertEqual(values['time_msec'].tolist(), times)
+        self.assertEqual(values[0].tolist(), tuple(records[0].values()))
+
+    def test_read_block_headers(self):
+        """
+        Test vectorized block header reading against LCDataBlock.readBlock
+        """
+        fname = Path(self.test_path) / 'BUGGY.fix_5000_5099.lch'
+        with open(fname, 'rb') as fp:
+            headers = read_block_headers(fp, 10, 20)
+            times = block_times_msec(headers)
+            self.assertEqual(len(headers), 20)
+            lcData = LCDataBlock()
+            lcData.seekBlock(fp, 10)
+            for hdr, msec in zip(headers, times):
+                lcData.readBlock(fp)
+                self.assertEqual(hdr['muxChannel'], lcData.muxChannel)
+                self.assertEqual(hdr['U2'], lcData.U2)
+                self.assertEqual(msec_to_datetime(msec),
+                                 lcData.getDateTime())
+            self.assertEqual(len(read_block_headers(fp)), 100)
+
+    def test_lcfile(self):
+        """
+        Test memory-mapped file access
+        """
+        fname = Path(self.test_path) / 'BUGGY.fix_5000_5099.lch'
+        with LCFile(fname, read_header=False) as lcfile, \
+                open(fname, 'rb') as fp:
+            self.assertEqual(len(lcfile), 100)
+            self.assertIsNone(lcfile.header)
+            lcData = LCDataBlock()
+            lcData.seekBlock(fp, 42)
+            lcData.readBlock(fp)
+            block = lcfile.getBlock(42)
+            self.assertEqual(bytes(block.data), lcData.data)
+            self.assertEqual(block.getDateTime(), lcData.getDateTime())
+            self.assertEqual(lcfile.blocks[40:44]['muxChannel'].tolist(),
+                             [0, 1, 2, 3])
+            self.assertEqual(lcfile.headers[42]['muxChannel'], 2)
+        fname = Path(self.test_path) / 'LSVEL.header.lch'
+        with LCFile(fname) as lcfile:
+            self.assertEqual(lcfile.header.numberOfChannels, 4)
+            self.assertEqual(len(lcfile.directory), 1171)
+            lcDir = LCDirEntry()
+            lcDir.readRecord(lcfile.directory[1])
+            self.assertEqual(lcDir.blockNumber, 3586 + 14336)
+
+    def test_blocks_to_int32(self):
+        """
+        Test vectorized 24-bit sample decoding
+        """
+        self.assertEqual(
+            data_to_int32(b'\x80\x00\x00\x7f\xff\xff\xff\xff\xff'
+                          b'\x00\x00\x01').tolist(),
+            [-8388608, 8388607, -1, 1])
+        fname = Path(self.test_path) / 'BUGGY.fix_5000_5099.lch'
+        with LCFile(fname, read_header=False) as lcfile:
+            samples = blocks_to_int32(lcfile.blocks[10:20])
+            self.assertEqual(samples.shape, (10, 166))
+            self.assertEqual(samples.dtype, 'int32')
+            for i in range(10):
+                block = lcfile.getBlock(10 + i)
+                values = block.convertDataTo24BitValues()
+                self.assertIsInstance(values, list)
+                self.assertEqual(samples[i].tolist(), values)
+                self.assertEqual(
+                    values,
+                    [x * (1 << 16) + y * (1 << 8) + z
+                     for x, y, z in [struct.unpack(">bBB", block.data[j:j + 3])
+                                     for j in range(0, 498, 3)]])
+
+    def test_iter_channel_samples(self):
+        """
+        Test streaming per-channel demultiplexing
+        """
+        fname = Path(self.test_path) / 'BUGGY.fix_5000_5099.lch'
+        with LCFile(fname, read_header=False) as lcfile:
+            all_samples = blocks_to_int32(lcfile.blocks)
+            all_times = block_times_msec(lcfile.headers)
+            chunks = list(iter_channel_samples(lcfile, 4, chunk_blocks=30))
+        # 30-block chunks are rounded down to 28 (7 blocks per channel)
+        self.assertEqual(len(chunks), 4)
+        start_times, samples = chunks[1]
+        self.assertEqual(start_times, all_times[28:32].tolist())
+        self.assertEqual(len(samples[2]), 7 * 166)
+        self.assertEqual(samples[2].tolist(),
+                         all_samples[30:56:4].ravel().tolist())
+        with open(fname, 'rb') as fp:
+            for a, b in zip(chunks,
+                            iter_channel_samples(fp, 4, chunk_blocks=30)):
+                self.assertEqual(a[0], b[0])
+                self.assertTrue(all((x == y).all()
+                                    for x, y in zip(a[1], b[1])))
+
+    def test_copy_blocks(self):
+        """
+        Test block copying between files
+        """
+        fname = Path(self.test_path) / 'BUGGY.fix_5000_5099.lch'
+        outfname = 'temp_copy.lch'
+        with open(fname, 'rb') as ifp, open(outfname, 'wb') as ofp:
+            ofp.write(b'x' * 10)
+            ofp.flush()
+            self.assertEqual(copy_blocks(ifp, ofp, 10, 90, 2), 90 * 512)
+        with open(fname, 'rb') as fp:
+            orig = fp.read()
+        with open(outfname, 'rb') as fp:
+            copied = fp.read()
+        self.assertEqual(copied[:10], b'x' * 10)
+        self.assertEqual(copied[1024:], orig[10 * 512:])
+        Path(outfname).unlink()
+
+    def test_lcindex(self):
+        """
+        Test block index files
+        """
+        fname = 'temp_index.lch'
+        shutil.copy(Path(self.test_path) / 'BUGGY.fix_5000_5099.lch', fname)
+        self.assertIsNone(load_index(fname))
+        with LCFile(fname, read_header=False) as lcfile:
+            index = lcfile.getIndex(build=True)
+            times = block_times_msec(lcfile.headers)
+            self.assertEqual(index.times.tolist(), times.tolist())
+            self.assertEqual(index.mux.tolist(),
+                             lcfile.headers['muxChannel'].tolist())
+        self.assertEqual(index.last_valid_block, 99)
+        loaded = load_index(fname)
+        self.assertEqual(loaded.key, index.key)
+        self.assertEqual(loaded.times.tolist(), index.times.tolist())
+        self.assertEqual(loaded.flags.tolist(), index.flags.tolist())
+        self.assertFalse((loaded.flags & INDEX_BAD_HEADER).any())
+        # The same blocks are checked with and without the index
+        self.assertEqual(
+            [x.tolist() for x in _read_shard(fname, 4, 99, 4, 2656, 4,
+                                             times[:4].tolist())],
+            [x.tolist() for x in _read_shard(fname, 4, 99, 4, 2656, 4,
+                                             times[:4].tolist(),
+                                             index=loaded)])
+        del loaded
+        # Changing the file outdates the index
+        with open(fname, 'ab') as fp:
+            fp.write(bytes(512))
+        self.assertIsNone(load_index(fname))
+        Path(index_filename(fname)).unlink()
+        Path(fname).unlink()
+
+    def test_find_block(self):
+        """
+        Test finding the block holding a given time
+        """
+        fname = Path(self.test_path) / 'BUGGY.fix_5000_5099.lch'
+        with LCFile(fname, read_header=False) as lcfile:
+            t0 = msec_to_datetime(block_times_msec(lcfile.headers[:1])[0])
+            self.assertEqual(find_block(lcfile, t0, 0, 4, 62.5), (0, 0))
+            self.assertEqual(find_block(lcfile, t0, 3, 4, 62.5), (3, 0))
+            t = t0 + timedelta(seconds=20 * 2.656 + 1)
+            self.assertEqual(find_block(lcfile, t, 2, 4, 62.5), (82, 62))
+            with self.assertRaises(ValueError):
+                find_block(lcfile, t0 - timedelta(seconds=1), 0, 4, 62.5)
+            with self.assertRaises(ValueError):
+                find_block(lcfile, t0 + timedelta(hours=1), 0, 4, 62.5)
+
+    def test_find_last_block(self):
+        """
+        Test finding the last valid block before trailing garbage
+        """
+        fname = 'temp_last.lch'
+        with open(Path(self.test_path) / 'BUGGY.fix_5000_5099.lch',
+                  'rb') as fp:
+            data = fp.read()
+        # Nothing, zero-filled blocks, older data
+        for tail in (b'', bytes(512 * 300), data[:40 * 512]):
+            with open(fname, 'wb') as fp:
+                fp.write(data + tail)
+            with LCFile(fname, read_header=False) as lcfile:
+                self.assertEqual(find_last_block(lcfile, 0, 4, 62.5,
+                                                 probe_blocks=16), 99)
+        # Hole larger than the windows in the data, and trailing zeros
+        with open(fname, 'wb') as fp:
+            fp.write(data[:40 * 512] + bytes(20 * 512) + data[60 * 512:]
+                     + bytes(512 * 300))
+        with LCFile(fname, read_header=False) as lcfile:
+            self.assertEqual(find_last_block(lcfile, 0, 4, 62.5,
+                                             probe_blocks=16), 99)
+        # Long zero-filled tail: only a few windows are read
+        with open(fname, 'wb') as fp:
+            fp.write(_make_blocks(np.zeros(4000)).tobytes())
+            fp.truncate(512 * 404000)
+        n_headers = []
+
+        def count_headers(headers):
+            n_headers.append(len(headers))
+            return block_times_msec(headers)
+        with LCFile(fname, read_header=False) as lcfile, \
+                mock.patch('lcheapo_noobspy.lcheapo.block_times_msec',
+                           side_effect=count_headers):
+            self.assertEqual(find_last_block(lcfile, 0, 4, 62.5,
+                                             probe_blocks=16), 3999)
+        self.assertLess(sum(n_headers), 5000)
+        Path(fname).unlink()
+
     def test_lcfix_buggy(self):
         """
         Test lcfix on a typical (buggy) file
@@ -125,6 +487,251 @@ class TestLCHEAPOMethods(unittest.TestCase):
             str(Path(self.test_path) / new_outfname))
         Path(new_outfname).unlink()
 
+    def test_lcfix_in_place_undo(self):
+        """
+        Test in-place block header patching and its undo journal
+        """
+        fname = 'temp_in_place.lch'
+        journal = 'temp_in_place.fix.undo.json'
+        shutil.copy(Path(self.test_path) / 'BUGGY.fix_5000_5099.lch', fname)
+        lcData = LCDataBlock()
+        pfile = _PatchedFile(fname)
+        lcData.seekBlock(pfile, 42)
+        lcData.readBlock(pfile)
+        orig_time = lcData.getDateTime()
+        lcData.changeTime(orig_time.replace(year=2030))
+        lcData.seekBlock(pfile, 42)
+        pfile.write(lcData.packHeader())
+        reader = pfile.reopen()
+        lcData.seekBlock(reader, 43)
+        lcData.seekBlock(pfile, 43)
+        pfile.write(reader.read(14))   # Unchanged, so dropped
+        # Writes undone by later ones are dropped too
+        originals = {}
+        for block in (60, 5):
+            lcData.seekBlock(reader, block)
+            originals[block] = reader.read(14)
+            lcData.seekBlock(pfile, block)
+            pfile.write(bytes(14))
+        self.assertEqual(pfile._sorted, [5 * 512, 42 * 512, 60 * 512])
+        for block in (5, 60):
+            lcData.seekBlock(pfile, block)
+            pfile.write(originals[block])
+        self.assertEqual(pfile._sorted, [42 * 512])
+        reader.close()
+        # Pending changes are seen by reads but not yet in the file
+        lcData.seekBlock(pfile, 42)
+        lcData.readBlock(pfile)
+        self.assertEqual(lcData.getDateTime().year, 2030)
+        self.assertBinFilesEqual(
+            fname, str(Path(self.test_path) / 'BUGGY.fix_5000_5099.lch'))
+        self.assertEqual(pfile.commit(journal), 1)
+        pfile.close()
+        with LCFile(fname, read_header=False) as lcfile:
+            self.assertEqual(lcfile.getBlock(42).getDateTime().year, 2030)
+        _undo_in_place(fname, journal)
+        self.assertFalse(Path(journal).exists())
+        self.assertBinFilesEqual(
+            fname, str(Path(self.test_path) / 'BUGGY.fix_5000_5099.lch'))
+        Path(fname).unlink()
+
+    def _fix_with_engine(self, engine, fname, last_block, force_time=False):
+        """
+        Verify and correct a file without header with one lcfix engine
+
+        :returns: last block, patches, counters, log messages, printed text
+            and time tears
+        """
+        lcfix.startBUG1A, lcfix.printHeader = -1, ''
+        delta = timedelta(milliseconds=2656)
+        with LCFile(fname, read_header=False) as lcfile:
+            last_time = [lcfile.getBlock(i).getDateTime() - delta
+                         for i in range(4)]
+        oftt = io.StringIO()
+        fixer = _BlockFixer(4, last_time, delta, last_block, force_time, oftt)
+        patches, out = {}, io.StringIO()
+        with open(fname, 'rb') as ifp1, redirect_stdout(out), \
+                self.assertLogs(level=logging.INFO) as logs:
+            if engine == 'loop':
+                last = _fix_blocks_loop(fixer, ifp1, 0, last_block, patches, 0)
+            else:
+                last = _fix_blocks_vector(fixer, ifp1, 0, last_block, patches)
+        return (last, patches, vars(fixer.counters), logs.output,
+                out.getvalue(), oftt.getvalue())
+
+    def test_lcfix_engines(self):
+        """
+        Test that the vector engine finds and corrects the same bugs as the
+        loop engine
+        """
+        errors = np.zeros(4000, dtype=np.int64)
+        errors[101] = -1000                 # BUG1
+        for block in range(1000, 3000, 500):
+            errors[block:block + 4] = -1000     # BUG1a
+        errors[1702] = 5000                 # BUG2
+        errors[[2201, 2205]] = 4000         # BUG2b
+        errors[3301:] += 100000             # Time tear
+        blocks = _make_blocks(errors)
+        blocks['U1'][707] = 7               # Bad header value
+        blocks['muxChannel'][1802] = 6      # Impossible channel
+        blocks['month'][2602] = 13          # Impossible time
+        fname = 'temp_engines.lch'
+        blocks.tofile(fname)
+        for force_time in (True, False):
+            loop = self._fix_with_engine('loop', fname, 3999, force_time)
+            vector = self._fix_with_engine('vector', fname, 3999, force_time)
+            self.assertEqual(vector, loop)
+        self.assertEqual(loop[2], {'bug1': 17, 'bug2': 4, 'bug3': 0,
+                                   'time_tear': 4, 'bad_hdr': 1})
+        Path(fname).unlink()
+
+    def _run_lcfix(self, in_dir, out_dir, *args):
+        """
+        Run lcfix in a new process
+
+        :returns: output file names and exit status
+        """
+        Path(out_dir).mkdir()
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            [str(self.path.parents[1]), os.environ.get('PYTHONPATH', '')]))
+        status = subprocess.run(
+            [sys.executable, '-m', 'lcheapo_noobspy.lcfix', '-i', str(in_dir),
+             '-o', str(out_dir)] + list(args), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+        return sorted(x.name for x in Path(out_dir).iterdir()), status
+
+    def assertLcfixRunsEqual(self, in_dir, args, first_args, second_args):
+        """
+        Assert that lcfix gives the same outputs with first_args and
+        second_args
+
+        process-steps.json, which holds the command line, is not compared
+        """
+        first = self._run_lcfix(in_dir, Path(in_dir) / 'out_1',
+                                *(first_args + args))
+        second = self._run_lcfix(in_dir, Path(in_dir) / 'out_2',
+                                 *(second_args + args))
+        self.assertEqual(first, second)
+        for fname in first[0]:
+            if fname != 'process-steps.json':
+                self.assertTrue(filecmp.cmp(Path(in_dir) / 'out_1' / fname,
+                                            Path(in_dir) / 'out_2' / fname,
+                                            shallow=False), fname)
+        return first[0]
+
+    def test_lcfix_jobs(self):
+        """
+        Test that lcfix gives the same outputs when files are processed in
+        parallel
+        """
+        in_dir = Path('temp_jobs')
+        in_dir.mkdir()
+        self.addCleanup(shutil.rmtree, in_dir)
+        errors = np.zeros(2000, dtype=np.int64)
+        errors[101] = -1000                     # BUG1
+        errors[702] = 5000                      # BUG2
+        _write_with_header(self, in_dir / 'temp_1.lch',
+                           _make_blocks(errors).tobytes())
+        errors = np.full(2000, 500 * 2656)      # Second file, no header
+        errors[[1201, 1205]] += 4000            # BUG2b
+        _make_blocks(errors).tofile(in_dir / 'temp_2.lch')
+        outputs = self.assertLcfixRunsEqual(
+            in_dir, ['temp_1.lch', 'temp_2.lch'], [], ['--jobs', '2'])
+        self.assertEqual(len([x for x in outputs if x.endswith('.fix.lch')]),
+                         2)
+
+    def test_lcfix_sharded_run(self):
+        """
+        Test that lcfix gives the same output when a file is read in shards
+        by parallel processes as when its blocks are read one by one
+        """
+        in_dir = Path('temp_sharded')
+        in_dir.mkdir()
+        self.addCleanup(shutil.rmtree, in_dir)
+        # Bugs around the first shard boundary (14336 blocks after dataStart)
+        errors = np.zeros(16000, dtype=np.int64)
+        for block in range(14336 - 1000, 14336 + 1000, 500):
+            errors[block:block + 4] = -1000     # BUG1a
+        errors[[14334, 14338]] += 4000          # BUG2b
+        errors[14345] = 5000                    # BUG2
+        blocks = _make_blocks(errors)
+        blocks['muxChannel'][14336] = 6         # Impossible channel
+        blocks['month'][14341] = 13             # Impossible time
+        _write_with_header(self, in_dir / 'temp_sharded.lch', blocks.tobytes())
+        outputs = self.assertLcfixRunsEqual(
+            in_dir, ['temp_sharded.lch'], ['--engine', 'loop'],
+            ['--jobs', '3'])
+        self.assertIn('temp_sharded.fix.lch', outputs)
+
+    def test_lcfix_shards(self):
+        """
+        Test that lcfix shards give the same blocks to check as the whole file
+        """
+        self.assertEqual(_shard_limits(3590, 3586 + 2 * 14336 + 5, 3586),
+                         [(3590, 17921), (17922, 32257), (32258, 32263)])
+        fname = str(Path(self.test_path) / 'BUGGY.fix_5000_5099.lch')
+        with open(fname, 'rb') as fp:
+            first_msec = [x - 2656 for x in
+                          block_times_msec(read_block_headers(fp, 0, 4))]
+        whole = _read_shard(fname, 0, 99, 4, 2656, 0, first_msec)
+        shards = [_read_shard(fname, a, b, 4, 2656, 0, first_msec)
+                  for a, b in [(0, 30), (31, 31), (32, 99)]]
+        for i in range(4):
+            self.assertEqual(whole[i].tolist(),
+                             sum([x[i].tolist() for x in shards], []))
+
+    def test_lcfix_split(self):
+        """
+        Test writing the fixed blocks to one file per period
+        """
+        fname = 'temp_split.lch'
+        _write_with_header(self, fname)
+        with LCFile(fname) as lcfile:
+            lcHeader = lcfile.header
+            start = lcHeader.dataStart
+            lcData = lcfile.getBlock(start + 40)
+        lcData.changeTime(lcData.getDateTime().replace(year=2030))
+        patches = {start + 40: lcData.packHeader()}
+        with open(fname, 'rb') as ifp1:
+            outfnames = _write_split_files(ifp1, lcHeader, start, start + 99,
+                                           patches, 'temp_split', '42', True)
+        self.assertEqual(len(outfnames), 3)
+        self.assertTrue(outfnames[1].startswith('temp_split_2030'))
+        for outfname, n_blocks in zip(outfnames, (40, 40, 20)):
+            with LCFile(outfname) as lcfile:
+                self.assertEqual(lcfile.n_blocks, start + n_blocks)
+                self.assertEqual(lcfile.header.dirCount, 1)
+                lcDir = LCDirEntry()
+                lcDir.readRecord(lcfile.directory[0])
+                self.assertEqual((lcDir.blockNumber, lcDir.numBlocks),
+                                 (start, n_blocks))
+                self.assertEqual(lcDir.getDateTime(),
+                                 lcfile.getBlock(start).getDateTime())
+        with LCFile(outfnames[1]) as lcfile:
+            self.assertEqual(lcfile.getBlock(start).getDateTime().year, 2030)
+        self.assertFalse(Path(index_filename(fname)).exists())
+        # Same files from the vector engine's arrays, without an index
+        outputs = []
+        for x in outfnames:
+            with open(x, 'rb') as fp:
+                outputs.append(fp.read())
+            Path(x).unlink()
+        with LCFile(fname) as lcfile:
+            arrays = [block_times_msec(lcfile.headers[start:start + 100]),
+                      lcfile.headers['muxChannel'][start:start + 100].copy()]
+        with open(fname, 'rb') as ifp1, \
+                mock.patch.object(LCFile, 'getIndex',
+                                  side_effect=AssertionError):
+            self.assertEqual(
+                _write_split_files(ifp1, lcHeader, start, start + 99, patches,
+                                   'temp_split', '42', True, arrays),
+                outfnames)
+        for x, output in zip(outfnames, outputs):
+            with open(x, 'rb') as fp:
+                self.assertEqual(fp.read(), output)
+        for x in outfnames:
+            Path(x).unlink()
+
     def test_lcfix_bad(self):
         """
         Test lcfix on a bad (full of time tears) file
@@ -181,6 +788,121 @@ class TestLCHEAPOMethods(unittest.TestCase):
             Path(self.test_path) / outfname)
         Path(outfname).unlink()
 
+    def test_lccut_time_window(self):
+        """
+        Test cutting a time window, in whole block groups
+        """
+        fname, outfname = 'temp_hdr.lch', 'temp_cut.lch'
+        orig = _write_with_header(self, fname)
+        with LCFile(fname) as lcfile, open(fname, 'rb') as fp:
+            start = lcfile.header.dataStart
+            # The whole file, given as a time window
+            window = time_window_blocks(lcfile,
+                                        parse_time('2019-07-20T11:13:01'),
+                                        parse_time('2019-07-20T11:14:05Z'))
+            self.assertEqual(window[:2], (start, start + 99))
+            self.assertEqual(time_window_blocks(lcfile, None, None)[:2],
+                             (start, start + 99))
+            # Times before and after the data
+            self.assertEqual(
+                time_window_blocks(lcfile, parse_time('2019-07-20T11:00'),
+                                   parse_time('2019-07-21'))[:2],
+                (start, start + 99))
+            # The second block group
+            first, last, _ = time_window_blocks(
+                lcfile, parse_time('2019-07-20T11:13:04'),
+                parse_time('2019-07-20T13:13:06+02:00'))
+            self.assertEqual((first, last), (start + 4, start + 7))
+            _write_windows(fp, [(first, last, outfname)], '.')
+            with self.assertRaises(ValueError):
+                time_window_blocks(lcfile, parse_time('2019-07-21'), None)
+        with open(outfname, 'rb') as fp:
+            self.assertEqual(fp.read(), orig[4 * 512:8 * 512])
+        with LCFile(outfname) as lcfile:
+            self.assertEqual(lcfile.getBlock(0).getDateTime(),
+                             parse_time('2019-07-20T11:13:03.528'))
+            with self.assertRaises(ValueError):
+                time_window_blocks(lcfile, None, None)
+        # Headerless files whose block 2 reads as an impossible disk header
+        for n_channels, data_start in ((0, 0), (4, 3586)):
+            block = bytearray(512)
+            struct.pack_into('>L', block, 60, data_start)
+            struct.pack_into('>H', block, 160, n_channels)
+            with open(fname, 'wb') as fp:
+                fp.write(orig[:1024] + block + orig[1536:])
+            with LCFile(fname) as lcfile:
+                self.assertEqual(lcfile.header.numberOfChannels, n_channels)
+                with self.assertRaisesRegex(ValueError, 'no disk header'):
+                    time_window_blocks(lcfile, None, None)
+        Path(outfname).unlink()
+
+    def test_lccut_windows(self):
+        """
+        Test writing several (overlapping) sections in one pass
+        """
+        self.assertEqual(_window('5', ''), (5, 0, None, None, ''))
+        self.assertEqual(_window('2019-07-20T11:13:01', '', 'x.lch'),
+                         (0, 0, '2019-07-20T11:13:01', None, 'x.lch'))
+        with self.assertRaises(ValueError):
+            _window('5', '2019-07-20T11:13:01')
+        fname = Path(self.test_path) / 'BUGGY.fix_5000_5099.lch'
+        windows = [(60, 99, 'temp_w3.lch'), (0, 9, 'temp_w1.lch'),
+                   (5, 69, 'temp_w2.lch')]
+        with open(fname, 'rb') as fp:
+            orig = fp.read()
+            _write_windows(fp, windows, '.')
+        for first, last, outfname in windows:
+            with open(outfname, 'rb') as fp:
+                self.assertEqual(fp.read(),
+                                 orig[first * 512:(last + 1) * 512])
+            Path(outfname).unlink()
+
+    def test_lccut_with_header(self):
+        """
+        Test writing a section with a disk header and directory
+        """
+        fname, outfname = 'temp_hdr.lch', 'temp_cut.lch'
+        _write_with_header(self, fname)
+        with LCFile(fname) as lcfile, open(fname, 'rb') as fp:
+            start = lcfile.header.dataStart
+            _write_windows(fp, [(start + 4, start + 99, outfname)], '.',
+                           out_block=start)
+            with open(outfname, 'r+b') as of:
+                _write_header(lcfile, of, start + 4, start + 99)
+            block_time = lcfile.getBlock(start + 4).getDateTime()
+        with LCFile(outfname) as lcfile:
+            self.assertEqual(lcfile.header.dataStart, start)
+            self.assertEqual(lcfile.header.writeBlock, start + 96)
+            self.assertEqual(lcfile.header.dirCount, 1)
+            self.assertEqual(len(lcfile.directory), 1)
+            lcDir = LCDirEntry()
+            lcDir.readRecord(lcfile.directory[0])
+            self.assertEqual((lcDir.blockNumber, lcDir.numBlocks),
+                             (start, 96))
+            self.assertEqual(lcDir.getDateTime(), block_time)
+        with open(outfname, 'rb') as fp1, open(fname, 'rb') as fp2:
+            fp1.seek(start * 512)
+            fp2.seek((start + 4) * 512)
+            self.assertEqual(fp1.read(), fp2.read())
+        Path(outfname).unlink()
+
+    def test_lccut_with_header_no_header(self):
+        """
+        Test that --with-header refuses a file without a disk header
+        """
+        out_dir = Path('temp_cut_dir')
+        out_dir.mkdir()
+        self.addCleanup(shutil.rmtree, out_dir)
+        argv = ['lccut', '-i', str(self.test_path), '-o', str(out_dir),
+                'BUGGY.fix_5000_5099.lch', '--start', '4', '--end', '99',
+                '--with-header']
+        with mock.patch.object(sys, 'argv', argv), \
+                redirect_stdout(io.StringIO()) as out:
+            lccut.main()
+        self.assertIn('has no disk header', out.getvalue())
+        self.assertEqual([x.name for x in out_dir.iterdir()],
+                         ['process-steps.json'])
+
     def test_lcinfo(self):
         """
         Test lcinfo
@@ -195,6 +917,133 @@ class TestLCHEAPOMethods(unittest.TestCase):
             str(Path(self.test_path) / 'BUGGY.info.txt'))
         Path('temp').unlink()
 
+    def test_lcinfo_records(self):
+        """
+        Test lcinfo's per-file records
+        """
+        fname = 'temp_info.lch'
+        _write_with_header(self, fname)
+        info = _get_file_Info(fname)
+        self.assertEqual({x: info[x] for x in ('has_header', 'n_channels',
+                                               'data_start', 'n_data_blocks')},
+                         {'has_header': True, 'n_channels': 4,
+                          'data_start': 3586, 'n_data_blocks': 100})
+        with LCFile(fname) as lcfile:
+            self.assertEqual(info['start_time'],
+                             lcfile.getBlock(3586).getDateTime())
+        info = _get_file_Info(str(Path(self.test_path)
+                                  / 'BUGGY.fix_5000_5099.lch'))
+        self.assertEqual(info, {'has_header': False, 'n_blocks': 100})
+        self.assertIn('error', _get_file_Info('temp_missing.lch'))
+
+    def test_lcinfo_cache(self):
+        """
+        Test lcinfo's information cache
+        """
+        cache_file, fname = 'temp_cache.jsonl', 'temp_cached.lch'
+        _write_with_header(self, fname)
+        info = _get_file_Info(fname, cache=_InfoCache(cache_file))
+        cache = _InfoCache(cache_file)
+        self.assertEqual(cache.get(fname, os.stat(fname)), None)  # Not saved
+        cache = _InfoCache(cache_file, max_entries=1)
+        _get_file_Info(fname, cache=cache)
+        cache.put('temp_other.lch', os.stat(fname), {})
+        self.assertTrue(cache.save())
+        cache = _InfoCache(cache_file)
+        self.assertEqual(list(cache.entries),    # Least recently used dropped
+                         [os.path.abspath('temp_other.lch')])
+        _get_file_Info(fname, cache=cache)
+        cache.save()
+        cache = _InfoCache(cache_file)
+        self.assertEqual(cache.get(fname, os.stat(fname)), info)
+        self.assertEqual(info['header']['numberOfChannels'], 4)
+        self.assertIsNone(_InfoCache(cache_file, refresh=True).get(
+            fname, os.stat(fname)))
+        with open(fname, 'ab') as fp:
+            fp.write(bytes(512))
+        self.assertIsNone(cache.get(fname, os.stat(fname)))
+        Path(cache_file).unlink()
+
+    def test_lcinfo_stats(self):
+        """
+        Test lcinfo's channel statistics against the full data
+        """
+        fname = 'temp_stats.lch'
+        _write_with_header(self, fname)
+        with open(fname, 'r+b') as fp:
+            # Zero the samples of channel 0's 2nd and 3rd blocks
+            for block in (3590, 3594):
+                fp.seek(block * 512 + 14)
+                fp.write(bytes(498))
+        stats = _get_file_Info(fname, stats=True)['stats']
+        self.assertEqual(stats[0]['n_zero_blocks'], 2)
+        self.assertGreaterEqual(stats[0]['longest_constant'], 332)
+        with LCFile(fname) as lcfile:
+            # Small chunks, to check the runs continued across chunks
+            for x, y in zip(_get_stats(lcfile, 4, 3586, 100, chunk_blocks=8),
+                            stats):
+                self.assertAlmostEqual(x.pop('rms'), y['rms'])
+                self.assertAlmostEqual(x.pop('mean'), y['mean'])
+                self.assertEqual(x, {k: y[k] for k in x})
+            samples = blocks_to_int32(lcfile.blocks[3586:3686])
+        for channel, x in enumerate(stats):
+            y = samples[channel::4].ravel()
+            changes = np.flatnonzero(np.diff(y)) + 1
+            runs = np.diff(np.r_[0, changes, len(y)])
+            self.assertEqual(x['n_samples'], len(y))
+            self.assertEqual((x['min'], x['max']), (y.min(), y.max()))
+            self.assertAlmostEqual(x['mean'], y.mean())
+            self.assertAlmostEqual(x['rms'], np.sqrt(np.mean(y**2.)))
+            self.assertEqual(x['longest_constant'], runs.max())
+            self.assertEqual(x['n_clipped'], np.sum(np.abs(y + 0.5) > 2**23-1))
+            self.assertEqual(x['n_zero_blocks'],
+                             np.sum(~samples[channel::4].any(axis=1)))
+
+    def test_lcinfo_timeline(self):
+        """
+        Test lcinfo's segments and station timeline
+        """
+        with open(Path(self.test_path) / 'BUGGY.fix_5000_5099.lch',
+                  'rb') as fp:
+            data = fp.read()
+        # Overlap of 2 block groups between a and b, gap of 2 between b and
+        # c, time tear inside d, which also has a BUG1 (channel 0 block 5)
+        # and a BUG2 (channel 0 block 15)
+        d = bytearray(data[:40 * 512] + data[48 * 512:])
+        d[20 * 512 + 2] = (d[20 * 512 + 2] + 1) % 60
+        d[60 * 512 + 4] = (d[60 * 512 + 4] + 1) % 24
+        parts = {'temp_a.lch': data[:40 * 512],
+                 'temp_b.lch': data[32 * 512:80 * 512],
+                 'temp_c.lch': data[88 * 512:],
+                 'temp_d.lch': bytes(d)}
+        for fname, x in parts.items():
+            _write_with_header(self, fname, x)
+        with LCFile('temp_d.lch') as lcfile:
+            segments = _get_segments(lcfile, 4, 62.5, 3586, 92,
+                                     chunk_blocks=8)
+        self.assertEqual([(x['first_block'], x['last_block'], x['n_samples'])
+                          for x in segments],
+                         [(3586, 3625, 10 * 166), (3626, 3677, 13 * 166)])
+        self.assertEqual(segments[1]['start_msec'] - segments[0]['end_msec'],
+                         2 * 2656)
+        infos = []
+        for fname in parts:
+            infos.append(_get_file_Info(fname, segments=True))
+            infos[-1]['filename'] = fname
+        # Same segments from the index
+        self.assertEqual(_get_file_Info('temp_d.lch', build_index=True,
+                                        segments=True)['segments'], segments)
+        station, = _get_timeline(infos[:3])
+        self.assertEqual(station['n_samples'], 23 * 166)
+        self.assertEqual([(x['n_samples'], x['files'])
+                          for x in station['gaps']],
+                         [(332, ['temp_b.lch', 'temp_c.lch'])])
+        self.assertEqual([(x['n_samples'], x['files'])
+                          for x in station['overlaps']],
+                         [(332, ['temp_a.lch', 'temp_b.lch'])])
+        self.assertEqual(len(_get_timeline(infos)[0]['overlaps']), 4)
+        Path(index_filename('temp_d.lch')).unlink()
+
     def test_lcheader(self):
         """
         Test lcheader